@@ -2,4 +2,5 @@
 # .render-build.sh
 
 python manage.py collectstatic --noinput
-python manage.py migrate
\ No newline at end of file
+# Default and every shard in DATABASE_SHARD_URLS
+python manage.py migrate_shards
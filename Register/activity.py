@@ -0,0 +1,158 @@
+"""Activity log: an append-only history of todo and folder changes.
+
+Write paths call ``record``. Once the surrounding transaction commits the
+entry goes into a per-process buffer instead of the database, and a
+background thread writes the buffer with one multi-row INSERT whenever
+``ACTIVITY_FLUSH_SIZE`` entries are waiting or ``ACTIVITY_FLUSH_INTERVAL``
+seconds have passed. A request never waits on the activity table. Each
+entry is written to the shard of the request that recorded it.
+
+The buffer holds at most ``ACTIVITY_BUFFER_SIZE`` entries. When the
+database falls that far behind new entries are dropped rather than growing
+the worker's memory, and counted in ``activity_dropped_total``; so is a
+batch whose INSERT fails. Entries still buffered when a worker exits are
+flushed on the way out, but one killed outright loses up to a batch.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, transaction
+from django.utils import timezone
+
+from . import metrics, sharding
+from .models import Activity
+
+logger = logging.getLogger(__name__)
+
+# Never copied into the log, only noted as changed
+SECRET_FIELDS = {'password'}
+REDACTED = '[redacted]'
+
+
+def diff(instance, changes):
+    """``{field: [old, new]}`` for ``changes`` about to be saved on ``instance``."""
+    return {
+        name: [REDACTED, REDACTED] if name in SECRET_FIELDS else [getattr(instance, name), value]
+        for name, value in changes.items()
+    }
+
+
+class ActivityBuffer:
+    def __init__(self, max_size, flush_size, flush_interval, background=True):
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        # Without the thread entries are only written by explicit flush() calls
+        self.background = background
+        self._reset()
+
+    def _reset(self):
+        self._entries = deque()
+        self._lock = threading.Lock()
+        # Held for a whole flush so batches are written one at a time
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = os.getpid()
+
+    def append(self, entry, using=DEFAULT_DB_ALIAS):
+        """Queue ``entry`` for the ``using`` shard; False when it was dropped."""
+        if self._pid != os.getpid():
+            # Forked from a process that had already started: the thread
+            # and the parent's entries didn't come along
+            self._reset()
+        with self._lock:
+            if len(self._entries) >= self.max_size:
+                metrics.increment('activity_dropped_total', reason='full')
+                return False
+            self._entries.append((using, entry))
+            full = len(self._entries) >= self.flush_size
+            if self._thread is None and self.background:
+                self._thread = threading.Thread(target=self._run, name='activity-flush', daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+        return True
+
+    def __len__(self):
+        return len(self._entries)
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of rows written."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._entries.popleft() for _ in range(min(self.flush_size, len(self._entries)))]
+                if not batch:
+                    return written
+                shards = defaultdict(list)
+                for using, entry in batch:
+                    shards[using].append(entry)
+                failed = False
+                for using, entries in shards.items():
+                    try:
+                        Activity.objects.using(using).bulk_create(entries)
+                    except Exception:
+                        logger.exception('Dropped %d activity entries for %s', len(entries), using)
+                        metrics.increment('activity_dropped_total', len(entries), reason='error')
+                        failed = True
+                        continue
+                    written += len(entries)
+                    metrics.increment('activity_flushed_total', len(entries))
+                if failed:
+                    # Leave the rest for the next tick rather than dropping it too
+                    return written
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            # The thread keeps its own connection; respect CONN_MAX_AGE and
+            # drop it after errors like a request would
+            close_old_connections()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = ActivityBuffer(
+                    getattr(settings, 'ACTIVITY_BUFFER_SIZE', 10000),
+                    getattr(settings, 'ACTIVITY_FLUSH_SIZE', 200),
+                    getattr(settings, 'ACTIVITY_FLUSH_INTERVAL', 2.0),
+                )
+                atexit.register(flush)
+    return _buffer
+
+
+def record(user_id, action, object_type, object_id, changes=None):
+    """Log ``action`` on an object once the current transaction commits."""
+    entry = Activity(
+        user_id=user_id,
+        action=action,
+        object_type=object_type,
+        object_id=object_id,
+        changes=changes or {},
+        created_at=timezone.now(),
+    )
+    using = sharding.current()
+    transaction.on_commit(lambda: get_buffer().append(entry, using), using=using)
+
+
+def flush():
+    """Write the buffered entries now (at exit, and in tests and benchmarks)."""
+    return get_buffer().flush() if _buffer is not None else 0
@@ -1,12 +1,299 @@
-from django.contrib import admin
+import json
+from collections import defaultdict
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser, Todo, TodoFolder
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import F, Q
+from django.http import QueryDict
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from . import activity, sharding
+from .archive import archive_todos
+from .events import publish_event
+from .models import OPEN_TODOS, CustomUser, Todo, TodoClosure, TodoFolder
+from .recurrence import materialize_next
+from .views import _todo_event_data
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that uses the PostgreSQL planner's row estimate for big lists.
+
+    An exact COUNT(*) over millions of rows takes seconds; below
+    EXACT_COUNT_LIMIT (and on other databases) the exact count is used.
+    """
+
+    EXACT_COUNT_LIMIT = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return super().count
+        if queryset.query.is_empty():
+            return 0
+
+        try:
+            sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+        except EmptyResultSet:
+            # Filters that can never match, e.g. pk__in=[]
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = int(plan[0]['Plan']['Plan Rows'])
+        return super().count if estimate < self.EXACT_COUNT_LIMIT else estimate
+
+
+MAX_ID = 2 ** 63 - 1
+
+
+class ScalableAdminMixin:
+    paginator = EstimatedCountPaginator
+    # Skip the second, unfiltered COUNT(*) shown next to filtered results
+    show_full_result_count = False
+    search_help_text = "Search by id or by the owner's exact email"
+
+    def get_search_results(self, request, queryset, search_term):
+        # Only lookups that hit an index: the primary key or the unique email
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.isascii() and term.isdigit():
+            # Ids beyond bigint can't exist and would fail in the database
+            if int(term) > MAX_ID:
+                return queryset.none(), False
+            return queryset.filter(pk=int(term)), False
+        if '@' in term:
+            return queryset.filter(user__email=term), False
+        return queryset.none(), False
+
+    def save_model(self, request, obj, form, change):
+        # Edits made here invalidate the version API clients hold
+        if change:
+            obj.version += 1
+        super().save_model(request, obj, form, change)
+
+
+class ShardFilter(admin.SimpleListFilter):
+    """Which shard's rows the list shows; ShardedAdminMixin activates it."""
+
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in sharding.shards()]
+
+    def choices(self, changelist):
+        # No "All": one list can only read one database
+        selected = self.value() or DEFAULT_DB_ALIAS
+        for value, title in self.lookup_choices:
+            yield {
+                'selected': value == selected,
+                'query_string': changelist.get_query_string({self.parameter_name: value}),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        return queryset
+
+
+class ShardedModelForm(forms.ModelForm):
+    def clean(self):
+        cleaned_data = super().clean()
+        user = cleaned_data.get('user')
+        if user is not None:
+            alias, moving = sharding.lookup(user.id)
+            if moving:
+                raise forms.ValidationError(f'{user.email} is being moved between shards; try again later.')
+            if alias != sharding.current():
+                raise forms.ValidationError(f"{user.email}'s data is on shard '{alias}'; pick it in the shard filter first.")
+        return cleaned_data
+
+
+class ShardedAdminMixin:
+    """Read and change one shard at a time, picked with ShardFilter.
+
+    The shard is active for the whole view, rendering included, so lists,
+    forms, deletes and the actions all hit the same database.
+    """
+    form = ShardedModelForm
+
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        if len(sharding.shards()) > 1:
+            return (ShardFilter, *list_filter)
+        return list_filter
+
+    def admin_shard(self, request):
+        alias = request.GET.get(ShardFilter.parameter_name)
+        if alias is None:
+            # Add, change and delete pages carry the list's filters along
+            filters = QueryDict(request.GET.get('_changelist_filters', ''))
+            alias = filters.get(ShardFilter.parameter_name)
+        return alias if alias in sharding.shards() else DEFAULT_DB_ALIAS
+
+    def _on_shard(self, view, request, *args, **kwargs):
+        with sharding.use(self.admin_shard(request)):
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            return response
+
+    def changelist_view(self, request, extra_context=None):
+        return self._on_shard(super().changelist_view, request, extra_context)
+
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        return self._on_shard(super().changeform_view, request, object_id, form_url, extra_context)
+
+    def delete_view(self, request, object_id, extra_context=None):
+        return self._on_shard(super().delete_view, request, object_id, extra_context)
+
+    def history_view(self, request, object_id, extra_context=None):
+        return self._on_shard(super().history_view, request, object_id, extra_context)
+
 
 class CustomUserAdmin(UserAdmin):
     list_display = ('email', 'username', 'phone', 'is_staff')
     search_fields = ('email', 'username')
     ordering = ('email',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    # The database cascade only reaches default; the user's shard goes first
+
+    def has_delete_permission(self, request, obj=None):
+        if obj is not None and sharding.lookup(obj.id)[1]:
+            return False
+        return super().has_delete_permission(request, obj)
+
+    def delete_model(self, request, obj):
+        sharding.delete_user_data(obj)
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        moving = queryset.filter(shard_entry__moving=True)
+        if moving.exists():
+            self.message_user(
+                request, f'Skipped {moving.count()} users being moved between shards.', messages.WARNING
+            )
+            queryset = queryset.exclude(id__in=moving.values('id'))
+        for user in queryset:
+            sharding.delete_user_data(user)
+        super().delete_queryset(request, queryset)
+
+
+class TodoFolderAdmin(ShardedAdminMixin, ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'name', 'user', 'locked', 'priority', 'pending_deletion', 'updated_at')
+    # __str__ reads the owner's username
+    list_select_related = ('user',)
+    list_filter = ('locked', 'pending_deletion', 'priority')
+    raw_id_fields = ('user',)
+    search_fields = ('id', 'user__email')
+    ordering = ('-id',)
+    readonly_fields = ('password', 'version', 'created_at', 'updated_at')
+
+
+class TodoActionForm(ActionForm):
+    folder = forms.IntegerField(required=False, label='Target folder id')
+
+
+class TodoAdmin(ShardedAdminMixin, ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'title', 'user', 'folder_name', 'status', 'priority', 'due_date', 'completed', 'updated_at')
+    list_select_related = ('user', 'folder')
+    # due_date and completed are served by todo_due_date_completed_idx
+    list_filter = (('due_date', admin.DateFieldListFilter), 'completed', 'status', 'priority')
+    raw_id_fields = ('user', 'folder', 'recurrence')
+    search_fields = ('id', 'user__email')
+    ordering = ('-id',)
+    # parent is only changed through the API, which keeps TodoClosure in sync
+    readonly_fields = ('parent', 'version', 'created_at', 'updated_at')
+    action_form = TodoActionForm
+    actions = ('mark_completed', 'move_to_folder', 'archive_completed')
+
+    @admin.display(description='Folder', ordering='folder__name')
+    def folder_name(self, todo):
+        return todo.folder.name if todo.folder else None
+
+    # The actions below are single set-based statements (or batched moves),
+    # so "select all" over a large filtered list stays cheap
+
+    @admin.action(description='Mark selected todos as completed')
+    def mark_completed(self, request, queryset):
+        todos = queryset.filter(OPEN_TODOS)
+        with transaction.atomic(using=sharding.current()):
+            recurring = list(todos.filter(recurrence__isnull=False))
+            completed = list(todos.values_list('id', 'user_id', 'status'))
+            updated = todos.update(
+                completed=True, status='completed', version=F('version') + 1, updated_at=timezone.now()
+            )
+            # Recurring todos go on as when completed through the API
+            next_todos = []
+            for todo in recurring:
+                todo.completed, todo.status = True, 'completed'
+                next_todo = materialize_next(todo)
+                if next_todo is not None:
+                    next_todos.append(next_todo)
+
+            ids_by_user = defaultdict(list)
+            for todo_id, user_id, status in completed:
+                ids_by_user[user_id].append(todo_id)
+                activity.record(user_id, 'todo.updated', 'todo', todo_id, {
+                    'completed': [False, True], 'status': [status, 'completed']
+                })
+            for user_id, todo_ids in ids_by_user.items():
+                publish_event(user_id, 'todos.completed', {'todo_ids': todo_ids})
+            for todo in next_todos:
+                publish_event(todo.user_id, 'todo.created', _todo_event_data(todo))
+                activity.record(todo.user_id, 'todo.created', 'todo', todo.id, {
+                    'title': todo.title, 'folder_id': todo.folder_id, 'recurrence_id': todo.recurrence_id
+                })
+
+        message = f'Marked {updated} todos as completed.'
+        if next_todos:
+            message += f' Created the next occurrence of {len(next_todos)} recurring todos.'
+        self.message_user(request, message, messages.SUCCESS)
+
+    @admin.action(description='Move selected todos to the folder id given above')
+    def move_to_folder(self, request, queryset):
+        try:
+            folder = TodoFolder.objects.get(id=int(request.POST.get('folder')))
+        except (TypeError, ValueError, TodoFolder.DoesNotExist):
+            self.message_user(request, 'Enter an existing target folder id.', messages.ERROR)
+            return
+        # Subtasks live in their parent's folder: only top-level todos move,
+        # taking their whole branch along
+        subtask_count = queryset.filter(parent__isnull=False).count()
+        # Todos can only live in their owner's folders
+        roots = queryset.filter(user_id=folder.user_id, parent__isnull=True).values('id')
+        branches = TodoClosure.objects.filter(ancestor_id__in=roots).values('descendant_id')
+        moved = Todo.objects.filter(Q(id__in=roots) | Q(id__in=branches)).update(
+            folder=folder, version=F('version') + 1, updated_at=timezone.now()
+        )
+        self.message_user(
+            request, f"Moved {moved} todos to '{folder.name}', subtasks included (only its owner's todos can be moved there).",
+            messages.SUCCESS
+        )
+        if subtask_count:
+            self.message_user(
+                request, f'Skipped {subtask_count} subtasks; they stay with their parent. Move the top-level todo instead.',
+                messages.WARNING
+            )
+
+    @admin.action(description='Archive selected completed todos')
+    def archive_completed(self, request, queryset):
+        archived = archive_todos(queryset)
+        self.message_user(request, f'Archived {archived} completed todos; open todos were left in place.', messages.SUCCESS)
+
 
 admin.site.register(CustomUser, CustomUserAdmin)
-admin.site.register(Todo)
-admin.site.register(TodoFolder)
\ No newline at end of file
+admin.site.register(Todo, TodoAdmin)
+admin.site.register(TodoFolder, TodoFolderAdmin)
@@ -0,0 +1,111 @@
+"""Per-day agenda of a user's todos for calendar views.
+
+One grouped query over ``(user, due_date)`` returns, for every day in the
+window that has todos, the counts by status and priority and the day's todo
+ids (or compact rows), aggregated into a JSON array by the database.
+
+``due_date`` is a plain date, so nothing is converted between time zones
+in SQL. Only "today", the default start of the window, depends on the time
+zone: the active one (``TIME_ZONE`` with ``USE_TZ``) unless the client
+names its own.
+"""
+import zoneinfo
+from datetime import timedelta
+
+from django.db.models import Aggregate, Count, F, JSONField, Q
+from django.db.models.functions import JSONObject
+from django.utils import timezone
+
+from .models import PRIORITY_NAMES, Todo
+
+MAX_DAYS = 366
+DEFAULT_DAYS = 7
+INCLUDE_MODES = ('ids', 'rows', 'none')
+
+STATUSES = [value for value, _ in Todo.STATUS_CHOICES]
+PRIORITIES = [value for value, _ in Todo.PRIORITY_CHOICES]
+DONE = Q(completed=True) | Q(status='completed')
+
+ROW_FIELDS = ('id', 'folder_id', 'parent_id', 'title', 'status', 'priority', 'completed')
+
+
+class AgendaError(ValueError):
+    pass
+
+
+class JSONArrayAgg(Aggregate):
+    """The group's values as a JSON array, in no particular order."""
+
+    function = 'JSON_GROUP_ARRAY'
+    output_field = JSONField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        # jsonb, not JSON_AGG's json: psycopg2 already decodes json columns,
+        # and JSONField would then try to decode the list again
+        return self.as_sql(compiler, connection, function='JSONB_AGG', **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, function='JSON_ARRAYAGG', **extra_context)
+
+
+def today(tz_name=None):
+    """Today's date in ``tz_name``, or in the active time zone."""
+    if not tz_name:
+        return timezone.localdate()
+    try:
+        return timezone.localdate(timezone=zoneinfo.ZoneInfo(tz_name))
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        raise AgendaError(f"Unknown time zone '{tz_name}'")
+
+
+def window(start, end, tz_name=None):
+    """``(start, end)`` of the agenda, defaulting to the week from today."""
+    start = start or today(tz_name)
+    end = end or start + timedelta(days=DEFAULT_DAYS - 1)
+    if end < start:
+        raise AgendaError('end must not be before start')
+    if (end - start).days >= MAX_DAYS:
+        raise AgendaError(f'The window can span at most {MAX_DAYS} days')
+    return start, end
+
+
+def agenda(user, start, end, include='ids'):
+    """Days between ``start`` and ``end`` (inclusive) that have todos due."""
+    counts = {f'status_{status}': Count('id', filter=Q(status=status)) for status in STATUSES}
+    counts.update({f'priority_{priority}': Count('id', filter=Q(priority=priority)) for priority in PRIORITIES})
+    if include == 'ids':
+        counts['todos'] = JSONArrayAgg('id')
+    elif include == 'rows':
+        counts['todos'] = JSONArrayAgg(JSONObject(**{field: F(field) for field in ROW_FIELDS}))
+
+    rows = (
+        Todo.objects.filter(user=user, due_date__gte=start, due_date__lte=end)
+        .exclude(folder__pending_deletion=True)
+        .values('due_date')
+        .annotate(total=Count('id'), done=Count('id', filter=DONE), **counts)
+        .order_by('due_date')
+    )
+
+    days = []
+    for row in rows:
+        day = {
+            'date': row['due_date'].strftime('%Y-%m-%d'),
+            'total': row['total'],
+            'done': row['done'],
+            'by_status': {status: row[f'status_{status}'] for status in STATUSES},
+            'by_priority': {priority: row[f'priority_{priority}'] for priority in PRIORITIES},
+        }
+        if include == 'ids':
+            day['todo_ids'] = sorted(row['todos'])
+        elif include == 'rows':
+            # Inside JSON the columns come back raw: SQLite's booleans as 0/1
+            # and priorities as their stored numbers
+            day['todos'] = sorted(
+                (
+                    {**todo, 'completed': bool(todo['completed']), 'priority': PRIORITY_NAMES[todo['priority']]}
+                    for todo in row['todos']
+                ),
+                key=lambda todo: todo['id']
+            )
+        days.append(day)
+    return days
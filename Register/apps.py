@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class RegisterConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Register'
+
+    def ready(self):
+        from .sharding import reserve_id_ranges_after_migrate
+
+        post_migrate.connect(reserve_id_ranges_after_migrate, sender=self)
@@ -0,0 +1,74 @@
+"""Hot/cold split for completed todos.
+
+Completed todos untouched for a while are moved from Todo into ArchivedTodo
+so the per-user list queries and indexes on the hot table stay small.
+Todos that still have subtasks stay in the hot table: deleting them there
+would delete their subtasks too. So does a todo whose id is already taken
+in ArchivedTodo, which archiving it would overwrite or lose.
+"""
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from . import sharding
+from .models import ARCHIVABLE_TODOS, ArchivedTodo, Todo
+
+# Columns copied verbatim between the two tables
+ARCHIVED_FIELDS = [
+    'id', 'user_id', 'folder_id', 'title', 'description', 'status', 'priority',
+    'due_date', 'completed', 'position', 'created_at', 'updated_at',
+]
+
+
+def _archivable(todos):
+    return todos.filter(ARCHIVABLE_TODOS).exclude(
+        Exists(Todo.objects.filter(parent=OuterRef('pk'))) | Exists(ArchivedTodo.objects.filter(id=OuterRef('pk')))
+    )
+
+
+def _move_batch(todos, batch_size):
+    with transaction.atomic(using=sharding.current()):
+        batch = list(todos.select_for_update(skip_locked=True).values(*ARCHIVED_FIELDS)[:batch_size])
+        if not batch:
+            return 0
+        # Conflicting ids were filtered out; any other failure rolls back
+        # before a hot row is deleted
+        ArchivedTodo.objects.bulk_create([ArchivedTodo(**row) for row in batch], batch_size=batch_size)
+        Todo.objects.filter(id__in=[row['id'] for row in batch]).delete()
+    return len(batch)
+
+
+def archive_batch(cutoff, batch_size=1000):
+    """Move up to ``batch_size`` completed todos last updated before ``cutoff``.
+
+    Returns the number of todos moved; 0 means nothing is left to archive.
+    """
+    return _move_batch(
+        _archivable(Todo.objects.filter(updated_at__lt=cutoff)).order_by('updated_at'), batch_size
+    )
+
+
+def archive_todos(todos, batch_size=1000):
+    """Archive the completed todos in the ``todos`` queryset, in batches.
+
+    Open todos and todos with subtasks are left alone. Returns the number moved.
+    """
+    todos = _archivable(todos).order_by('id')
+    moved = 0
+    while True:
+        count = _move_batch(todos, batch_size)
+        if not count:
+            return moved
+        moved += count
+
+
+def restore(archived):
+    """Move one archived todo back into the hot table, keeping its id."""
+    with transaction.atomic(using=sharding.current()):
+        values = {field: getattr(archived, field) for field in ARCHIVED_FIELDS}
+        todo = Todo.objects.create(**values)
+        # auto_now_add/auto_now overwrite the timestamps on insert
+        Todo.objects.filter(id=todo.id).update(created_at=values['created_at'], updated_at=timezone.now())
+        archived.delete()
+    todo.refresh_from_db()
+    return todo
@@ -0,0 +1,130 @@
+"""In-process dispatch of batched API calls (``POST auth/batch/``).
+
+Each sub-request is turned into an HttpRequest and handed straight to the
+resolved Register view, so a screen that needs a dozen calls pays for one
+round trip and one authentication.
+"""
+import io
+import json
+from urllib.parse import urlsplit
+
+from django.db import transaction
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+
+from . import sharding
+
+MAX_REQUESTS = 50
+METHODS = ('GET', 'POST', 'PUT', 'DELETE')
+
+# Batching these would nest batches, hold the response open or stream a
+# body that isn't JSON
+EXCLUDED_URL_NAMES = {'batch', 'events', 'export-data', 'import-data'}
+
+
+class BatchError(ValueError):
+    pass
+
+
+def clean_batch(data):
+    """Validate the payload; returns ``(sub_requests, atomic)``."""
+    if not isinstance(data, dict):
+        raise BatchError('Request body must be an object')
+    sub_requests = data.get('requests')
+    if not isinstance(sub_requests, list) or not sub_requests:
+        raise BatchError('requests must be a non-empty list')
+    if len(sub_requests) > MAX_REQUESTS:
+        raise BatchError(f'A batch can hold at most {MAX_REQUESTS} requests')
+
+    cleaned = []
+    for index, sub in enumerate(sub_requests):
+        if not isinstance(sub, dict) or not isinstance(sub.get('path'), str):
+            raise BatchError(f'requests[{index}] needs a path')
+        method = str(sub.get('method', 'GET')).upper()
+        if method not in METHODS:
+            raise BatchError(f"requests[{index}].method must be one of: {', '.join(METHODS)}")
+        cleaned.append({
+            'id': sub.get('id', index),
+            'method': method,
+            'path': sub['path'],
+            'body': sub.get('body'),
+        })
+    return cleaned, bool(data.get('atomic', False))
+
+
+def _subrequest(parent, user, method, path, body):
+    url = urlsplit(path)
+    request = HttpRequest()
+    request.method = method
+    request.path = request.path_info = url.path
+    request.GET = QueryDict(url.query)
+    # The batch's own Idempotency-Key and If-Match cover the whole batch,
+    # not each part; sub-requests send their version in the body
+    request.META = {
+        key: value for key, value in parent.META.items()
+        if (key.startswith('HTTP_') and key not in ('HTTP_IDEMPOTENCY_KEY', 'HTTP_IF_MATCH'))
+        or key in ('REMOTE_ADDR', 'SERVER_NAME', 'SERVER_PORT')
+    }
+    request.META.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'CONTENT_TYPE': 'application/json',
+    })
+    raw = json.dumps(body).encode() if body is not None else b''
+    request.META['CONTENT_LENGTH'] = str(len(raw))
+    request._body = raw
+    request._stream = io.BytesIO(raw)
+    request.authenticated_user = user
+    return request
+
+
+def _dispatch(parent, user, sub):
+    try:
+        match = resolve(urlsplit(sub['path']).path)
+    except Resolver404:
+        return 404, {'error': 'Not found'}
+    if match.url_name in EXCLUDED_URL_NAMES or match.func.__module__ != 'Register.views':
+        return 400, {'error': 'This endpoint cannot be batched'}
+
+    request = _subrequest(parent, user, sub['method'], sub['path'], sub['body'])
+    try:
+        response = match.func(request, *match.args, **match.kwargs)
+    except Exception as e:
+        return 500, {'error': str(e)}
+    if response.streaming:
+        return 400, {'error': 'This endpoint cannot be batched'}
+    try:
+        content = json.loads(response.content) if response.content else None
+    except ValueError:
+        content = response.content.decode(errors='replace')
+    return response.status_code, content
+
+
+def run_batch(parent, user, sub_requests, atomic=False):
+    """Run the sub-requests in order.
+
+    With ``atomic`` they share one transaction: the first response with a
+    4xx/5xx status rolls everything back and the remaining sub-requests are
+    skipped. Returns ``(responses, rolled_back)``.
+    """
+    responses = []
+    if not atomic:
+        for sub in sub_requests:
+            status, body = _dispatch(parent, user, sub)
+            responses.append({'id': sub['id'], 'status': status, 'body': body})
+        return responses, False
+
+    rolled_back = False
+    with transaction.atomic(using=sharding.current()):
+        for sub in sub_requests:
+            status, body = _dispatch(parent, user, sub)
+            responses.append({'id': sub['id'], 'status': status, 'body': body})
+            if status >= 400:
+                transaction.set_rollback(True, using=sharding.current())
+                rolled_back = True
+                break
+
+    for sub in sub_requests[len(responses):]:
+        responses.append({'id': sub['id'], 'status': 424, 'body': {'error': 'Skipped after an earlier failure'}})
+    return responses, rolled_back
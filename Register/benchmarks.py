@@ -0,0 +1,450 @@
+"""Micro-benchmarks for the Register app.
+
+Run them with ``python manage.py benchmark [name ...]``. Benchmarks that need
+rows create them inside a transaction that is rolled back afterwards.
+"""
+import os
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+
+from .exporting import stream_export
+from .importing import import_records
+
+from .folder_lock import (
+    check_folder_password,
+    check_unlock_token,
+    hash_folder_password,
+    make_unlock_token,
+)
+from .activity import ActivityBuffer
+from .agenda import agenda
+from .models import (
+    NEXT_UP_ORDER, OPEN_TODOS, PRIORITY_RANKS, Activity, CustomUser, RecurrenceRule, Tag, Todo, TodoFolder, TodoTag
+)
+from .ratelimit import CacheBuckets, LocalBuckets, parse_rate
+from .recurrence import expand_for_user
+from .tagging import filter_by_tags
+from .tokens import issue_tokens
+from .views import authenticate_request, todos as todo_list_view
+
+BENCHMARKS = {}
+
+
+class Reporter:
+    """Formats benchmark results for the ``benchmark`` management command."""
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+
+    def timing(self, label, seconds, unit='op'):
+        self.stdout.write(f'  {label:<40} {seconds * 1e6:>14.2f} us/{unit}')
+
+    def rate(self, label, count, seconds, unit='rows'):
+        self.stdout.write(f'  {label:<40} {count / seconds:>14.0f} {unit}/s')
+
+    def value(self, label, text):
+        self.stdout.write(f'  {label:<40} {text:>14}')
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+@contextmanager
+def rolled_back():
+    """Run the block in a transaction that is always rolled back."""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def seed_user(todo_count, folder_count=1, description=''):
+    """Create a throwaway user with ``todo_count`` todos spread over folders."""
+    user = CustomUser.objects.create_user(email=f'bench-{uuid.uuid4().hex}@example.com', username='bench')
+    folders = TodoFolder.objects.bulk_create([
+        TodoFolder(user=user, user_folder_id=i + 1, name=f'Folder {i + 1}') for i in range(folder_count)
+    ])
+    Todo.objects.bulk_create(
+        (Todo(user=user, folder=folders[i % folder_count], title=f'Todo {i}', description=description)
+         for i in range(todo_count)),
+        batch_size=2000,
+    )
+    return user
+
+
+def peak_memory(func):
+    """Peak bytes traced while running ``func``.
+
+    Kept separate from timing runs because tracemalloc slows allocation down.
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def per_call(func, number, repeat=3):
+    """Best-of-``repeat`` seconds per call of ``func``."""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+# Total ``python -X importtime`` time for importing the ASGI app, which is
+# what every worker pays without --preload and every management command
+# pays in part. About 250 ms on a developer laptop at the time of writing;
+# the headroom absorbs slower machines, not new heavy imports. Checked by
+# ``manage.py benchmark startup``, which exits non-zero when it is exceeded.
+IMPORT_TIME_BUDGET = 0.45
+
+
+def measure_imports(code='import project1.asgi'):
+    """Run ``code`` in a fresh interpreter under ``-X importtime``.
+
+    Returns ``(total_seconds, modules)`` where ``modules`` maps each imported
+    module to ``(nesting depth, cumulative seconds)``.
+    """
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'project1.settings')}
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    total, modules = 0.0, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        _, cumulative, name = line.split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules[name.strip()] = (depth, int(cumulative) / 1e6)
+        if depth == 0:
+            total += int(cumulative) / 1e6
+    return total, modules
+
+
+@benchmark
+def folder_password(out):
+    folder = SimpleNamespace(id=1, password=hash_folder_password('s3cret-folder'))
+    user = SimpleNamespace(id=1)
+    plaintext = 's3cret-folder'
+    token = make_unlock_token(folder, user)
+
+    out.timing('plaintext compare', per_call(lambda: constant_time_compare('s3cret-folder', plaintext), 100000))
+    out.timing('hash password', per_call(lambda: hash_folder_password('s3cret-folder'), 3))
+    out.timing('verify hashed password', per_call(lambda: check_folder_password(folder, 's3cret-folder'), 3))
+    out.timing('issue unlock token', per_call(lambda: make_unlock_token(folder, user), 10000))
+    out.timing('verify unlock token', per_call(lambda: check_unlock_token(token, folder, user), 10000))
+
+
+@benchmark
+def export(out):
+    # Both sizes exceed the 2000-row fetch chunk, so peak memory should match
+    for todo_count in (5000, 50000):
+        with rolled_back():
+            user = seed_user(todo_count, folder_count=10, description='x' * 200)
+            for export_format, gzip in (('ndjson', False), ('csv', False), ('ndjson', True)):
+                def run():
+                    return sum(len(chunk) for chunk in stream_export(user, export_format, gzip))
+
+                start = time.perf_counter()
+                size = run()
+                out.rate(f"{export_format}{' gzip' if gzip else ''} x{todo_count}", todo_count, time.perf_counter() - start)
+                out.value('  output / peak memory', f'{size // 1024} KiB / {peak_memory(run) // 1024} KiB')
+
+
+def _ndjson_lines(todo_count, folder_count=10):
+    for i in range(folder_count):
+        yield f'{{"type":"folder","user_folder_id":{i + 1},"name":"Folder {i + 1}"}}\n'.encode()
+    for i in range(todo_count):
+        yield (
+            f'{{"type":"todo","user_folder_id":{i % folder_count + 1},"title":"Todo {i}",'
+            f'"description":"{"x" * 200}","due_date":"2026-01-01"}}\n'
+        ).encode()
+
+
+@benchmark
+def import_ndjson(out):
+    for todo_count in (5000, 50000):
+        with rolled_back():
+            user = seed_user(0, folder_count=0)
+            start = time.perf_counter()
+            summary = import_records(user, _ndjson_lines(todo_count))
+            out.rate(f'ndjson x{todo_count}', summary['todos_created'], time.perf_counter() - start)
+        with rolled_back():
+            user = seed_user(0, folder_count=0)
+            peak = peak_memory(lambda: import_records(user, _ndjson_lines(todo_count)))
+            out.value('  peak memory', f'{peak // 1024} KiB')
+
+
+@benchmark
+def recurrence(out):
+    with rolled_back():
+        user = seed_user(0, folder_count=1)
+        folder = TodoFolder.objects.get(user=user)
+        frequencies = [
+            {'frequency': 'daily', 'interval': 1},
+            {'frequency': 'daily', 'interval': 3},
+            {'frequency': 'weekly', 'interval': 1, 'weekdays': '0,2,4'},
+            {'frequency': 'weekly', 'interval': 2, 'weekdays': '5'},
+            {'frequency': 'monthly', 'interval': 1},
+        ]
+        # Rules that started years ago: expansion must jump straight to the window
+        RecurrenceRule.objects.bulk_create(
+            (RecurrenceRule(user=user, folder=folder, title=f'Rule {i}',
+                            start_date=date(2020, 1, 1) + timedelta(days=i % 365), **frequencies[i % len(frequencies)])
+             for i in range(5000)),
+            batch_size=1000,
+        )
+
+        start = date(2026, 1, 1)
+        for days in (7, 31, 365):
+            end = start + timedelta(days=days - 1)
+            count = sum(1 for _ in expand_for_user(user, start, end))
+            seconds = per_call(lambda: sum(1 for _ in expand_for_user(user, start, end)), 1)
+            out.timing(f'5000 rules, {days}-day window', seconds, unit='call')
+            out.timing(f'  per occurrence ({count} total)', seconds / count, unit='occurrence')
+
+
+@benchmark
+def sparse_fields(out):
+    # Description-heavy rows: a list screen that only renders title and
+    # status shouldn't pay for reading and serializing 2 KiB per todo
+    factory = RequestFactory()
+    with rolled_back():
+        user = seed_user(5000, folder_count=10, description='x' * 2048)
+        for label, query in (('all fields', ''), ('fields=title,status', '?fields=title,status')):
+            request = factory.get(f'/auth/todos/{query}')
+            request.authenticated_user = user
+            size = len(todo_list_view(request).content)
+            out.timing(f'{label} x5000', per_call(lambda: todo_list_view(request), 3), unit='request')
+            out.value('  payload / peak memory', f'{size // 1024} KiB / {peak_memory(lambda: todo_list_view(request)) // 1024} KiB')
+
+
+@benchmark
+def auth(out):
+    factory = RequestFactory()
+    with rolled_back():
+        user = seed_user(0, folder_count=0)
+        user.auth_token = uuid.uuid4().hex
+        user.save(update_fields=['auth_token'])
+        access = issue_tokens(user)['access']
+        for label, header in (('legacy Token (DB lookup)', f'Token {user.auth_token}'),
+                              ('Bearer access token', f'Bearer {access}')):
+            request = factory.get('/auth/todos/', HTTP_AUTHORIZATION=header)
+            authenticate_request(request)  # warms the token version cache
+            with CaptureQueriesContext(connection) as queries:
+                authenticate_request(request)
+            out.timing(label, per_call(lambda: authenticate_request(request), 5000), unit='request')
+            out.value('  queries per request', str(len(queries)))
+
+
+@benchmark
+def rate_limit(out):
+    # Cost of one bucket check; cache timings depend on the configured cache
+    capacity, refill = parse_rate('30/m')
+    for label, buckets in (('in-process buckets', LocalBuckets()), ('cache buckets', CacheBuckets())):
+        keys = [f'login_ip:10.0.{i // 256}.{i % 256}' for i in range(10000)]
+        position = iter(range(10 ** 9))
+
+        def take():
+            buckets.take(keys[next(position) % len(keys)], capacity, refill, time.time())
+
+        out.timing(label, per_call(take, 20000), unit='check')
+
+
+@benchmark
+def tags(out):
+    # 100k todos and 300 tags; every todo gets 2 different ones
+    with rolled_back():
+        user = seed_user(100000, folder_count=20)
+        tags = Tag.objects.bulk_create([Tag(user=user, name=f'tag-{i}') for i in range(300)])
+        todo_ids = list(Todo.objects.filter(user=user).order_by('id').values_list('id', flat=True))
+        TodoTag.objects.bulk_create(
+            (TodoTag(todo_id=todo_id, tag_id=tags[(n + offset) % len(tags)].id)
+             for n, todo_id in enumerate(todo_ids) for offset in (0, 1 + n // len(tags) % (len(tags) - 1))),
+            batch_size=5000,
+        )
+        todos = Todo.objects.filter(user=user)
+        for label, names, match in (
+            ('any of 1 tag', ['tag-7'], 'any'),
+            ('any of 5 tags', [f'tag-{i}' for i in range(5)], 'any'),
+            ('all of 2 tags', ['tag-1', 'tag-7'], 'all'),
+            ('all of 3 tags (no match)', ['tag-1', 'tag-7', 'tag-9'], 'all'),
+        ):
+            def run():
+                return list(filter_by_tags(todos, user, names, match).values_list('id', flat=True))
+
+            out.timing(label, per_call(run, 5), unit='query')
+            out.value('  matching todos', str(len(run())))
+
+        factory = RequestFactory()
+        for query in ('?fields=title,tags', '?fields=title,tags&tags=tag-1,tag-7&tag_match=all'):
+            request = factory.get(f'/auth/todos/{query}')
+            request.authenticated_user = user
+            with CaptureQueriesContext(connection) as queries:
+                todo_list_view(request)
+            out.timing(f'list {query}', per_call(lambda: todo_list_view(request), 3), unit='request')
+            out.value('  queries', str(len(queries)))
+
+
+@benchmark
+def activity(out):
+    # What logging 10k changes costs written one row at a time, as a request
+    # would, against appending them to the buffer and flushing in batches
+    count = 10000
+    with rolled_back():
+        user = seed_user(0)
+
+        def entries():
+            return [Activity(user=user, action='todo.updated', object_type='todo', object_id=i,
+                             changes={'title': ['old', 'new']}, created_at=timezone.now()) for i in range(count)]
+
+        rows = entries()
+        started = time.perf_counter()
+        for row in rows:
+            row.save()
+        out.rate('one INSERT per change', count, time.perf_counter() - started)
+
+        # Flushed here rather than by the thread, whose own connection can't
+        # see the rolled-back user
+        buffer = ActivityBuffer(count, settings.ACTIVITY_FLUSH_SIZE, settings.ACTIVITY_FLUSH_INTERVAL, background=False)
+        rows = entries()
+        started = time.perf_counter()
+        for row in rows:
+            buffer.append(row)
+        appended = time.perf_counter() - started
+        buffer.flush()
+        flushed = time.perf_counter() - started
+        out.timing('append to buffer', appended / count, unit='change')
+        out.rate(f'buffered, {settings.ACTIVITY_FLUSH_SIZE}-row INSERTs', count, flushed)
+
+
+@benchmark
+def agenda_year(out):
+    # A heavy user: 50k todos due over a year, 5% without a due date
+    with rolled_back():
+        user = seed_user(0, folder_count=20)
+        folders = list(TodoFolder.objects.filter(user=user))
+        start = date(2025, 1, 1)
+        statuses, priorities = ('pending', 'in_progress', 'completed'), ('low', 'medium', 'high')
+        Todo.objects.bulk_create(
+            (Todo(user=user, folder=folders[i % len(folders)], title=f'Todo {i}',
+                  due_date=None if i % 20 == 0 else start + timedelta(days=i % 365),
+                  status=statuses[i % 3], priority=priorities[i // 3 % 3])
+             for i in range(50000)),
+            batch_size=5000,
+        )
+        end = start + timedelta(days=364)
+
+        def bucket_in_python():
+            # What the calendar did before: every todo, grouped client-side
+            days = {}
+            for todo in Todo.objects.filter(user=user, due_date__gte=start, due_date__lte=end).values(
+                'id', 'due_date', 'status', 'priority'
+            ):
+                days.setdefault(todo['due_date'], []).append(todo)
+            return days
+
+        out.timing('fetch all + bucket in Python', per_call(bucket_in_python, 3), unit='year')
+        for include in ('none', 'ids', 'rows'):
+            def run():
+                return agenda(user, start, end, include)
+
+            run()  # SQLite checks for JSON support on first use
+            with CaptureQueriesContext(connection) as queries:
+                days = run()
+            out.timing(f'agenda include={include}', per_call(run, 3), unit='year')
+            out.value('  days / queries', f'{len(days)} / {len(queries)}')
+
+
+@benchmark
+def next_up(out):
+    # 50k todos, a third of them done, across 20 folders
+    with rolled_back():
+        user = seed_user(0, folder_count=20)
+        folders = list(TodoFolder.objects.filter(user=user))
+        priorities = list(PRIORITY_RANKS)
+        Todo.objects.bulk_create(
+            (Todo(user=user, folder=folders[i % len(folders)], title=f'Todo {i}',
+                  due_date=None if i % 10 == 0 else date(2025, 1, 1) + timedelta(days=i * 7 % 365),
+                  priority=priorities[i * 13 % 3], completed=i % 3 == 0)
+             for i in range(50000)),
+            batch_size=5000,
+        )
+
+        def rank_in_python():
+            # What clients did before: every open todo, ranked by name
+            rank = {name: -value for name, value in PRIORITY_RANKS.items()}
+            todos = Todo.objects.filter(OPEN_TODOS, user=user).values('id', 'priority', 'due_date')
+            return sorted(
+                todos, key=lambda t: (rank[t['priority']], t['due_date'] is None, t['due_date'] or date.max, t['id'])
+            )[:10]
+
+        def top_k():
+            return list(
+                Todo.objects.filter(OPEN_TODOS, user=user).exclude(folder__pending_deletion=True)
+                .order_by(*NEXT_UP_ORDER).values('id', 'priority', 'due_date')[:10]
+            )
+
+        assert [t['id'] for t in rank_in_python()] == [t['id'] for t in top_k()]
+        out.timing('fetch open todos + rank in Python', per_call(rank_in_python, 3), unit='call')
+        out.timing('ORDER BY ... LIMIT 10 on todo_next_up_idx', per_call(top_k, 50), unit='call')
+
+
+@benchmark
+def startup(out):
+    # What a worker pays without --preload: a fresh interpreter importing the app
+    command = [sys.executable, '-c', 'import project1.asgi']
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'project1.settings')}
+
+    def cold_start():
+        subprocess.run(command, cwd=settings.BASE_DIR, env=env, check=True)
+
+    out.timing('cold start (import project1.asgi)', per_call(cold_start, 1, repeat=5), unit='process')
+
+    # Best of three, so a noisy neighbour doesn't count against the budget
+    runs = [measure_imports() for _ in range(3)]
+    total, modules = min(runs, key=lambda run: run[0])
+    out.value('  of which imports', f'{total * 1000:.0f} ms')
+    out.value('  import budget', f'{IMPORT_TIME_BUDGET * 1000:.0f} ms')
+    # Direct imports of the app (including those made by django.setup())
+    direct = [(seconds, name) for name, (depth, seconds) in modules.items() if depth == 1]
+    for seconds, name in sorted(direct, reverse=True)[:8]:
+        out.value(f'    {name}', f'{seconds * 1000:.1f} ms')
+
+    # With --preload workers are forked from the loaded master instead
+    import project1.asgi  # noqa: F401  (loads the URLconf and every view)
+    request = RequestFactory().get('/health/')
+
+    def fork_worker():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                resolve(request.path).func(request)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+
+    out.timing('fork preloaded worker + first request', per_call(fork_worker, 20), unit='worker')
+
+    if total > IMPORT_TIME_BUDGET:
+        raise CommandError(
+            f'Importing project1.asgi took {total * 1000:.0f} ms of imports '
+            f'(budget {IMPORT_TIME_BUDGET * 1000:.0f} ms); see the slowest imports above'
+        )
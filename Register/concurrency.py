@@ -0,0 +1,66 @@
+"""Optimistic concurrency for todo and folder edits.
+
+Todo and TodoFolder rows carry a ``version`` that every edit bumps. An edit
+is written with a single ``UPDATE ... WHERE id = %s AND version = %s``; when
+another device saved in between no row matches, and the client gets 409 with
+the current state instead of silently overwriting that save. Nothing is
+locked while the request runs.
+
+Clients send the version their edit is based on as ``If-Match: "<version>"``
+(the ETag of detail responses) or as ``version`` in the body. Edits without
+one are still applied field by field against the latest row.
+"""
+from django.utils import timezone
+
+# Unversioned edits that keep losing the race to other writers give up
+UPDATE_ATTEMPTS = 3
+
+
+class VersionError(ValueError):
+    pass
+
+
+def etag(instance):
+    return f'"{instance.version}"'
+
+
+def requested_version(request, data):
+    """Version the client's edit is based on, or None when it sent none."""
+    value = request.headers.get('If-Match')
+    if value is None and isinstance(data, dict):
+        value = data.get('version')
+    if value in (None, '', '*'):
+        return None
+    if isinstance(value, str):
+        value = value.strip().removeprefix('W/').strip('"')
+    if isinstance(value, bool):
+        raise VersionError('version must be an integer')
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise VersionError('version must be an integer')
+
+
+def changed_fields(instance, values):
+    """The subset of ``values`` that differs from what ``instance`` holds."""
+    return {name: value for name, value in values.items() if getattr(instance, name) != value}
+
+
+def save_changes(instance, changes):
+    """Write ``changes`` if the row is still at ``instance.version``.
+
+    Only the changed columns, the version and ``updated_at`` are written.
+    Returns False, leaving ``instance`` untouched, when another write got
+    there first.
+    """
+    now = timezone.now()
+    updated = type(instance)._base_manager.filter(pk=instance.pk, version=instance.version).update(
+        version=instance.version + 1, updated_at=now, **changes
+    )
+    if not updated:
+        return False
+    for name, value in changes.items():
+        setattr(instance, name, value)
+    instance.version += 1
+    instance.updated_at = now
+    return True
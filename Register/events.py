@@ -0,0 +1,197 @@
+"""Per-user change events for the live-update stream (``GET auth/events/``).
+
+Write paths call ``publish_event``; once the surrounding transaction commits
+the event is handed to the configured backend:
+
+* ``LocalEventBackend`` delivers straight to this process's broker. Enough
+  when a single process serves both the writes and the streams.
+* ``PostgresEventBackend`` sends a NOTIFY on the ``EVENTS_CHANNEL`` channel.
+  Every process serving streams runs one LISTEN thread that feeds its own
+  broker, so events reach clients connected to any worker.
+
+Each open stream is a coroutine waiting on a small asyncio queue; no thread
+or database connection is held per client.
+"""
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.utils.module_loading import import_string
+
+from . import sharding
+
+logger = logging.getLogger(__name__)
+
+EVENTS_CHANNEL = 'taskmanager_events'
+HEARTBEAT_SECONDS = 15
+QUEUE_SIZE = 100
+
+
+def _frame(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n'
+
+
+class Subscription:
+    def __init__(self, user_id, loop):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+
+    def put(self, frame):
+        # Runs on the subscriber's event loop. A client that falls this far
+        # behind is told to refetch instead of being sent the backlog.
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            frame = _frame('resync', {})
+        self.queue.put_nowait(frame)
+
+
+class Broker:
+    """In-process fan-out from published events to open streams."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def dispatch(self, message):
+        """Deliver a published message (as produced by ``publish_event``)."""
+        payload = json.loads(message)
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(payload['user'], ()))
+        if not subscriptions:
+            return
+        frame = _frame(payload['event'], payload['data'])
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, frame)
+            except RuntimeError:
+                # The subscriber's loop has shut down
+                self.unsubscribe(subscription)
+
+
+broker = Broker()
+
+
+class LocalEventBackend:
+    def start(self):
+        pass
+
+    def publish(self, message):
+        broker.dispatch(message)
+
+
+class PostgresEventBackend:
+    """Cross-process delivery through PostgreSQL LISTEN/NOTIFY."""
+
+    # NOTIFY payloads must stay under 8000 bytes
+    MAX_PAYLOAD = 7900
+
+    def __init__(self, using='default'):
+        self.using = using
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def publish(self, message):
+        if len(message.encode()) > self.MAX_PAYLOAD:
+            # Send just enough for clients to refetch the object
+            payload = json.loads(message)
+            payload['data'] = {'id': payload['data'].get('id'), 'truncated': True}
+            message = json.dumps(payload)
+        with connections[self.using].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [EVENTS_CHANNEL, message])
+
+    def start(self):
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='event-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        import psycopg2
+
+        params = connections[self.using].get_connection_params()
+        while True:
+            try:
+                conn = psycopg2.connect(**params)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN {EVENTS_CHANNEL}')
+                while True:
+                    if select.select([conn], [], [], HEARTBEAT_SECONDS) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        broker.dispatch(conn.notifies.pop(0).payload)
+            except Exception:
+                logger.exception('Event listener lost its connection; reconnecting')
+                time.sleep(1)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            path = getattr(settings, 'EVENTS_BACKEND', 'Register.events.LocalEventBackend')
+            _backend = import_string(path)()
+        return _backend
+
+
+def _send(message):
+    try:
+        get_backend().publish(message)
+    except Exception:
+        # Live updates are best effort; never fail the write that triggered them
+        logger.exception('Could not publish change event')
+
+
+def publish_event(user_id, event, data):
+    """Publish ``event`` to ``user_id``'s streams after the current transaction commits."""
+    message = json.dumps({'user': user_id, 'event': event, 'data': data}, cls=DjangoJSONEncoder)
+    # Writes happen on the user's shard, so that is the commit to wait for
+    transaction.on_commit(lambda: _send(message), using=sharding.current())
+
+
+def subscribe(user_id):
+    get_backend().start()
+    return broker.subscribe(user_id)
+
+
+async def stream(subscription):
+    """SSE body for one client; heartbeats keep idle proxies from closing it."""
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            try:
+                frame = await asyncio.wait_for(subscription.queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            yield frame
+    finally:
+        broker.unsubscribe(subscription)
@@ -0,0 +1,134 @@
+"""Streaming export of a user's folders and todos as NDJSON or CSV.
+
+Rows are read with ``QuerySet.iterator()`` (server-side cursors on
+PostgreSQL) and encoded into fixed-size chunks, so memory use does not
+depend on how many todos a user has. Under ASGI the chunks are handed over
+one at a time through ``as_async``.
+"""
+import csv
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+
+from . import sharding
+from .models import ArchivedTodo, Todo, TodoFolder
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+CSV_COLUMNS = [
+    'type', 'user_folder_id', 'name', 'title', 'description', 'status', 'priority',
+    'due_date', 'completed', 'locked', 'position', 'archived', 'created_at', 'updated_at',
+]
+
+FOLDER_FIELDS = ['user_folder_id', 'name', 'description', 'locked', 'priority', 'created_at', 'updated_at']
+TODO_FIELDS = [
+    'folder__user_folder_id', 'title', 'description', 'status', 'priority',
+    'due_date', 'completed', 'position', 'created_at', 'updated_at',
+]
+
+DB_CHUNK_SIZE = 2000
+OUTPUT_CHUNK_SIZE = 64 * 1024
+
+
+def export_records(user, using, chunk_size=DB_CHUNK_SIZE):
+    """Yield one dict per folder, then one per todo (hot and archived), read from shard ``using``."""
+    folders = TodoFolder.objects.using(using).visible().filter(user=user).order_by('user_folder_id').values(*FOLDER_FIELDS)
+    for folder in folders.iterator(chunk_size=chunk_size):
+        yield {'type': 'folder', **folder}
+
+    todos = Todo.objects.using(using).filter(user=user).exclude(folder__pending_deletion=True).order_by('id')
+    archived = ArchivedTodo.objects.using(using).filter(user=user).order_by('id')
+    for queryset, is_archived in ((todos, False), (archived, True)):
+        for todo in queryset.values(*TODO_FIELDS).iterator(chunk_size=chunk_size):
+            todo['user_folder_id'] = todo.pop('folder__user_folder_id')
+            todo['archived'] = is_archived
+            yield {'type': 'todo', **todo}
+
+
+class _Echo:
+    """csv.writer target that hands back each encoded row."""
+
+    def write(self, value):
+        return value
+
+
+def _encode_ndjson(records):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for record in records:
+        yield encoder.encode(record) + '\n'
+
+
+def _encode_csv(records):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for record in records:
+        yield writer.writerow([_csv_value(record.get(column)) for column in CSV_COLUMNS])
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def _chunked(pieces, size=OUTPUT_CHUNK_SIZE):
+    buffer, buffered = [], 0
+    for piece in pieces:
+        data = piece.encode('utf-8')
+        buffer.append(data)
+        buffered += len(data)
+        if buffered >= size:
+            yield b''.join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(user, export_format='ndjson', gzip=False):
+    """Iterator of byte chunks for a full export of ``user``'s data."""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported format '{export_format}'. Use one of: {', '.join(EXPORT_FORMATS)}")
+    encode = _encode_ndjson if export_format == 'ndjson' else _encode_csv
+    # The body is produced after the view has returned, so the shard is
+    # picked now
+    chunks = _chunked(encode(export_records(user, sharding.current())))
+    return _gzipped(chunks) if gzip else chunks
+
+
+async def as_async(chunks):
+    """Async iterator over the sync iterator ``chunks``, for ASGI responses.
+
+    Given a sync iterator, Django's ASGI handler runs ``sync_to_async(list)``
+    on it and so builds the whole body in memory before sending a byte. Here
+    each chunk is pulled with its own ``sync_to_async`` call, on the
+    request's thread where the export's database cursor lives.
+    """
+    iterator = iter(chunks)
+    next_chunk = sync_to_async(next)
+    try:
+        while True:
+            chunk = await next_chunk(iterator, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        # A client that disconnects early leaves the cursor open otherwise
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close)()
@@ -0,0 +1,114 @@
+"""Background deletion of large folders.
+
+``todo_folders`` DELETE hides a large folder and queues a FolderDeletionJob;
+the ``process_folder_deletions`` worker then removes its todos in bounded
+batches, each in its own short transaction, and finally the folder itself.
+
+A run that fails is retried with exponential backoff. After
+``MAX_ATTEMPTS`` runs the job is marked ``failed`` and the folder is shown
+again with whatever todos are left, so the user can see and retry it.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import sharding
+from .models import ArchivedTodo, FolderDeletionJob, Todo, TodoFolder
+
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF = timedelta(minutes=1)
+
+
+def sync_delete_limit():
+    # Folders with at most this many todos are still deleted inside the request
+    return getattr(settings, 'FOLDER_DELETE_SYNC_LIMIT', 1000)
+
+
+def queue_folder_deletion(folder):
+    with transaction.atomic(using=sharding.current()):
+        TodoFolder.objects.filter(id=folder.id).update(pending_deletion=True)
+        return FolderDeletionJob.objects.create(
+            user_id=folder.user_id,
+            folder=folder,
+            folder_name=folder.name,
+        )
+
+
+def claim_next_job(stale_after=timedelta(minutes=10)):
+    """Atomically mark the oldest runnable job as running and return it.
+
+    Jobs left ``running`` by a worker that died are picked up again once they
+    have not reported progress for ``stale_after``; failed runs once their
+    ``retry_at`` has passed.
+    """
+    now = timezone.now()
+    runnable = FolderDeletionJob.objects.filter(
+        Q(status='pending', retry_at__isnull=True)
+        | Q(status='pending', retry_at__lte=now)
+        | Q(status='running', updated_at__lt=now - stale_after)
+    )
+    for job in runnable.order_by('created_at')[:5]:
+        claimed = FolderDeletionJob.objects.filter(id=job.id, status=job.status, updated_at=job.updated_at).update(
+            status='running', attempts=F('attempts') + 1, updated_at=timezone.now()
+        )
+        if claimed:
+            job.refresh_from_db()
+            if job.attempts > MAX_ATTEMPTS:
+                # Its last run never reported back either
+                _give_up(job, 'The worker stopped during every attempt')
+                continue
+            return job
+    return None
+
+
+def _give_up(job, error):
+    with transaction.atomic(using=sharding.current()):
+        FolderDeletionJob.objects.filter(id=job.id).update(
+            status='failed', error=error, retry_at=None, updated_at=timezone.now(), finished_at=timezone.now()
+        )
+        if job.folder_id is not None:
+            TodoFolder.objects.filter(id=job.folder_id).update(pending_deletion=False)
+
+
+def _failed(job, error):
+    if job.attempts >= MAX_ATTEMPTS:
+        _give_up(job, error)
+        return
+    now = timezone.now()
+    FolderDeletionJob.objects.filter(id=job.id).update(
+        status='pending', error=error, retry_at=now + RETRY_BACKOFF * 2 ** (job.attempts - 1), updated_at=now
+    )
+
+
+def run_job(job, batch_size=1000):
+    try:
+        if job.folder_id is not None:
+            # Archived todos cascade from the folder too, so batch them as well
+            if job.total_todos is None:
+                job.total_todos = sum(model.objects.filter(folder_id=job.folder_id).count() for model in (Todo, ArchivedTodo))
+                job.save(update_fields=['total_todos', 'updated_at'])
+
+            for model in (Todo, ArchivedTodo):
+                while True:
+                    ids = list(model.objects.filter(folder_id=job.folder_id).values_list('id', flat=True)[:batch_size])
+                    if not ids:
+                        break
+                    with transaction.atomic(using=sharding.current()):
+                        model.objects.filter(id__in=ids).delete()
+                        FolderDeletionJob.objects.filter(id=job.id).update(
+                            deleted_todos=F('deleted_todos') + len(ids), updated_at=timezone.now()
+                        )
+
+            TodoFolder.objects.filter(id=job.folder_id).delete()
+
+        FolderDeletionJob.objects.filter(id=job.id).update(
+            status='completed', updated_at=timezone.now(), finished_at=timezone.now()
+        )
+    except Exception as e:
+        _failed(job, str(e))
+        raise
+    job.refresh_from_db()
+    return job
@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from django.core import signing
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+UNLOCK_TOKEN_SALT = 'Register.folder_lock.unlock'
+
+
+def hash_folder_password(raw_password):
+    return make_password(raw_password)
+
+
+def check_folder_password(folder, raw_password):
+    # Full hasher round trip (PBKDF2 by default); only used to obtain an
+    # unlock token or by legacy clients that still send the password.
+    if not raw_password or not folder.password:
+        return False
+    return check_password(raw_password, folder.password)
+
+
+def unlock_token_max_age():
+    return getattr(settings, 'FOLDER_UNLOCK_TOKEN_MAX_AGE', 300)
+
+
+def _password_fingerprint(folder):
+    # Binds the token to the current password hash so re-locking a folder
+    # with a new password invalidates outstanding tokens.
+    return salted_hmac(UNLOCK_TOKEN_SALT, folder.password or '').hexdigest()[:16]
+
+
+def make_unlock_token(folder, user):
+    signer = signing.TimestampSigner(salt=UNLOCK_TOKEN_SALT)
+    return signer.sign_object({
+        'f': folder.id,
+        'u': user.id,
+        'p': _password_fingerprint(folder),
+    })
+
+
+def check_unlock_token(token, folder, user):
+    """Validate an unlock token for ``folder`` with a single HMAC check."""
+    if not token:
+        return False
+    signer = signing.TimestampSigner(salt=UNLOCK_TOKEN_SALT)
+    try:
+        payload = signer.unsign_object(token, max_age=unlock_token_max_age())
+    except (signing.BadSignature, ValueError):
+        return False
+    return (
+        payload.get('f') == folder.id
+        and payload.get('u') == user.id
+        and constant_time_compare(payload.get('p', ''), _password_fingerprint(folder))
+    )
@@ -0,0 +1,178 @@
+"""``Idempotency-Key`` support for create and bulk endpoints.
+
+The first request with a key claims it by inserting an IdempotencyKey row
+in the same transaction that runs the view, and stores the response on it.
+A retry with the same key gets the stored response back (marked with
+``Idempotent-Replayed: true``) without running the view again.
+
+A duplicate that arrives while the first request is still running blocks
+on the row's unique index until that transaction finishes: it then replays
+the stored response, or runs normally if the first request failed and
+rolled its claim back.
+
+Streamed uploads (``hash_body=False``) work differently. Their body isn't
+read to fingerprint it, so the client sends a ``Content-Digest`` of it
+instead. And the view doesn't run inside the claim's transaction, which
+would turn the upload's batch transactions into one long one: the claim
+is committed first, marked as in progress, and filled in or deleted once
+the view returns. Duplicates meanwhile get 409.
+"""
+import functools
+import hashlib
+from datetime import timedelta
+from http import HTTPStatus
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from . import sharding
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+DIGEST_HEADER = 'Content-Digest'
+# Content type of a committed claim whose view is still running
+IN_PROGRESS = ''
+# A claim still in progress after this long belongs to a request that died
+STALE_CLAIM_AFTER = timedelta(hours=1)
+
+
+def key_ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 3600))
+
+
+def _fingerprint(request, hash_body):
+    digest = hashlib.sha256(f'{request.method} {request.get_full_path()}\n'.encode())
+    if hash_body:
+        digest.update(request.body)
+    else:
+        digest.update(request.headers.get(DIGEST_HEADER, '').encode())
+    return digest.hexdigest()
+
+
+def _replay(record):
+    response = HttpResponse(bytes(record.body), status=record.status_code, content_type=record.content_type)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _in_progress():
+    return JsonResponse({'error': f'A request with this {HEADER} is still in progress'}, status=HTTPStatus.CONFLICT)
+
+
+def _claim(user, key, fingerprint):
+    """Insert the key's row: ``(record, None)``, or ``(None, response)`` for a duplicate."""
+    try:
+        with transaction.atomic(using=sharding.current()):
+            # Blocks while another request holds the same key
+            return IdempotencyKey.objects.create(
+                user=user, key=key, fingerprint=fingerprint,
+                status_code=HTTPStatus.ACCEPTED, content_type=IN_PROGRESS, body=b''
+            ), None
+    except IntegrityError:
+        return None, _existing(user, key, fingerprint) or _in_progress()
+
+
+def _store(record, response):
+    record.status_code = response.status_code
+    record.content_type = response.get('Content-Type', '')
+    record.body = response.content
+    record.save(update_fields=['status_code', 'content_type', 'body'])
+
+
+def _existing(user, key, fingerprint):
+    """Response for a key that was already used, or None if it can be claimed."""
+    record = IdempotencyKey.objects.filter(user=user, key=key).first()
+    if record is None:
+        return None
+    if record.created_at < timezone.now() - key_ttl():
+        record.delete()
+        return None
+    if record.content_type == IN_PROGRESS:
+        if record.created_at < timezone.now() - STALE_CLAIM_AFTER:
+            record.delete()
+            return None
+        return _in_progress()
+    if record.fingerprint != fingerprint:
+        return JsonResponse(
+            {'error': f'{HEADER} was already used for a different request'},
+            status=HTTPStatus.UNPROCESSABLE_ENTITY
+        )
+    return _replay(record)
+
+
+def idempotent(hash_body=True):
+    """Make a view's POST requests replayable via the ``Idempotency-Key`` header.
+
+    Set ``hash_body=False`` for streamed uploads, whose body shouldn't be
+    read into memory just to fingerprint it and which run their own
+    transactions (see the module docstring).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if request.method != 'POST' or not key:
+                return view(request, *args, **kwargs)
+            if len(key) > 255:
+                return JsonResponse({'error': f'{HEADER} is too long'}, status=HTTPStatus.BAD_REQUEST)
+
+            # Imported here: the views module imports this one
+            from .views import authenticate_request
+
+            user, error = authenticate_request(request)
+            if error:
+                return error
+            request.authenticated_user = user
+            if not hash_body and not request.headers.get(DIGEST_HEADER):
+                return JsonResponse(
+                    {'error': f'{DIGEST_HEADER} is required with {HEADER} for uploads'},
+                    status=HTTPStatus.BAD_REQUEST
+                )
+            fingerprint = _fingerprint(request, hash_body)
+
+            replay = _existing(user, key, fingerprint)
+            if replay is not None:
+                return replay
+
+            if not hash_body:
+                record, duplicate = _claim(user, key, fingerprint)
+                if duplicate is not None:
+                    return duplicate
+                try:
+                    response = view(request, *args, **kwargs)
+                except BaseException:
+                    record.delete()
+                    raise
+                if response.status_code >= 500 or response.streaming:
+                    record.delete()
+                else:
+                    _store(record, response)
+                return response
+
+            with transaction.atomic(using=sharding.current()):
+                record, duplicate = _claim(user, key, fingerprint)
+                if duplicate is not None:
+                    return duplicate
+
+                response = view(request, *args, **kwargs)
+                if response.status_code >= 500 or response.streaming:
+                    # Not worth replaying: drop the claim so a retry runs again
+                    transaction.set_rollback(True, using=sharding.current())
+                    return response
+                _store(record, response)
+            return response
+        return wrapper
+    return decorator
+
+
+def purge_expired(batch_size=5000):
+    """Delete keys older than IDEMPOTENCY_KEY_TTL; returns how many were removed."""
+    cutoff = timezone.now() - key_ttl()
+    removed = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(created_at__lt=cutoff).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return removed
+        removed += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
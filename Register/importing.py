@@ -0,0 +1,262 @@
+"""Streaming import of folders and todos from NDJSON or CSV.
+
+Accepts the format written by Register/exporting.py. Records are read one
+line at a time and written in batches: folders referenced by a batch are
+resolved or created with one query each way, and todos are validated with
+the same rules as the todos POST view and inserted with ``bulk_create``.
+Invalid rows are reported and skipped; they never abort the import.
+"""
+import csv
+import json
+
+from django.db import transaction
+from django.db.models import Max
+
+from . import sharding
+from .folder_lock import hash_folder_password
+from .models import Todo, TodoFolder
+from .ordering import key_between
+from .validation import PRIORITIES, TodoValidationError, clean_todo
+
+IMPORT_FORMATS = ('ndjson', 'csv')
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+_TRUE_VALUES = {'true', '1', 'yes'}
+
+
+def _as_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in _TRUE_VALUES
+    return bool(value)
+
+
+def _as_int(value):
+    if value in (None, ''):
+        return None
+    return int(value)
+
+
+def read_ndjson(lines):
+    """Yield ``(line_number, record_or_error)`` for each non-blank line."""
+    for number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            yield number, 'Invalid JSON'
+            continue
+        yield number, record if isinstance(record, dict) else 'Each line must be a JSON object'
+
+
+def read_csv(lines):
+    """Yield ``(line_number, record)`` using the export's CSV header."""
+    text = (line.decode('utf-8') if isinstance(line, bytes) else line for line in lines)
+    reader = csv.DictReader(text)
+    for record in reader:
+        # Empty cells mean "not given", like a missing key in NDJSON
+        yield reader.line_num, {key: value for key, value in record.items() if value not in ('', None)}
+
+
+class Importer:
+    def __init__(self, user, batch_size=BATCH_SIZE):
+        self.user = user
+        self.batch_size = batch_size
+        self.folder_ids = {}  # user_folder_id -> TodoFolder.id
+        self.last_positions = {}  # TodoFolder.id -> last key used
+        self.next_user_folder_id = None
+        self.rows = 0
+        self.folders_created = 0
+        self.todos_created = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def run(self, records):
+        batch = []
+        for line, record in records:
+            self.rows += 1
+            if isinstance(record, str):
+                self.error(line, record)
+                continue
+            batch.append((line, record))
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+        if batch:
+            self._flush(batch)
+        return self.summary()
+
+    def summary(self):
+        return {
+            'rows': self.rows,
+            'folders_created': self.folders_created,
+            'todos_created': self.todos_created,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+    def _flush(self, batch):
+        folders = [(line, record) for line, record in batch if record.get('type') == 'folder']
+        todos = [(line, record) for line, record in batch if record.get('type', 'todo') == 'todo']
+        for line, record in batch:
+            if record.get('type', 'todo') not in ('folder', 'todo'):
+                self.error(line, f"Unknown record type '{record.get('type')}'")
+
+        with transaction.atomic(using=sharding.current()):
+            if folders:
+                self._import_folders(folders)
+            if todos:
+                self._import_todos(todos)
+
+    def _load_folders(self, user_folder_ids):
+        missing = [i for i in user_folder_ids if i not in self.folder_ids]
+        if missing:
+            self.folder_ids.update(
+                TodoFolder.objects.visible()
+                .filter(user=self.user, user_folder_id__in=missing)
+                .values_list('user_folder_id', 'id')
+            )
+
+    def _import_folders(self, folders):
+        parsed = []
+        for line, record in folders:
+            try:
+                user_folder_id = _as_int(record.get('user_folder_id'))
+            except (TypeError, ValueError):
+                self.error(line, 'user_folder_id must be an integer')
+                continue
+            name = record.get('name')
+            if not name:
+                self.error(line, 'Folder name is required')
+                continue
+            if not isinstance(name, str):
+                self.error(line, 'Folder name must be a string')
+                continue
+            if not all(isinstance(record.get(field), (str, type(None))) for field in ('description', 'password')):
+                self.error(line, 'Folder description and password must be strings')
+                continue
+            if len(name) > TodoFolder._meta.get_field('name').max_length:
+                self.error(line, f"Folder name must be at most {TodoFolder._meta.get_field('name').max_length} characters")
+                continue
+            if record.get('priority', 'medium') not in (None, *PRIORITIES):
+                self.error(line, 'Invalid priority')
+                continue
+            parsed.append((line, user_folder_id, record))
+
+        self._load_folders({user_folder_id for _, user_folder_id, _ in parsed if user_folder_id is not None})
+        if self.next_user_folder_id is None:
+            last = TodoFolder.objects.filter(user=self.user).aggregate(last=Max('user_folder_id'))['last']
+            self.next_user_folder_id = (last or 0) + 1
+
+        new_folders = []
+        new_ids = set()
+        for line, user_folder_id, record in parsed:
+            if user_folder_id is not None and user_folder_id in self.folder_ids:
+                continue  # Already exists: todos get attached to it
+            if user_folder_id is None or user_folder_id in new_ids:
+                user_folder_id = self.next_user_folder_id
+            new_ids.add(user_folder_id)
+            self.next_user_folder_id = max(self.next_user_folder_id, user_folder_id + 1)
+            locked = _as_bool(record.get('locked', False)) and bool(record.get('password'))
+            new_folders.append(TodoFolder(
+                user=self.user,
+                user_folder_id=user_folder_id,
+                name=record['name'],
+                description=record.get('description', ''),
+                locked=locked,
+                password=hash_folder_password(record['password']) if locked else None,
+                priority=record.get('priority', 'medium'),
+            ))
+
+        if new_folders:
+            # user_folder_ids that exist but are hidden (pending deletion)
+            # can't be reused; move those folders to fresh ids
+            taken = set(
+                TodoFolder.objects.filter(
+                    user=self.user, user_folder_id__in=[f.user_folder_id for f in new_folders]
+                ).values_list('user_folder_id', flat=True)
+            )
+            for folder in new_folders:
+                if folder.user_folder_id in taken:
+                    folder.user_folder_id = self.next_user_folder_id
+                    self.next_user_folder_id += 1
+            TodoFolder.objects.bulk_create(new_folders)
+            created = dict(
+                TodoFolder.objects.filter(
+                    user=self.user, user_folder_id__in=[f.user_folder_id for f in new_folders]
+                ).values_list('user_folder_id', 'id')
+            )
+            self.folder_ids.update(created)
+            self.folders_created += len(new_folders)
+
+    def _import_todos(self, todos):
+        referenced = set()
+        for _, record in todos:
+            try:
+                referenced.add(_as_int(record.get('user_folder_id')))
+            except (TypeError, ValueError):
+                pass
+        referenced.discard(None)
+        self._load_folders(referenced)
+
+        folder_pks = {self.folder_ids[i] for i in referenced if i in self.folder_ids}
+        unseen = folder_pks - self.last_positions.keys()
+        if unseen:
+            # Imported todos are appended below the folder's current last todo
+            last = (
+                Todo.objects.filter(folder_id__in=unseen)
+                .values('folder_id')
+                .annotate(last=Max('position'))
+                .values_list('folder_id', 'last')
+            )
+            self.last_positions.update({pk: None for pk in unseen})
+            self.last_positions.update(last)
+
+        new_todos = []
+        for line, record in todos:
+            try:
+                user_folder_id = _as_int(record.get('user_folder_id'))
+            except (TypeError, ValueError):
+                self.error(line, 'user_folder_id must be an integer')
+                continue
+            if user_folder_id is None:
+                self.error(line, 'Folder ID is required')
+                continue
+            folder_pk = self.folder_ids.get(user_folder_id)
+            if folder_pk is None:
+                self.error(line, 'Folder not found')
+                continue
+            try:
+                fields = clean_todo(
+                    title=record.get('name') or record.get('title'),
+                    description=record.get('description', ''),
+                    priority=record.get('priority', 'medium'),
+                    due_date=record.get('due_date'),
+                    completed=_as_bool(record.get('completed', False)),
+                    status=record.get('status', 'pending'),
+                )
+            except TodoValidationError as e:
+                self.error(line, str(e))
+                continue
+
+            position = key_between(self.last_positions[folder_pk], None)
+            self.last_positions[folder_pk] = position
+            new_todos.append(Todo(user=self.user, folder_id=folder_pk, position=position, **fields))
+
+        Todo.objects.bulk_create(new_todos, batch_size=self.batch_size)
+        self.todos_created += len(new_todos)
+
+
+def import_records(user, lines, import_format='ndjson', batch_size=BATCH_SIZE):
+    if import_format not in IMPORT_FORMATS:
+        raise ValueError(f"Unsupported format '{import_format}'. Use one of: {', '.join(IMPORT_FORMATS)}")
+    records = read_ndjson(lines) if import_format == 'ndjson' else read_csv(lines)
+    return Importer(user, batch_size=batch_size).run(records)
@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from Register import sharding
+from Register.archive import archive_batch
+
+
+class Command(BaseCommand):
+    help = 'Move completed todos older than --days from the todo table into the archive table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Archive completed todos not updated for this many days')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Todos moved per transaction')
+        parser.add_argument('--max-batches', type=int, default=None, help='Stop after this many batches')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        total = batches = 0
+        for shard in sharding.shards():
+            with sharding.use(shard):
+                while options['max_batches'] is None or batches < options['max_batches']:
+                    moved = archive_batch(cutoff, batch_size=options['batch_size'])
+                    if not moved:
+                        break
+                    total += moved
+                    batches += 1
+        self.stdout.write(f'Archived {total} todos in {batches} batches')
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from Register.benchmarks import BENCHMARKS, Reporter
+
+
+class Command(BaseCommand):
+    help = 'Run Register micro-benchmarks (all of them when no name is given)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help=f"One or more of: {', '.join(sorted(BENCHMARKS))}")
+
+    def handle(self, *args, **options):
+        names = options['names'] or sorted(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError(f"Unknown benchmark(s): {', '.join(unknown)}")
+
+        out = Reporter(self.stdout)
+        # DEBUG keeps every SQL string in connection.queries, which would
+        # skew both timings and memory measurements
+        with override_settings(DEBUG=False):
+            for name in names:
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                BENCHMARKS[name](out)
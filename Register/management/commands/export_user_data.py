@@ -0,0 +1,36 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Register.exporting import EXPORT_FORMATS, stream_export
+from Register import sharding
+from Register.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = "Stream a user's folders and todos as NDJSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='Email of the user to export')
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='ndjson')
+        parser.add_argument('--gzip', action='store_true', help='Gzip-compress the output')
+        parser.add_argument('--output', '-o', default='-', help="Output file ('-' for stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            user = CustomUser.objects.get(email=options['email'])
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"User '{options['email']}' not found")
+        sharding.activate(sharding.lookup(user.id)[0])
+
+        chunks = stream_export(user, options['format'], options['gzip'])
+        if options['output'] == '-':
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+
+        with open(options['output'], 'wb') as output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stderr.write(f"Exported {user.email} to {options['output']}")
@@ -0,0 +1,39 @@
+import gzip
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Register.importing import IMPORT_FORMATS, import_records
+from Register import sharding
+from Register.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Import folders and todos for a user from an NDJSON or CSV file (as written by export_user_data)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='Email of the user to import into')
+        parser.add_argument('input', help="Input file ('-' for stdin); .gz files are decompressed")
+        parser.add_argument('--format', choices=IMPORT_FORMATS, default=None,
+                            help='Defaults to csv for *.csv / *.csv.gz files, ndjson otherwise')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            user = CustomUser.objects.get(email=options['email'])
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"User '{options['email']}' not found")
+        sharding.activate(sharding.lookup(user.id)[0])
+
+        path = options['input']
+        import_format = options['format'] or ('csv' if path.removesuffix('.gz').endswith('.csv') else 'ndjson')
+
+        if path == '-':
+            summary = import_records(user, sys.stdin.buffer, import_format, options['batch_size'])
+        else:
+            opener = gzip.open if path.endswith('.gz') else open
+            with opener(path, 'rb') as lines:
+                summary = import_records(user, lines, import_format, options['batch_size'])
+
+        self.stdout.write(json.dumps(summary, indent=2))
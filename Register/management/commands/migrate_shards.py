@@ -0,0 +1,15 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from Register import sharding
+
+
+class Command(BaseCommand):
+    help = 'Apply migrations to the default database and every shard in settings.SHARDS'
+
+    def handle(self, *args, **options):
+        # ``migrate`` alone only touches default; each shard also needs its
+        # id ranges reserved, which the post_migrate hook does per alias
+        for alias in sharding.shards():
+            self.stdout.write(f'Migrating {alias}')
+            call_command('migrate', database=alias, interactive=False, verbosity=options['verbosity'])
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from Register import sharding
+from Register.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = "Move a user's folders, todos and related rows to another shard"
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='Email of the user to move')
+        parser.add_argument('--to', dest='target', default=None,
+                            help="Target shard alias; defaults to the shard the user's id hashes to")
+        parser.add_argument('--no-wait', action='store_true',
+                            help="Don't wait for cached directory entries to expire (only when no server is running)")
+
+    def handle(self, *args, **options):
+        try:
+            user = CustomUser.objects.get(email=options['email'])
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"User '{options['email']}' not found")
+
+        source = sharding.lookup(user.id)[0]
+        target = options['target'] or sharding.home_shard(user.id)
+        if source == target:
+            self.stdout.write(f'{user.email} is already on {target}')
+            return
+
+        try:
+            moved = sharding.move_user(user, target, wait=not options['no_wait'], log=self.stdout.write)
+        except sharding.ShardError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f'Moved {user.email} from {source} to {target} ({sum(moved.values())} rows)')
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Register import sharding
+from Register.folder_deletion import claim_next_job, run_job
+
+
+class Command(BaseCommand):
+    help = 'Worker that deletes folders queued by todo_folders DELETE in bounded batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Todos deleted per transaction')
+        parser.add_argument('--sleep', type=float, default=5.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the queue and exit instead of polling')
+
+    def handle(self, *args, **options):
+        while True:
+            # Each shard queues the jobs for its own folders
+            ran = False
+            for shard in sharding.shards():
+                with sharding.use(shard):
+                    while (job := claim_next_job()) is not None:
+                        ran = True
+                        self.run(job, options['batch_size'])
+            if not ran:
+                if options['once']:
+                    return
+                time.sleep(options['sleep'])
+
+    def run(self, job, batch_size):
+        self.stdout.write(f"Deleting folder '{job.folder_name}' (job {job.id})")
+        try:
+            job = run_job(job, batch_size=batch_size)
+        except Exception as e:
+            self.stderr.write(f'Job {job.id} failed: {e}')
+            return
+        self.stdout.write(f'Job {job.id} finished: {job.deleted_todos} todos deleted')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from Register import sharding
+from Register.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete stored Idempotency-Key responses older than IDEMPOTENCY_KEY_TTL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Keys deleted per statement')
+
+    def handle(self, *args, **options):
+        removed = 0
+        for shard in sharding.shards():
+            with sharding.use(shard):
+                removed += purge_expired(batch_size=options['batch_size'])
+        self.stdout.write(f'Deleted {removed} expired idempotency keys')
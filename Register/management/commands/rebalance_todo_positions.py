@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models.functions import Length
+
+from Register import sharding
+from Register.models import Todo
+from Register.ordering import REBALANCE_LENGTH, rebalance
+
+
+class Command(BaseCommand):
+    help = 'Respace todo order keys in folders whose keys have grown long (run periodically)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-length', type=int, default=REBALANCE_LENGTH,
+                            help='Rebalance folders holding a key longer than this')
+        parser.add_argument('--folder', type=int, action='append', dest='folders',
+                            help='Rebalance this folder id regardless of key length (repeatable)')
+
+    def handle(self, *args, **options):
+        # Folder ids are unique across shards; a folder is found on one of them
+        for shard in sharding.shards():
+            with sharding.use(shard):
+                self.rebalance_shard(options)
+
+    def rebalance_shard(self, options):
+        folder_ids = options['folders']
+        if not folder_ids:
+            folder_ids = list(
+                Todo.objects.annotate(key_length=Length('position'))
+                .filter(key_length__gt=options['max_length'])
+                .order_by()
+                .values_list('folder_id', flat=True)
+                .distinct()
+            )
+
+        for folder_id in folder_ids:
+            # One short transaction per folder
+            with transaction.atomic(using=sharding.current()):
+                count = rebalance(Todo.objects.filter(folder_id=folder_id).select_for_update())
+            if count:
+                self.stdout.write(f'Rebalanced {count} todos in folder {folder_id} on {sharding.current()}')
+
+        if not folder_ids:
+            self.stdout.write(f'No folders need rebalancing on {sharding.current()}')
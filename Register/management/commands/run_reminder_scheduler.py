@@ -0,0 +1,39 @@
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+
+from Register import sharding
+from Register.reminders import run_once
+
+
+class Command(BaseCommand):
+    help = 'Long-running scheduler that sends due and overdue todo reminders (safe to run several instances)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=60.0, help='Seconds between scans')
+        parser.add_argument('--batch-size', type=int, default=500, help='Reminders claimed per batch')
+        parser.add_argument('--lookahead-days', type=int, default=0,
+                            help='Also remind about todos due within this many days')
+        parser.add_argument('--overdue-days', type=int, default=7,
+                            help='Send overdue reminders for todos up to this many days late')
+        parser.add_argument('--worker-id', default=f'{socket.gethostname()}:{os.getpid()}')
+        parser.add_argument('--once', action='store_true', help='Run a single scan and exit')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            for shard in sharding.shards():
+                with sharding.use(shard):
+                    enqueued, sent = run_once(
+                        options['worker_id'],
+                        batch_size=options['batch_size'],
+                        lookahead_days=options['lookahead_days'],
+                        overdue_days=options['overdue_days'],
+                    )
+                if enqueued or sent:
+                    self.stdout.write(f'Enqueued {enqueued} reminders, sent {sent} on {shard}')
+            if options['once']:
+                return
+            time.sleep(max(0.0, options['interval'] - (time.monotonic() - started)))
@@ -0,0 +1,30 @@
+"""Process-local counters, exposed in the Prometheus text format at /metrics/.
+
+Each worker process keeps its own counts; scrape every worker (or sum the
+series) to get service-wide totals.
+"""
+import threading
+from collections import defaultdict
+
+_counters = defaultdict(int)
+_lock = threading.Lock()
+
+
+def increment(name, amount=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] += amount
+
+
+def value(name, **labels):
+    return _counters.get((name, tuple(sorted(labels.items()))), 0)
+
+
+def render():
+    with _lock:
+        items = sorted(_counters.items())
+    lines = []
+    for (name, labels), count in items:
+        label_text = ','.join(f'{key}="{val}"' for key, val in labels)
+        lines.append(f'{name}{{{label_text}}} {count}' if label_text else f'{name} {count}')
+    return '\n'.join(lines) + '\n'
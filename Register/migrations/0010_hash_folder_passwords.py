@@ -0,0 +1,24 @@
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.db import migrations
+
+
+def hash_plaintext_passwords(apps, schema_editor):
+    TodoFolder = apps.get_model('Register', 'TodoFolder')
+    folders = TodoFolder.objects.exclude(password__isnull=True).only('id', 'password')
+    for folder in folders.iterator():
+        try:
+            identify_hasher(folder.password)
+        except ValueError:
+            folder.password = make_password(folder.password)
+            folder.save(update_fields=['password'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Register', '0009_todo_completed_todo_due_date_todo_priority_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(hash_plaintext_passwords, migrations.RunPython.noop),
+    ]
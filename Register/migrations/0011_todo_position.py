@@ -0,0 +1,60 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:01
+
+from django.db import migrations, models
+
+# Frozen copy of what Register.ordering.keys_between(None, None, n) produced
+# when this migration was written, so later changes to that module can't
+# change what the migration does
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def _increment_integer(integer):
+    head, digits = integer[0], list(integer[1:])
+    for i in range(len(digits) - 1, -1, -1):
+        d = DIGITS.index(digits[i]) + 1
+        if d < len(DIGITS):
+            digits[i] = DIGITS[d]
+            return head + ''.join(digits)
+        digits[i] = DIGITS[0]
+    # Positive integer parts only: 'a' + 1 digit, 'b' + 2 digits, ...
+    return chr(ord(head) + 1) + ''.join(digits) + DIGITS[0]
+
+
+def initial_keys(n):
+    """``n`` ascending order keys: a0, a1, ..., az, b00, b01, ..."""
+    keys, key = [], 'a' + DIGITS[0]
+    for _ in range(n):
+        keys.append(key)
+        key = _increment_integer(key)
+    return keys
+
+
+def backfill_positions(apps, schema_editor):
+    # Keep the current newest-first order inside every folder
+    Todo = apps.get_model('Register', 'Todo')
+    folder_ids = Todo.objects.order_by().values_list('folder_id', flat=True).distinct()
+    for folder_id in list(folder_ids):
+        todos = list(Todo.objects.filter(folder_id=folder_id).order_by('-created_at', '-id').only('id'))
+        for todo, key in zip(todos, initial_keys(len(todos))):
+            todo.position = key
+        Todo.objects.bulk_update(todos, ['position'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Register', '0010_hash_folder_passwords'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='todo',
+            name='position',
+            field=models.CharField(default='a0', max_length=255),
+        ),
+        migrations.RunPython(backfill_positions, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['folder', 'position'], name='todo_folder_position_idx'),
+        ),
+    ]
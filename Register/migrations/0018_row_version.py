@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Register', '0017_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='todo',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='todofolder',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:34
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Register', '0018_row_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TodoTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='todo_tags', to='Register.tag')),
+                ('todo', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='todo_tags', to='Register.todo')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='todo',
+            name='tags',
+            field=models.ManyToManyField(blank=True, related_name='todos', through='Register.TodoTag', to='Register.tag'),
+        ),
+        migrations.AddConstraint(
+            model_name='tag',
+            constraint=models.UniqueConstraint(fields=('user', 'name'), name='unique_tag_name_per_user'),
+        ),
+        migrations.AddIndex(
+            model_name='todotag',
+            index=models.Index(fields=['tag', 'todo'], name='todotag_tag_todo_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='todotag',
+            constraint=models.UniqueConstraint(fields=('todo', 'tag'), name='unique_todo_tag'),
+        ),
+    ]
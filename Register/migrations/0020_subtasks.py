@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Register', '0019_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='todo',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='Register.todo'),
+        ),
+        migrations.CreateModel(
+            name='TodoClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='Register.todo')),
+                ('descendant', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='Register.todo')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['descendant', 'depth'], name='todoclosure_descendant_idx')],
+                'constraints': [models.UniqueConstraint(fields=('ancestor', 'descendant'), name='unique_todo_closure')],
+            },
+        ),
+    ]
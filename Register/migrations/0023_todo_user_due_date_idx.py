@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Register', '0022_user_shard'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['user', 'due_date'], name='todo_user_due_date_idx'),
+        ),
+    ]
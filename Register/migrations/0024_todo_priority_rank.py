@@ -0,0 +1,60 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:55
+
+import Register.models
+from django.db import migrations, models
+from django.db.models import Case, Value, When
+
+RANKS = {'low': 1, 'medium': 2, 'high': 3}
+PRIORITY_MODELS = ('TodoFolder', 'Todo', 'ArchivedTodo')
+
+
+def names_to_ranks(apps, schema_editor):
+    # Still text columns here; the AlterFields below cast '1'..'3' to integers.
+    # The todos POST view used to accept any string, which becomes medium.
+    alias = schema_editor.connection.alias
+    for name in PRIORITY_MODELS:
+        model = apps.get_model('Register', name)
+        model.objects.using(alias).filter(priority__isnull=False).update(priority=Case(
+            *(When(priority=priority, then=Value(str(rank))) for priority, rank in RANKS.items()),
+            default=Value(str(RANKS['medium'])),
+        ))
+
+
+def ranks_to_names(apps, schema_editor):
+    alias = schema_editor.connection.alias
+    for name in PRIORITY_MODELS:
+        model = apps.get_model('Register', name)
+        model.objects.using(alias).filter(priority__isnull=False).update(priority=Case(
+            *(When(priority=str(rank), then=Value(priority)) for priority, rank in RANKS.items()),
+            default=Value('medium'),
+        ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Register', '0023_todo_user_due_date_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(names_to_ranks, ranks_to_names),
+        migrations.AlterField(
+            model_name='archivedtodo',
+            name='priority',
+            field=Register.models.PriorityField(choices=[('low', 'Low'), ('medium', 'Medium'), ('high', 'High')], default='medium'),
+        ),
+        migrations.AlterField(
+            model_name='todo',
+            name='priority',
+            field=Register.models.PriorityField(choices=[('low', 'Low'), ('medium', 'Medium'), ('high', 'High')], default='medium'),
+        ),
+        migrations.AlterField(
+            model_name='todofolder',
+            name='priority',
+            field=Register.models.PriorityField(blank=True, choices=[('low', 'Low'), ('medium', 'Medium'), ('high', 'High')], default='medium', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(models.F('user'), models.OrderBy(models.F('priority'), descending=True), models.ExpressionWrapper(models.Q(('due_date__isnull', True)), output_field=models.BooleanField()), models.F('due_date'), models.F('id'), condition=models.Q(('completed', True), ('status', 'completed'), _connector='OR', _negated=True), name='todo_next_up_idx'),
+        ),
+    ]
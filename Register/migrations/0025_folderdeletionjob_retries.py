@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-19 15:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Register', '0024_todo_priority_rank'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folderdeletionjob',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='folderdeletionjob',
+            name='retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,6 +1,9 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.base_user import BaseUserManager
+from django.utils.functional import cached_property
 
 
 
@@ -28,6 +31,8 @@ class CustomManager(BaseUserManager):
 class CustomUser(AbstractUser):
 
     auth_token = models.CharField(max_length=32, blank=True, null=True)
+    # Embedded in signed tokens; bumping it revokes them (Register/tokens.py)
+    token_version = models.PositiveIntegerField(default=0)
     email=models.EmailField(unique=True)
     username= models.CharField(max_length=200)
     first_name= models.CharField(max_length=200)
@@ -40,6 +45,66 @@ class CustomUser(AbstractUser):
     REQUIRED_FIELDS=['phone']
     objects = CustomManager()
 
+class UserShard(models.Model):
+    """Directory entry: which database holds a user's folders and todos.
+
+    Lives in the default database with the users themselves; see
+    Register/sharding.py.
+    """
+
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, primary_key=True, related_name='shard_entry')
+    shard = models.CharField(max_length=50)
+    # Set while move_user_shard copies the user's rows; requests get 503
+    moving = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'user {self.user_id} on {self.shard}'
+
+
+PRIORITY_RANKS = {'low': 1, 'medium': 2, 'high': 3}
+PRIORITY_NAMES = {rank: name for name, rank in PRIORITY_RANKS.items()}
+
+
+class PriorityField(models.PositiveSmallIntegerField):
+    """Priority as 'low'/'medium'/'high' in Python and the API, stored as 1/2/3.
+
+    The column sorts by importance, so ``order_by('-priority')`` and indexes
+    on it rank rows in the database. Lookups take the names too.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        return PRIORITY_NAMES.get(value, value)
+
+    def to_python(self, value):
+        if value is None or value in PRIORITY_RANKS:
+            return value
+        if value in PRIORITY_NAMES:
+            return PRIORITY_NAMES[value]
+        raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice', params={'value': value})
+
+    def get_prep_value(self, value):
+        value = models.Field.get_prep_value(self, value)
+        if value is None:
+            return None
+        try:
+            return PRIORITY_RANKS[value]
+        except (KeyError, TypeError):
+            raise ValueError(f"Field '{self.name}' expected one of {', '.join(PRIORITY_RANKS)} but got {value!r}.")
+
+    @cached_property
+    def validators(self):
+        # choices already bound the value; the integer range checks would
+        # compare names with numbers
+        return [*self.default_validators, *self._validators]
+
+
+class TodoFolderQuerySet(models.QuerySet):
+    def visible(self):
+        # Folders queued for background deletion are hidden from the API
+        return self.filter(pending_deletion=False)
+
+
 class TodoFolder(models.Model):
     PRIORITY_CHOICES = [
         ('low', 'Low'),
@@ -53,17 +118,24 @@ class TodoFolder(models.Model):
     description = models.TextField(blank=True, null=True)
     locked = models.BooleanField(default=False)
     password = models.CharField(max_length=128, blank=True, null=True)
-    priority = models.CharField(max_length=10,blank=True,null=True, choices=PRIORITY_CHOICES, default='medium')
+    priority = PriorityField(blank=True, null=True, choices=PRIORITY_CHOICES, default='medium')
+    pending_deletion = models.BooleanField(default=False)
+    # Bumped by every edit; see Register/concurrency.py
+    version = models.PositiveIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = TodoFolderQuerySet.as_manager()
+
     class Meta:
         unique_together = ('user', 'user_folder_id')
 
     def __str__(self):
         return f"{self.user.username}'s folder: {self.name}"
 
-class Todo(models.Model):
+class AbstractTodo(models.Model):
+    """Columns shared by the hot Todo table and the ArchivedTodo cold table."""
+
     STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('in_progress', 'In Progress'),
@@ -77,15 +149,280 @@ class Todo(models.Model):
     ]
     
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
-    folder = models.ForeignKey(TodoFolder,null=True, blank=True, on_delete=models.CASCADE, related_name='todos')
+    folder = models.ForeignKey(TodoFolder,null=True, blank=True, on_delete=models.CASCADE, related_name='%(class)ss')
     title = models.CharField(max_length=200)
     description = models.TextField(blank=True, null=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
-    priority = models.CharField(max_length=10, choices=PRIORITY_CHOICES, default='medium')
+    priority = PriorityField(choices=PRIORITY_CHOICES, default='medium')
     due_date = models.DateField(blank=True, null=True)
     completed = models.BooleanField(default=False)
+    # Fractional order key within the folder, see Register/ordering.py
+    position = models.CharField(max_length=255, default='a0')
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return self.title
+
+
+# Todos that count as done for archiving purposes
+ARCHIVABLE_TODOS = models.Q(completed=True) | models.Q(status='completed')
+OPEN_TODOS = ~ARCHIVABLE_TODOS
+# "What to do next": most important first, then the soonest due, undated
+# last. todo_next_up_idx holds the same expressions so a query ordered by
+# them with a LIMIT reads its rows straight off the index
+NEXT_UP_ORDER = (
+    models.F('priority').desc(),
+    models.ExpressionWrapper(models.Q(due_date__isnull=True), output_field=models.BooleanField()),
+    models.F('due_date'),
+    models.F('id'),
+)
+
+
+class RecurrenceRule(models.Model):
+    """A repeating todo; see Register/recurrence.py for how it is expanded."""
+
+    FREQUENCY_CHOICES = [
+        ('daily', 'Daily'),
+        ('weekly', 'Weekly'),
+        ('monthly', 'Monthly'),
+    ]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    folder = models.ForeignKey(TodoFolder, null=True, blank=True, on_delete=models.CASCADE, related_name='recurrence_rules')
+    title = models.CharField(max_length=200)
+    description = models.TextField(blank=True, null=True)
+    priority = models.CharField(max_length=10, default='medium')
+    frequency = models.CharField(max_length=10, choices=FREQUENCY_CHOICES)
+    interval = models.PositiveSmallIntegerField(default=1)
+    # Comma-separated weekday numbers (Monday=0) for weekly rules
+    weekdays = models.CharField(max_length=20, blank=True, default='')
+    start_date = models.DateField()
+    until = models.DateField(blank=True, null=True)
+    count = models.PositiveIntegerField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.title} ({self.frequency})'
+
+
+class Tag(models.Model):
+    """A user's cross-folder label; see Register/tagging.py."""
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    name = models.CharField(max_length=50)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'name'], name='unique_tag_name_per_user'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class Todo(AbstractTodo):
+    # Set on every materialized occurrence of a recurring todo
+    recurrence = models.ForeignKey(RecurrenceRule, null=True, blank=True, on_delete=models.SET_NULL, related_name='todos')
+    tags = models.ManyToManyField(Tag, through='TodoTag', related_name='todos', blank=True)
+    # Subtasks; the full hierarchy is kept in TodoClosure (Register/subtasks.py)
+    parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='children')
+    # Bumped by every edit; see Register/concurrency.py
+    version = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['folder', 'position'], name='todo_folder_position_idx'),
+            # Small partial index that lets archive_completed_todos find
+            # old completed rows without scanning the open ones
+            models.Index(fields=['updated_at'], condition=ARCHIVABLE_TODOS, name='todo_archivable_idx'),
+            # Range scans by the reminder scheduler
+            models.Index(fields=['due_date', 'completed'], name='todo_due_date_completed_idx'),
+            # A user's todos by day: agenda and occurrences
+            models.Index(fields=['user', 'due_date'], name='todo_user_due_date_idx'),
+            # A user's open todos in next-up order
+            models.Index(models.F('user'), *NEXT_UP_ORDER, condition=OPEN_TODOS, name='todo_next_up_idx'),
+        ]
+
+
+class TodoTag(models.Model):
+    # The composite indexes below lead with each column, so the default
+    # single-column foreign key indexes would only slow down tagging
+    todo = models.ForeignKey(Todo, on_delete=models.CASCADE, related_name='todo_tags', db_index=False)
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='todo_tags', db_index=False)
+
+    class Meta:
+        constraints = [
+            # Also the index for loading a list's tags by todo
+            models.UniqueConstraint(fields=['todo', 'tag'], name='unique_todo_tag'),
+        ]
+        indexes = [
+            # Tag filters are answered from this index alone
+            models.Index(fields=['tag', 'todo'], name='todotag_tag_todo_idx'),
+        ]
+
+
+class TodoClosure(models.Model):
+    """One row per (ancestor, descendant) pair of subtasks, at any depth."""
+
+    # Covered by the composite indexes below
+    ancestor = models.ForeignKey(Todo, on_delete=models.CASCADE, related_name='descendant_links', db_index=False)
+    descendant = models.ForeignKey(Todo, on_delete=models.CASCADE, related_name='ancestor_links', db_index=False)
+    # 1 for a direct child, 2 for a grandchild, ...
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='unique_todo_closure'),
+        ]
+        indexes = [
+            models.Index(fields=['descendant', 'depth'], name='todoclosure_descendant_idx'),
+        ]
+
+
+class ArchivedTodo(AbstractTodo):
+    """Completed todos moved out of the hot table by archive_completed_todos.
+
+    Rows keep their original Todo id and timestamps so they can be restored.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='archivedtodo_user_id_idx'),
+        ]
+
+
+class FolderDeletionJob(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    folder = models.ForeignKey(TodoFolder, null=True, blank=True, on_delete=models.SET_NULL, related_name='deletion_jobs')
+    folder_name = models.CharField(max_length=100)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    total_todos = models.PositiveIntegerField(null=True, blank=True)
+    deleted_todos = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    # Runs started, including ones whose worker died
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # A failed run is retried (back to pending) no earlier than this
+    retry_at = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'updated_at'], name='folder_job_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Delete '{self.folder_name}' ({self.status})"
+
+
+class Reminder(models.Model):
+    """Delivery record for one due/overdue reminder of a todo.
+
+    The unique constraint on (todo, kind, due_date) is what guarantees a
+    reminder is never sent twice, even with several schedulers running.
+    """
+
+    KIND_CHOICES = [
+        ('due', 'Due'),
+        ('overdue', 'Overdue'),
+    ]
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('claimed', 'Claimed'),
+        ('sent', 'Sent'),
+        ('skipped', 'Skipped'),
+        ('failed', 'Failed'),
+    ]
+
+    todo = models.ForeignKey(Todo, on_delete=models.CASCADE, related_name='reminders')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    due_date = models.DateField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    claimed_by = models.CharField(max_length=100, blank=True, default='')
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    sent_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['todo', 'kind', 'due_date'], name='unique_reminder_per_due_date'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'claimed_at'], name='reminder_status_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} reminder for todo {self.todo_id} ({self.status})'
+
+
+class IdempotencyKey(models.Model):
+    """Stored response of a create request sent with an ``Idempotency-Key`` header."""
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    # SHA-256 of method, path and body (or Content-Digest); a reused key must match it
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField()
+    content_type = models.CharField(max_length=100)
+    body = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key_per_user'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='idempotency_key_created_idx'),
+        ]
+
+
+class Activity(models.Model):
+    """Append-only history of changes to a user's todos and folders.
+
+    Rows are written in batches by Register/activity.py. ``object_id`` is
+    not a foreign key so entries outlive the objects they describe.
+    """
+
+    OBJECT_TYPES = [
+        ('todo', 'Todo'),
+        ('folder', 'Folder'),
+    ]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    action = models.CharField(max_length=30)
+    object_type = models.CharField(max_length=10, choices=OBJECT_TYPES)
+    object_id = models.BigIntegerField()
+    # {field: [old, new]} for updates, a summary of the object otherwise
+    changes = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    # When the change happened, not when its batch was flushed
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='activity_user_id_idx'),
+        ]
 
     def __str__(self):
-        return self.title
\ No newline at end of file
+        return f'{self.action} {self.object_type} {self.object_id}'
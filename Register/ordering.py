@@ -0,0 +1,181 @@
+"""Fractional order keys for manually sorted todos.
+
+A port of the "fractional indexing" scheme: every key is an integer part
+(a head character that encodes its length, followed by that many digits)
+plus an optional fractional part. A key strictly between any two keys can
+always be generated, so moving an item only rewrites that item's row.
+
+Only ``0-9`` and ``a-z`` are used, so keys compare the same way under byte
+ordering and under the usual locale collations. Positive integer parts use
+the heads ``a``..``z`` (2..27 characters long) and negative ones use
+``0``..``9`` (11..2 characters long).
+"""
+
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+BASE = len(DIGITS)
+INTEGER_ZERO = 'a' + DIGITS[0]
+SMALLEST_INTEGER = '0' + DIGITS[0] * 10
+
+# Keys longer than this are rewritten by the rebalance_todo_positions command.
+REBALANCE_LENGTH = 24
+
+
+def _integer_length(head):
+    if 'a' <= head <= 'z':
+        return ord(head) - ord('a') + 2
+    if '0' <= head <= '9':
+        return ord('9') - ord(head) + 2
+    raise ValueError(f'Invalid order key head: {head!r}')
+
+
+def _integer_part(key):
+    length = _integer_length(key[0])
+    if length > len(key):
+        raise ValueError(f'Invalid order key: {key!r}')
+    return key[:length]
+
+
+def _validate(key):
+    if key == SMALLEST_INTEGER:
+        raise ValueError(f'Invalid order key: {key!r}')
+    integer = _integer_part(key)
+    if key[len(integer):].endswith(DIGITS[0]):
+        raise ValueError(f'Invalid order key: {key!r}')
+
+
+def _midpoint(a, b):
+    # Fractional parts only; ``b`` of None means "1.0".
+    if b is not None:
+        n = 0
+        while n < len(b) and (a[n] if n < len(a) else DIGITS[0]) == b[n]:
+            n += 1
+        if n > 0:
+            return b[:n] + _midpoint(a[n:], b[n:])
+
+    digit_a = DIGITS.index(a[0]) if a else 0
+    digit_b = DIGITS.index(b[0]) if b is not None else BASE
+    if digit_b - digit_a > 1:
+        return DIGITS[(digit_a + digit_b + 1) // 2]
+    if b is not None and len(b) > 1:
+        return b[:1]
+    return DIGITS[digit_a] + _midpoint(a[1:], None)
+
+
+def _increment_integer(integer):
+    head, digits = integer[0], list(integer[1:])
+    for i in range(len(digits) - 1, -1, -1):
+        d = DIGITS.index(digits[i]) + 1
+        if d < BASE:
+            digits[i] = DIGITS[d]
+            return head + ''.join(digits)
+        digits[i] = DIGITS[0]
+
+    if head == '9':
+        return 'a' + DIGITS[0]
+    if head == 'z':
+        return None
+    new_head = chr(ord(head) + 1)
+    if new_head > 'a':
+        digits.append(DIGITS[0])
+    else:
+        digits.pop()
+    return new_head + ''.join(digits)
+
+
+def _decrement_integer(integer):
+    head, digits = integer[0], list(integer[1:])
+    for i in range(len(digits) - 1, -1, -1):
+        d = DIGITS.index(digits[i]) - 1
+        if d >= 0:
+            digits[i] = DIGITS[d]
+            return head + ''.join(digits)
+        digits[i] = DIGITS[-1]
+
+    if head == 'a':
+        return '9' + DIGITS[-1]
+    if head == '0':
+        return None
+    new_head = chr(ord(head) - 1)
+    if new_head <= '9':
+        digits.append(DIGITS[-1])
+    else:
+        digits.pop()
+    return new_head + ''.join(digits)
+
+
+def key_between(a, b):
+    """Return a key sorting strictly between ``a`` and ``b``.
+
+    Either bound may be None, meaning "before everything" / "after everything".
+    """
+    if a is not None:
+        _validate(a)
+    if b is not None:
+        _validate(b)
+    if a is not None and b is not None and a >= b:
+        raise ValueError(f'{a!r} must sort before {b!r}')
+
+    if a is None:
+        if b is None:
+            return INTEGER_ZERO
+        integer_b = _integer_part(b)
+        if integer_b == SMALLEST_INTEGER:
+            return integer_b + _midpoint('', b[len(integer_b):])
+        if integer_b < b:
+            return integer_b
+        result = _decrement_integer(integer_b)
+        if result is None:
+            raise ValueError('Cannot generate a key before the smallest key')
+        return result
+
+    integer_a = _integer_part(a)
+    fraction_a = a[len(integer_a):]
+    if b is None:
+        result = _increment_integer(integer_a)
+        return result if result is not None else integer_a + _midpoint(fraction_a, None)
+
+    integer_b = _integer_part(b)
+    if integer_a == integer_b:
+        return integer_a + _midpoint(fraction_a, b[len(integer_b):])
+    result = _increment_integer(integer_a)
+    if result is None:
+        raise ValueError('Cannot generate a key after the largest key')
+    return result if result < b else integer_a + _midpoint(fraction_a, None)
+
+
+def keys_between(a, b, n):
+    """Return ``n`` ascending keys between ``a`` and ``b``, kept short."""
+    if n <= 0:
+        return []
+    if n == 1:
+        return [key_between(a, b)]
+    if b is None:
+        keys = []
+        key = key_between(a, None)
+        for _ in range(n):
+            keys.append(key)
+            key = key_between(key, None)
+        return keys
+    if a is None:
+        keys = []
+        key = key_between(None, b)
+        for _ in range(n):
+            keys.append(key)
+            key = key_between(None, key)
+        return keys[::-1]
+    mid = n // 2
+    middle = key_between(a, b)
+    return keys_between(a, middle, mid) + [middle] + keys_between(middle, b, n - mid - 1)
+
+
+def rebalance(queryset, batch_size=1000):
+    """Rewrite the keys of ``queryset`` to short, evenly spaced ones.
+
+    The current order (by position, then id) is preserved. Callers should run
+    this inside a transaction.
+    """
+    rows = list(queryset.order_by('position', 'id').only('id', 'position'))
+    for row, key in zip(rows, keys_between(None, None, len(rows))):
+        row.position = key
+    queryset.model.objects.bulk_update(rows, ['position'], batch_size=batch_size)
+    return len(rows)
@@ -0,0 +1,115 @@
+"""Token-bucket rate limiting for the login and register endpoints.
+
+Each limit in ``AUTH_RATE_LIMITS`` is ``"<tokens>/<s|m|h>"``: a bucket holds
+up to ``tokens`` attempts and refills at that many per period. Buckets live
+in this process (``RATE_LIMIT_BACKEND = 'local'``) or in the shared Django
+cache (``'cache'``), which is what several workers or instances need to
+enforce one limit between them.
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600}
+
+DEFAULT_LIMITS = {
+    'login_ip': '30/m',
+    'login_email': '10/m',
+    'register_ip': '10/h',
+    'register_email': '5/h',
+}
+
+
+def parse_rate(rate):
+    """``'10/m'`` -> (capacity 10, refill of 10 per 60 seconds as tokens/second)."""
+    tokens, _, period = rate.partition('/')
+    capacity = int(tokens)
+    return capacity, capacity / PERIODS[period]
+
+
+class LocalBuckets:
+    """Buckets in a bounded in-process LRU dict."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, refill, now):
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill)
+            retry_after = 0.0 if tokens >= 1 else (1 - tokens) / refill
+            self._buckets[key] = (tokens - 1 if tokens >= 1 else tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+
+class CacheBuckets:
+    """Buckets in the shared cache.
+
+    Read-modify-write without a lock: concurrent attempts on one key can
+    slip a few extra requests through, which is fine for throttling.
+    """
+
+    def __init__(self, alias='default'):
+        self.cache = caches[alias]
+
+    def take(self, key, capacity, refill, now):
+        cache_key = 'ratelimit:' + hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+        tokens, updated = self.cache.get(cache_key) or (capacity, now)
+        tokens = min(capacity, tokens + (now - updated) * refill)
+        retry_after = 0.0 if tokens >= 1 else (1 - tokens) / refill
+        # Expire once the bucket would be full again anyway
+        self.cache.set(cache_key, (tokens - 1 if tokens >= 1 else tokens, now), math.ceil(capacity / refill) + 1)
+        return retry_after
+
+
+_local_buckets = LocalBuckets()
+_limits = {}
+
+
+def _buckets():
+    if getattr(settings, 'RATE_LIMIT_BACKEND', 'local') == 'cache':
+        return CacheBuckets()
+    return _local_buckets
+
+
+def _limit(scope):
+    if scope not in _limits:
+        rates = {**DEFAULT_LIMITS, **getattr(settings, 'AUTH_RATE_LIMITS', {})}
+        _limits[scope] = parse_rate(rates[scope])
+    return _limits[scope]
+
+
+def client_ip(request):
+    # Behind N trusted proxies the client is the Nth address from the right
+    # of X-Forwarded-For; anything further left can be forged by the client
+    proxies = getattr(settings, 'NUM_PROXIES', 0)
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    if proxies and forwarded:
+        addresses = [address.strip() for address in forwarded.split(',')]
+        return addresses[-min(proxies, len(addresses))]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def hit(scope, value):
+    """Spend one attempt of ``scope`` for ``value``.
+
+    Returns 0 when allowed, otherwise the seconds until the next attempt.
+    """
+    if not getattr(settings, 'RATE_LIMIT_ENABLED', True):
+        return 0.0
+    capacity, refill = _limit(scope)
+    retry_after = _buckets().take(f'{scope}:{value}', capacity, refill, time.time())
+    if retry_after:
+        metrics.increment('auth_rate_limited_total', scope=scope)
+    return retry_after
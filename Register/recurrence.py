@@ -0,0 +1,234 @@
+"""Lazy expansion of recurring todos.
+
+A RecurrenceRule is stored once; only its next occurrence exists as a real
+Todo. Other occurrences are computed on demand: the first occurrence in a
+window is found arithmetically from the rule's start date, so listing a
+window costs O(occurrences in the window) rather than O(occurrences since
+the rule started).
+"""
+import calendar
+from datetime import date, datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Max, Q
+
+from . import sharding
+from .models import RecurrenceRule, Todo
+from .ordering import key_between
+
+WEEKDAY_NAMES = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+FREQUENCIES = ('daily', 'weekly', 'monthly')
+
+
+class RecurrenceError(ValueError):
+    pass
+
+
+def _add_months(start, months):
+    month_index = start.month - 1 + months
+    year, month = start.year + month_index // 12, month_index % 12 + 1
+    # Clamp e.g. Jan 31 + 1 month to the last day of February
+    return date(year, month, min(start.day, calendar.monthrange(year, month)[1]))
+
+
+def _weekdays(rule):
+    if rule.weekdays:
+        return sorted(int(day) for day in rule.weekdays.split(','))
+    return [rule.start_date.weekday()]
+
+
+def _daily(rule, start):
+    step = rule.interval
+    k = max(0, -(-(start - rule.start_date).days // step))  # ceil division
+    while True:
+        yield k, rule.start_date + timedelta(days=k * step)
+        k += 1
+
+
+def _weekly(rule, start):
+    days = _weekdays(rule)
+    anchor = rule.start_date - timedelta(days=rule.start_date.weekday())  # Monday of the first week
+    first_week = [d for d in days if anchor + timedelta(days=d) >= rule.start_date]
+    # Active weeks are every ``interval`` weeks from the anchor week
+    week = max(0, (start - anchor).days // 7 // rule.interval)
+    while True:
+        week_start = anchor + timedelta(weeks=week * rule.interval)
+        for position, d in enumerate(first_week if week == 0 else days):
+            index = position if week == 0 else len(first_week) + (week - 1) * len(days) + position
+            yield index, week_start + timedelta(days=d)
+        week += 1
+
+
+def _monthly(rule, start):
+    months = (start.year - rule.start_date.year) * 12 + start.month - rule.start_date.month
+    k = max(0, months // rule.interval - 1)
+    while True:
+        yield k, _add_months(rule.start_date, k * rule.interval)
+        k += 1
+
+
+_EXPANDERS = {'daily': _daily, 'weekly': _weekly, 'monthly': _monthly}
+
+
+def iter_occurrences(rule, start):
+    """Yield occurrence dates on or after ``start`` in order, honouring until/count."""
+    start = max(start, rule.start_date)
+    for index, day in _EXPANDERS[rule.frequency](rule, start):
+        if rule.count is not None and index >= rule.count:
+            return
+        if rule.until is not None and day > rule.until:
+            return
+        if day >= start:
+            yield day
+
+
+def occurrences(rule, start, end):
+    """Occurrence dates of ``rule`` within ``[start, end]``."""
+    result = []
+    for day in iter_occurrences(rule, start):
+        if day > end:
+            break
+        result.append(day)
+    return result
+
+
+def next_occurrence(rule, after):
+    """First occurrence strictly after ``after``, or None when the rule has ended."""
+    return next(iter_occurrences(rule, after + timedelta(days=1)), None)
+
+
+def _parse_weekdays(value):
+    if isinstance(value, str):
+        value = [part for part in value.split(',') if part]
+    days = set()
+    for day in value or []:
+        if isinstance(day, str) and day.strip().upper()[:2] in WEEKDAY_NAMES:
+            days.add(WEEKDAY_NAMES.index(day.strip().upper()[:2]))
+        elif isinstance(day, int) and 0 <= day <= 6:
+            days.add(day)
+        else:
+            raise RecurrenceError('weekdays must be 0-6 (Monday=0) or MO..SU')
+    return ','.join(str(day) for day in sorted(days))
+
+
+def _parse_rrule(text):
+    """Map the supported subset of an RFC 5545 RRULE onto rule fields."""
+    parts = {}
+    for part in text.upper().removeprefix('RRULE:').split(';'):
+        if '=' not in part:
+            raise RecurrenceError(f"Invalid RRULE part '{part}'")
+        key, value = part.split('=', 1)
+        parts[key] = value
+
+    fields = {
+        'frequency': parts.pop('FREQ', '').lower(),
+        'interval': parts.pop('INTERVAL', 1),
+        'weekdays': parts.pop('BYDAY', ''),
+        'count': parts.pop('COUNT', None),
+        'until': parts.pop('UNTIL', None),
+    }
+    if parts:
+        raise RecurrenceError(f"Unsupported RRULE parts: {', '.join(sorted(parts))}")
+    if fields['until']:
+        try:
+            fields['until'] = datetime.strptime(fields['until'][:8], '%Y%m%d').date().isoformat()
+        except ValueError:
+            raise RecurrenceError('UNTIL must look like YYYYMMDD')
+    return fields
+
+
+def clean_rule(data):
+    """Validate a recurrence payload (fields or an ``rrule`` string)."""
+    if data.get('rrule'):
+        data = _parse_rrule(data['rrule'])
+
+    frequency = data.get('frequency')
+    if frequency not in FREQUENCIES:
+        raise RecurrenceError(f"frequency must be one of: {', '.join(FREQUENCIES)}")
+
+    try:
+        interval = int(data.get('interval') or 1)
+        count = int(data['count']) if data.get('count') not in (None, '') else None
+    except (TypeError, ValueError):
+        raise RecurrenceError('interval and count must be integers')
+    if interval < 1 or (count is not None and count < 1):
+        raise RecurrenceError('interval and count must be positive')
+
+    until = data.get('until')
+    if until:
+        try:
+            until = datetime.strptime(until, '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            raise RecurrenceError('Invalid until date format. Use YYYY-MM-DD')
+
+    weekdays = _parse_weekdays(data.get('weekdays')) if frequency == 'weekly' else ''
+
+    return {
+        'frequency': frequency,
+        'interval': interval,
+        'weekdays': weekdays,
+        'until': until or None,
+        'count': count,
+    }
+
+
+def is_done(todo):
+    return bool(todo.completed) or todo.status == 'completed'
+
+
+def materialize_next(todo):
+    """Create the occurrence that follows ``todo`` once it has been completed.
+
+    Only the latest occurrence of a rule spawns a new one, so completing an
+    older occurrence again is a no-op. Returns the new Todo or None.
+    """
+    if todo.recurrence_id is None or todo.due_date is None:
+        return None
+
+    with transaction.atomic(using=sharding.current()):
+        # Lock the rule so two devices completing the same todo can't both
+        # create the next occurrence
+        rule = RecurrenceRule.objects.select_for_update().get(id=todo.recurrence_id)
+        if rule.todos.filter(due_date__gt=todo.due_date).exists():
+            return None
+        next_date = next_occurrence(rule, todo.due_date)
+        if next_date is None:
+            return None
+
+        # Later occurrences follow the latest edits of the series
+        rule.title, rule.description, rule.priority = todo.title, todo.description, todo.priority
+        rule.save(update_fields=['title', 'description', 'priority', 'updated_at'])
+
+        first_position = (
+            Todo.objects.filter(folder_id=todo.folder_id)
+            .order_by('position')
+            .values_list('position', flat=True)
+            .first()
+        )
+        return Todo.objects.create(
+            user_id=todo.user_id,
+            folder_id=todo.folder_id,
+            recurrence=rule,
+            title=todo.title,
+            description=todo.description,
+            priority=todo.priority,
+            due_date=next_date,
+            position=key_between(None, first_position),
+        )
+
+
+def expand_for_user(user, start, end):
+    """Virtual (not yet materialized) occurrences of ``user``'s rules in the window."""
+    rules = (
+        RecurrenceRule.objects.filter(user=user, start_date__lte=end)
+        .filter(Q(until__isnull=True) | Q(until__gte=start))
+        .exclude(folder__pending_deletion=True)
+        .annotate(last_materialized=Max('todos__due_date'))
+    )
+    for rule in rules:
+        # Dates up to the latest real occurrence are represented by Todos
+        window_start = start
+        if rule.last_materialized is not None:
+            window_start = max(start, rule.last_materialized + timedelta(days=1))
+        for day in occurrences(rule, window_start, end):
+            yield rule, day
@@ -0,0 +1,181 @@
+"""Due-date reminders.
+
+The ``run_reminder_scheduler`` command repeatedly:
+
+1. enqueues Reminder rows for open todos that are due (or overdue) using a
+   range scan on the ``(due_date, completed)`` index; the unique constraint
+   on (todo, kind, due_date) makes enqueueing idempotent,
+2. claims a batch of pending reminders with a conditional UPDATE tagged with
+   a per-batch claim token, so several scheduler instances never deliver the
+   same reminder,
+3. hands the batch to the configured sender and records the outcome.
+"""
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import sharding
+from .models import Reminder, Todo
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+
+
+class BaseReminderSender:
+    """Delivers reminders; subclasses implement ``send_messages``."""
+
+    def send_messages(self, reminders):
+        """Deliver ``reminders`` and return the ids that were delivered."""
+        raise NotImplementedError
+
+
+def format_reminder(reminder):
+    todo = reminder.todo
+    if reminder.kind == 'due':
+        return f"'{todo.title}' is due on {reminder.due_date:%Y-%m-%d}"
+    return f"'{todo.title}' was due on {reminder.due_date:%Y-%m-%d} and is overdue"
+
+
+class ConsoleReminderSender(BaseReminderSender):
+    """Logs reminders instead of delivering them (local stub backend)."""
+
+    def send_messages(self, reminders):
+        for reminder in reminders:
+            logger.info('Reminder for %s: %s', reminder.todo.user.email, format_reminder(reminder))
+        return [reminder.id for reminder in reminders]
+
+
+# Reminders "sent" by LocMemReminderSender, for local development and tests
+outbox = []
+
+
+class LocMemReminderSender(BaseReminderSender):
+    def send_messages(self, reminders):
+        for reminder in reminders:
+            outbox.append({
+                'reminder_id': reminder.id,
+                'email': reminder.todo.user.email,
+                'message': format_reminder(reminder),
+            })
+        return [reminder.id for reminder in reminders]
+
+
+def get_sender():
+    backend = getattr(settings, 'REMINDER_SENDER', 'Register.reminders.ConsoleReminderSender')
+    return import_string(backend)()
+
+
+def _open_todos(start, end):
+    # Served by the (due_date, completed) index
+    return (
+        Todo.objects.filter(due_date__gte=start, due_date__lte=end, completed=False)
+        .exclude(status='completed')
+        .exclude(folder__pending_deletion=True)
+    )
+
+
+def enqueue(today, lookahead_days=0, overdue_days=7, batch_size=1000):
+    """Create missing reminder rows; returns how many were created."""
+    windows = [
+        ('due', today, today + timedelta(days=lookahead_days)),
+        ('overdue', today - timedelta(days=overdue_days), today - timedelta(days=1)),
+    ]
+    created = 0
+    for kind, start, end in windows:
+        todos = _open_todos(start, end).exclude(
+            Exists(Reminder.objects.filter(todo=OuterRef('pk'), kind=kind, due_date=OuterRef('due_date')))
+        )
+        batch = []
+        for todo_id, due_date in todos.values_list('id', 'due_date').iterator(chunk_size=batch_size):
+            batch.append(Reminder(todo_id=todo_id, kind=kind, due_date=due_date))
+            if len(batch) >= batch_size:
+                created += len(Reminder.objects.bulk_create(batch, ignore_conflicts=True))
+                batch = []
+        if batch:
+            created += len(Reminder.objects.bulk_create(batch, ignore_conflicts=True))
+    return created
+
+
+def claim(worker_id, batch_size=500, stale_after=timedelta(minutes=5)):
+    """Claim up to ``batch_size`` reminders for this worker.
+
+    Reminders claimed by a worker that stopped before recording an outcome,
+    and failed deliveries waiting for a retry, become claimable again after
+    ``stale_after``.
+    """
+    now = timezone.now()
+    retry_before = now - stale_after
+    claimable = (
+        Q(status='pending', claimed_at__isnull=True)
+        | Q(status__in=['pending', 'claimed'], claimed_at__lt=retry_before)
+    )
+    token = f'{worker_id}:{uuid.uuid4().hex[:12]}'
+
+    with transaction.atomic(using=sharding.current()):
+        # SKIP LOCKED lets PostgreSQL workers take disjoint batches; the
+        # conditional UPDATE below keeps claiming safe on other backends
+        ids = list(
+            Reminder.objects.select_for_update(skip_locked=True)
+            .filter(claimable)
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return []
+        Reminder.objects.filter(claimable, id__in=ids).update(
+            status='claimed', claimed_by=token, claimed_at=now, attempts=F('attempts') + 1
+        )
+
+    return list(Reminder.objects.filter(claimed_by=token, status='claimed').select_related('todo__user'))
+
+
+def deliver(reminders, sender):
+    """Send claimed reminders and record the outcome; returns the number sent."""
+    if not reminders:
+        return 0
+    # Outcomes are only recorded while this batch's claim still holds: a
+    # reminder reclaimed after going stale belongs to the newer claim
+    claimed = Reminder.objects.filter(status='claimed', claimed_by=reminders[0].claimed_by)
+
+    # The todo may have been completed or rescheduled since it was enqueued
+    stale = [r.id for r in reminders if r.todo.completed or r.todo.status == 'completed' or r.todo.due_date != r.due_date]
+    live = [r for r in reminders if r.id not in stale]
+    if stale:
+        claimed.filter(id__in=stale).update(status='skipped')
+
+    if not live:
+        return 0
+
+    try:
+        sent_ids = set(sender.send_messages(live))
+        error = 'Not delivered by sender'
+    except Exception as e:
+        logger.exception('Reminder sender failed')
+        sent_ids, error = set(), str(e)
+
+    if sent_ids:
+        claimed.filter(id__in=sent_ids).update(status='sent', sent_at=timezone.now(), last_error='')
+    failed = [r.id for r in live if r.id not in sent_ids]
+    if failed:
+        claimed.filter(id__in=failed, attempts__lt=MAX_ATTEMPTS).update(status='pending', last_error=error)
+        claimed.filter(id__in=failed, attempts__gte=MAX_ATTEMPTS).update(status='failed', last_error=error)
+    return len(sent_ids)
+
+
+def run_once(worker_id, sender=None, batch_size=500, lookahead_days=0, overdue_days=7):
+    sender = sender or get_sender()
+    enqueued = enqueue(timezone.localdate(), lookahead_days, overdue_days)
+    sent = 0
+    while True:
+        batch = claim(worker_id, batch_size)
+        if not batch:
+            break
+        sent += deliver(batch, sender)
+    return enqueued, sent
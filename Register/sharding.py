@@ -0,0 +1,327 @@
+"""Horizontal sharding of user data.
+
+Users, their tokens and the shard directory live in the default database.
+Everything a user owns (folders, todos and the tables hanging off them) lives
+on one shard, one of the aliases in ``settings.SHARDS``:
+
+* New users are placed by a stable hash of their id and the choice is
+  recorded in the UserShard directory; users without an entry predate
+  sharding and stay on ``default``. Adding shards only affects new users.
+* ``authenticate_request`` looks the user's shard up (through the cache, for
+  ``SHARD_DIRECTORY_CACHE_TTL`` seconds) and activates it for the request.
+  ``ShardRouter`` then sends every query on a sharded model there, so views
+  stay shard-local without naming a database. Code that opens transactions
+  or raw cursors passes ``using=current()``.
+* Each shard also holds a copy of its users' rows so foreign keys to
+  CustomUser hold there. Only the default copy is ever updated; the others
+  are anchors.
+* Ids must survive a move, so every shard allocates ids for the sharded
+  tables from its own range of ``SHARD_ID_SPAN`` values.
+
+``move_user`` (the ``move_user_shard`` command) rebalances a user: it marks
+the directory entry as moving, waits out the directory cache so no process
+still writes to the old shard, copies the rows, flips the entry and deletes
+the old copies. Deleting a user likewise starts with ``delete_user_data``,
+as the database cascade only reaches default.
+"""
+import time
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max
+
+from .models import CustomUser, UserShard
+
+# Models routed to the active shard, parents first, with the lookup that
+# selects one user's rows
+USER_DATA = [
+    ('TodoFolder', 'user_id'),
+    ('RecurrenceRule', 'user_id'),
+    ('Tag', 'user_id'),
+    ('Todo', 'user_id'),
+    ('TodoTag', 'todo__user_id'),
+    ('TodoClosure', 'ancestor__user_id'),
+    ('ArchivedTodo', 'user_id'),
+    ('FolderDeletionJob', 'user_id'),
+    ('Reminder', 'todo__user_id'),
+    ('IdempotencyKey', 'user_id'),
+    ('Activity', 'user_id'),
+]
+SHARDED_MODELS = {f'Register.{name}' for name, _ in USER_DATA}
+
+# 2**40 ids per shard, far more than one database will ever hand out
+SHARD_ID_SPAN = 2 ** 40
+COPY_BATCH_SIZE = 2000
+
+_active = ContextVar('active_shard', default=None)
+
+
+class ShardError(Exception):
+    pass
+
+
+def shards():
+    return list(getattr(settings, 'SHARDS', [DEFAULT_DB_ALIAS]))
+
+
+def current():
+    """Alias of the shard activated for this request or block."""
+    return _active.get() or DEFAULT_DB_ALIAS
+
+
+def activate(alias):
+    _active.set(alias)
+
+
+@contextmanager
+def use(alias):
+    """Route sharded models to ``alias`` inside the block (commands, jobs)."""
+    token = _active.set(alias)
+    try:
+        yield alias
+    finally:
+        _active.reset(token)
+
+
+def shard_middleware(get_response):
+    # Nothing activated in one request may leak into the next on this thread
+    def middleware(request):
+        token = _active.set(None)
+        try:
+            return get_response(request)
+        finally:
+            _active.reset(token)
+    return middleware
+
+
+def home_shard(user_id):
+    """The shard the hash picks for ``user_id`` among the configured shards."""
+    aliases = shards()
+    return aliases[zlib.crc32(str(user_id).encode()) % len(aliases)]
+
+
+def _directory_key(user_id):
+    return f'user-shard:{user_id}'
+
+
+def lookup(user_id):
+    """``(alias, moving)`` for ``user_id``, read through the cache."""
+    entry = cache.get(_directory_key(user_id))
+    if entry is None:
+        row = UserShard.objects.filter(user_id=user_id).values_list('shard', 'moving').first()
+        entry = tuple(row) if row else (DEFAULT_DB_ALIAS, False)
+        cache.set(_directory_key(user_id), entry, getattr(settings, 'SHARD_DIRECTORY_CACHE_TTL', 30))
+    return entry
+
+
+def place(user):
+    """Choose the shard for a new ``user`` and record it; returns the alias.
+
+    Run it in the transaction creating the user, so no user exists without
+    a directory entry.
+    """
+    alias = home_shard(user.id)
+    if alias != DEFAULT_DB_ALIAS:
+        with transaction.atomic(using=alias):
+            _copy_rows(CustomUser, {'id': user.id}, DEFAULT_DB_ALIAS, alias)
+    UserShard.objects.create(user=user, shard=alias)
+    cache.delete(_directory_key(user.id))
+    return alias
+
+
+class ShardRouter:
+    """Send sharded models to the active shard, everything else to default."""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label not in SHARDED_MODELS:
+            return None
+        # Related objects come from the database of the row they hang off
+        instance = hints.get('instance')
+        if instance is not None and instance._meta.label in SHARDED_MODELS and instance._state.db:
+            return instance._state.db
+        return _active.get()
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Shards have the same schema and carry copies of their users' rows
+        if obj1._meta.app_label == obj2._meta.app_label == 'Register':
+            return True
+        return None
+
+
+def _models():
+    from django.apps import apps
+
+    return [(apps.get_model('Register', name), lookup) for name, lookup in USER_DATA]
+
+
+def _copy_rows(model, filters, source, target):
+    """Copy rows as they are, ids and timestamps included; returns the count.
+
+    Plain INSERTs rather than ``bulk_create``, which would refresh
+    ``auto_now`` columns.
+    """
+    connection = connections[target]
+    fields = model._meta.concrete_fields
+    quote = connection.ops.quote_name
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(model._meta.db_table),
+        ', '.join(quote(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)),
+    )
+    rows = (
+        model._base_manager.using(source).filter(**filters).order_by('pk')
+        .values_list(*(field.attname for field in fields))
+        .iterator(chunk_size=COPY_BATCH_SIZE)
+    )
+    copied = 0
+    batch = []
+    with connection.cursor() as cursor:
+        for row in rows:
+            batch.append([field.get_db_prep_save(value, connection) for field, value in zip(fields, row)])
+            if len(batch) == COPY_BATCH_SIZE:
+                cursor.executemany(sql, batch)
+                copied += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+            copied += len(batch)
+    return copied
+
+
+def _delete_rows(model, filters, using):
+    deleted = 0
+    rows = model._base_manager.using(using).filter(**filters)
+    while True:
+        ids = list(rows.values_list('pk', flat=True)[:COPY_BATCH_SIZE])
+        if not ids:
+            return deleted
+        model._base_manager.using(using).filter(pk__in=ids).delete()
+        deleted += len(ids)
+
+
+def _last_id(connection, model):
+    """Last id handed out by ``model``'s sequence, and the sequence's name."""
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table])
+            row = cursor.fetchone()
+            return (row[0] if row else 0), table
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [table, model._meta.pk.column])
+        sequence = cursor.fetchone()[0]
+        cursor.execute(f'SELECT last_value, is_called FROM {sequence}')
+        last, called = cursor.fetchone()
+        return (last if called else last - 1), sequence
+
+
+def reserve_id_range(alias):
+    """Point the id sequences of ``alias``'s sharded tables into its range.
+
+    Copying rows in from another shard can drag SQLite's counters into that
+    shard's range; running this again afterwards puts them back. SQLite
+    never hands out an id below the largest one in a table, so a SQLite
+    shard can't take rows from a shard with a higher range (ShardError).
+    """
+    connection = connections[alias]
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        raise ShardError(f'Id ranges are not supported on {connection.vendor}')
+    start = shards().index(alias) * SHARD_ID_SPAN
+    end = start + SHARD_ID_SPAN
+    for model, _ in _models():
+        rows = model._base_manager.using(alias)
+        if connection.vendor == 'sqlite' and rows.filter(pk__gte=end).exists():
+            raise ShardError(f'{model.__name__} rows from a higher shard would push {alias} out of its id range')
+        highest = rows.filter(pk__gte=start, pk__lt=end).aggregate(Max('pk'))['pk__max']
+        last, sequence = _last_id(connection, model)
+        # Never hand out an id twice, even one whose row was deleted
+        value = max(start, highest or 0, last if start <= last < end else 0)
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT setval(%s, %s, %s)', [sequence, max(value, 1), value > 0])
+            else:
+                cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s', [value, sequence])
+                if not cursor.rowcount:
+                    cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [sequence, value])
+
+
+def reserve_id_ranges_after_migrate(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    # default keeps the range starting at 0 its existing rows already use
+    if using in shards() and using != DEFAULT_DB_ALIAS:
+        reserve_id_range(using)
+
+
+def move_user(user, target, wait=True, log=lambda message: None):
+    """Move all of ``user``'s data to the ``target`` shard.
+
+    Returns ``{model name: rows moved}``. The user gets 503 responses while
+    the move runs. Safe to run again after a failure: rows left on the
+    target by an earlier attempt are replaced.
+    """
+    if target not in shards():
+        raise ShardError(f"Unknown shard '{target}'. Use one of: {', '.join(shards())}")
+    entry, _ = UserShard.objects.get_or_create(user=user, defaults={'shard': DEFAULT_DB_ALIAS})
+    source = entry.shard
+    if source == target:
+        return {}
+
+    UserShard.objects.filter(user=user).update(moving=True)
+    cache.delete(_directory_key(user.id))
+    if wait:
+        ttl = getattr(settings, 'SHARD_DIRECTORY_CACHE_TTL', 30)
+        log(f'Waiting {ttl}s for cached directory entries to expire')
+        time.sleep(ttl)
+
+    moved = {}
+    try:
+        with transaction.atomic(using=target):
+            if target != DEFAULT_DB_ALIAS and not CustomUser.objects.using(target).filter(id=user.id).exists():
+                _copy_rows(CustomUser, {'id': user.id}, DEFAULT_DB_ALIAS, target)
+            for model, lookup in reversed(_models()):
+                _delete_rows(model, {lookup: user.id}, target)
+            for model, lookup in _models():
+                moved[model.__name__] = _copy_rows(model, {lookup: user.id}, source, target)
+                log(f'Copied {moved[model.__name__]} {model.__name__} rows')
+            reserve_id_range(target)
+    except Exception:
+        UserShard.objects.filter(user=user).update(moving=False)
+        cache.delete(_directory_key(user.id))
+        raise
+
+    UserShard.objects.filter(user=user).update(shard=target, moving=False)
+    cache.delete(_directory_key(user.id))
+
+    with transaction.atomic(using=source):
+        for model, lookup in reversed(_models()):
+            _delete_rows(model, {lookup: user.id}, source)
+        if source != DEFAULT_DB_ALIAS:
+            CustomUser.objects.using(source).filter(id=user.id).delete()
+    return moved
+
+
+def delete_user_data(user):
+    """Delete ``user``'s rows and anchor copy from their shard.
+
+    Deleting the user only cascades on default, so call this first. Returns
+    ``{model name: rows deleted}``; raises ShardError while the user is
+    being moved.
+    """
+    entry = UserShard.objects.filter(user=user).values_list('shard', 'moving').first()
+    alias, moving = entry or (DEFAULT_DB_ALIAS, False)
+    if moving:
+        raise ShardError(f'User {user.id} is being moved between shards')
+    if alias == DEFAULT_DB_ALIAS:
+        return {}
+
+    deleted = {}
+    with transaction.atomic(using=alias):
+        for model, lookup in reversed(_models()):
+            deleted[model.__name__] = _delete_rows(model, {lookup: user.id}, alias)
+        CustomUser.objects.using(alias).filter(id=user.id).delete()
+    cache.delete(_directory_key(user.id))
+    return deleted
@@ -0,0 +1,147 @@
+"""Subtask hierarchy kept in a closure table.
+
+``Todo.parent`` holds the direct parent. TodoClosure additionally stores one
+row for every (ancestor, descendant) pair with its distance, so reading a
+subtree, rolling up completion and moving or deleting a branch each take a
+fixed number of queries however deep the tree is. Todos without a parent
+or children have no closure rows at all.
+
+Every write to ``Todo.parent`` must go through ``attach``/``move`` so the
+closure rows stay in sync. Deleting a todo cascades to its closure rows and,
+through ``parent``, to its whole branch.
+"""
+from django.db import connections
+from django.db.models import Count, Q
+
+from . import sharding
+from .models import Todo, TodoClosure
+
+SUBTREE_FIELDS = (
+    'id', 'parent_id', 'title', 'status', 'priority', 'due_date', 'completed', 'position', 'version'
+)
+
+
+class SubtaskError(ValueError):
+    pass
+
+
+def descendant_ids(todo_id):
+    """Subquery of the ids of every todo below ``todo_id``."""
+    return TodoClosure.objects.filter(ancestor_id=todo_id).values('descendant_id')
+
+
+def check_parent(todo_id, parent):
+    """Raise SubtaskError if ``parent`` can't take the branch rooted at ``todo_id``."""
+    if parent.id == todo_id or TodoClosure.objects.filter(ancestor_id=todo_id, descendant_id=parent.id).exists():
+        raise SubtaskError('A todo cannot be moved below itself or one of its subtasks')
+
+
+def lock_for_move(todo_id, parent):
+    """Lock the rows a move below ``parent`` depends on, then check it again.
+
+    Two moves that each pass ``check_parent`` can still form a cycle
+    together (A below B and B below A), but only if one of them moves a
+    todo that is the other's new parent or one of its ancestors. Locking
+    the moved todo, the parent and the parent's ancestors makes such moves
+    wait for each other, and the check then sees the first one's closure
+    rows. Run it in the transaction that performs the move.
+    """
+    ancestors = TodoClosure.objects.filter(descendant_id=parent.id).values('ancestor_id')
+    list(
+        Todo.objects.select_for_update().filter(Q(id__in=[todo_id, parent.id]) | Q(id__in=ancestors))
+        .order_by('id').values_list('id', flat=True)
+    )
+    check_parent(todo_id, parent)
+
+
+def attach(todo_id, parent_id):
+    """Add closure rows placing the branch rooted at ``todo_id`` below ``parent_id``.
+
+    One INSERT ... SELECT pairing every ancestor of the parent (and the
+    parent itself) with every node of the branch (and its root).
+    """
+    connection = connections[sharding.current()]
+    table = connection.ops.quote_name(TodoClosure._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (ancestor_id, descendant_id, depth) '
+            f'SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth + 1 '
+            f'FROM (SELECT ancestor_id, depth FROM {table} WHERE descendant_id = %s '
+            f'      UNION ALL SELECT %s, 0) a '
+            f'CROSS JOIN (SELECT descendant_id, depth FROM {table} WHERE ancestor_id = %s '
+            f'            UNION ALL SELECT %s, 0) d',
+            [parent_id, parent_id, todo_id, todo_id],
+        )
+
+
+def detach(todo_id):
+    """Remove the closure rows linking the branch at ``todo_id`` to its old ancestors."""
+    TodoClosure.objects.filter(
+        Q(descendant_id=todo_id) | Q(descendant_id__in=descendant_ids(todo_id)),
+        ancestor_id__in=TodoClosure.objects.filter(descendant_id=todo_id).values('ancestor_id'),
+    ).delete()
+
+
+def move(todo, parent):
+    """Re-link the closure rows after ``todo.parent`` changed to ``parent`` (or None).
+
+    Subtasks live in their parent's folder, so the branch follows the new
+    parent into its folder. Callers update ``todo`` itself and run this in
+    the same transaction.
+    """
+    detach(todo.id)
+    if parent is not None:
+        attach(todo.id, parent.id)
+        Todo.objects.filter(id__in=descendant_ids(todo.id)).exclude(folder_id=parent.folder_id).update(
+            folder_id=parent.folder_id
+        )
+
+
+def delete_branch(todo):
+    """Delete ``todo`` and all of its subtasks; returns the subtask ids.
+
+    The branch is deleted as one set so Django's cascade collector doesn't
+    walk ``parent`` one level (and one query) at a time.
+    """
+    ids = list(Todo.objects.filter(id__in=descendant_ids(todo.id)).values_list('id', flat=True))
+    Todo.objects.filter(id__in=[todo.id, *ids]).delete()
+    return ids
+
+
+def progress(todo_id):
+    """Rolled-up completion of everything below ``todo_id``, in one query."""
+    return TodoClosure.objects.filter(ancestor_id=todo_id).aggregate(
+        subtasks=Count('id'),
+        completed=Count('id', filter=Q(descendant__completed=True) | Q(descendant__status='completed')),
+    )
+
+
+def _is_done(row):
+    return bool(row['completed']) or row['status'] == 'completed'
+
+
+def subtree(todo):
+    """``todo``'s subtasks as nested dicts, each with its own rolled-up progress.
+
+    The whole branch is read in one query and assembled in Python.
+    """
+    rows = list(
+        Todo.objects.filter(ancestor_links__ancestor_id=todo.id)
+        .order_by('ancestor_links__depth', 'position', 'id')
+        .values(*SUBTREE_FIELDS)
+    )
+    nodes = {todo.id: {'children': [], 'progress': {'subtasks': 0, 'completed': 0}}}
+    for row in rows:
+        row['due_date'] = row['due_date'].strftime('%Y-%m-%d') if row['due_date'] else None
+        row['children'] = []
+        row['progress'] = {'subtasks': 0, 'completed': 0}
+        nodes[row['id']] = row
+        nodes[row['parent_id']]['children'].append(row)
+
+    # Rows come parents first, so walking them backwards finishes every
+    # child before its parent
+    for row in reversed(rows):
+        parent = nodes[row['parent_id']]['progress']
+        parent['subtasks'] += row['progress']['subtasks'] + 1
+        parent['completed'] += row['progress']['completed'] + (1 if _is_done(row) else 0)
+    return nodes[todo.id]
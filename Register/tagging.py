@@ -0,0 +1,136 @@
+"""Tags: per-user labels that cut across folders.
+
+Tag filters are set operations over the TodoTag link table, answered from
+its (tag, todo) index and never by intersecting id lists in Python:
+
+* ``any``: todos with a link row for at least one of the tags (a semi-join),
+* ``all``: link rows for the tags grouped by todo, keeping the todos that
+  have one row per tag (``HAVING COUNT(*) = n``).
+
+Both join the tag names in the same statement, so a filtered list is still a
+single query.
+
+A todo's tags are part of its representation, so every change to them
+(tagging, renaming or deleting a tag) bumps the todos' ``version``, and with
+it their ETag.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from . import sharding
+from .models import Tag, Todo, TodoTag
+
+MATCH_MODES = ('any', 'all')
+MAX_TAGS_PER_REQUEST = 50
+MAX_TODOS_PER_REQUEST = 1000
+
+
+class TagError(ValueError):
+    pass
+
+
+def clean_tag_names(value):
+    """Tag names from a list or a comma-separated string, stripped and de-duplicated."""
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list):
+        raise TagError('Tags must be a list of names')
+
+    max_length = Tag._meta.get_field('name').max_length
+    names = []
+    for name in value:
+        if not isinstance(name, str):
+            raise TagError('Tags must be a list of names')
+        name = name.strip()
+        if not name:
+            continue
+        # Names are passed comma-separated in list filters
+        if ',' in name:
+            raise TagError('Tag names cannot contain commas')
+        if len(name) > max_length:
+            raise TagError(f'Tag names must be at most {max_length} characters')
+        if name not in names:
+            names.append(name)
+    if len(names) > MAX_TAGS_PER_REQUEST:
+        raise TagError(f'At most {MAX_TAGS_PER_REQUEST} tags per request')
+    return names
+
+
+def get_or_create_tags(user, names):
+    """``{name: tag id}`` for ``names``, creating the missing tags in one insert."""
+    tags = dict(Tag.objects.filter(user=user, name__in=names).values_list('name', 'id'))
+    missing = [name for name in names if name not in tags]
+    if missing:
+        # ignore_conflicts: another request may create the same tag meanwhile
+        Tag.objects.bulk_create([Tag(user=user, name=name) for name in missing], ignore_conflicts=True)
+        tags.update(Tag.objects.filter(user=user, name__in=missing).values_list('name', 'id'))
+    return tags
+
+
+def _touch(todos):
+    todos.update(version=F('version') + 1, updated_at=timezone.now())
+
+
+def rename_tag(tag, name):
+    """Rename ``tag``; raises IntegrityError if the user already has ``name``."""
+    with transaction.atomic(using=sharding.current()):
+        tag.name = name
+        tag.save(update_fields=['name'])
+        _touch(Todo.objects.filter(id__in=TodoTag.objects.filter(tag=tag).values('todo_id')))
+
+
+def delete_tag(tag):
+    with transaction.atomic(using=sharding.current()):
+        _touch(Todo.objects.filter(id__in=TodoTag.objects.filter(tag=tag).values('todo_id')))
+        tag.delete()
+
+
+def filter_by_tags(todos, user, names, match='any'):
+    """Narrow the ``todos`` queryset to those tagged with any/all of ``names``."""
+    links = TodoTag.objects.filter(tag__user=user, tag__name__in=names)
+    if match == 'all' and len(names) > 1:
+        # Names are unique per user, so a todo with every tag has one row per name
+        links = links.values('todo_id').annotate(matched=Count('tag_id')).filter(matched=len(names))
+    return todos.filter(id__in=links.values('todo_id'))
+
+
+def tag_names_by_todo(todos):
+    """``{todo id: [tag names]}`` for the todos in the ``todos`` queryset, in one query."""
+    rows = (
+        TodoTag.objects.filter(todo__in=todos.values('id'))
+        .order_by('tag__name')
+        .values_list('todo_id', 'tag__name')
+    )
+    names = defaultdict(list)
+    for todo_id, name in rows:
+        names[todo_id].append(name)
+    return names
+
+
+def tag_todos(user, todo_ids, add=(), remove=()):
+    """Add and remove tags on several of ``user``'s todos at once.
+
+    Tags named in ``add`` are created when missing. Returns the ids of the
+    todos that were found; ids of other users' todos are ignored.
+    """
+    found = list(
+        Todo.objects.filter(user=user, id__in=todo_ids)
+        .exclude(folder__pending_deletion=True)
+        .values_list('id', flat=True)
+    )
+    with transaction.atomic(using=sharding.current()):
+        if add and found:
+            tag_ids = get_or_create_tags(user, add).values()
+            TodoTag.objects.bulk_create(
+                [TodoTag(todo_id=todo_id, tag_id=tag_id) for todo_id in found for tag_id in tag_ids],
+                ignore_conflicts=True,
+                batch_size=1000,
+            )
+        if remove and found:
+            TodoTag.objects.filter(todo_id__in=found, tag__user=user, tag__name__in=remove).delete()
+        if found:
+            _touch(Todo.objects.filter(id__in=found))
+    return found
@@ -1,3 +1,1677 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import uuid
+import zlib
+from datetime import date, timedelta
+from http import HTTPStatus
+from importlib import import_module
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import F, QuerySet
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from project1 import health
+
+from . import activity, events, folder_deletion, models, ratelimit, reminders, sharding, subtasks, views
+from .archive import archive_todos
+from .concurrency import UPDATE_ATTEMPTS, save_changes
+from .benchmarks import measure_imports
+from .folder_deletion import claim_next_job, queue_folder_deletion, run_job
+from .folder_lock import hash_folder_password, make_unlock_token
+from .importing import import_records
+from .models import (
+    Activity, ArchivedTodo, CustomUser, FolderDeletionJob, IdempotencyKey, RecurrenceRule, Reminder, Tag, Todo,
+    TodoFolder, UserShard
+)
+from .ordering import key_between, keys_between
+from .recurrence import materialize_next, next_occurrence, occurrences
+from .tagging import tag_todos
+from .tokens import VERSION_CLAIM, issue_tokens, revoke_tokens, token_version
+
+# Only needed by a few code paths, which import them when first used
+LAZY_IMPORTS = ('twilio', 'requests', 'django.test', 'rest_framework_simplejwt.tokens')
+
+
+class StartupImportTests(SimpleTestCase):
+    def test_optional_dependencies_are_imported_lazily(self):
+        modules = measure_imports()[1]
+        for name in LAZY_IMPORTS:
+            with self.subTest(module=name):
+                self.assertNotIn(name, modules)
+
+
+class PositionMigrationTests(SimpleTestCase):
+    def test_frozen_keys_are_valid_and_ascending(self):
+        migration = import_module('Register.migrations.0011_todo_position')
+        keys = migration.initial_keys(2000)
+        self.assertEqual(keys[:3], ['a0', 'a1', 'a2'])
+        self.assertEqual(keys, sorted(set(keys)))
+        # Still accepted by the live module, so moves between them work
+        for a, b in zip(keys, keys[1:]):
+            self.assertTrue(a < key_between(a, b) < b)
+
+
+SHARDS = ['default', 'shard1', 'shard2']
+# See DATABASE_SHARD_URLS in settings.py. The runner sets up the databases
+# of skipped tests too, so they only name aliases that exist.
+SHARD_DATABASES = set(SHARDS) & settings.DATABASES.keys()
+requires_shards = skipUnless(
+    SHARD_DATABASES == set(SHARDS), 'needs two shards configured through DATABASE_SHARD_URLS'
+)
+
+
+@requires_shards
+@override_settings(SHARDS=SHARDS)
+class ShardingTests(TestCase):
+    databases = SHARD_DATABASES
+
+    def setUp(self):
+        cache.clear()
+
+    def make_user(self, shard):
+        user = CustomUser.objects.create_user(email=f'{shard}-{uuid.uuid4().hex[:8]}@example.com', password='x')
+        if shard != 'default':
+            sharding.move_user(user, shard, wait=False)
+        return user
+
+    def api(self, user, method, path, body=None):
+        return getattr(self.client, method)(
+            path, json.dumps(body) if body is not None else '', content_type='application/json', secure=True,
+            HTTP_AUTHORIZATION=f"Bearer {issue_tokens(user)['access']}",
+        )
+
+    def rows(self, model, alias, **filters):
+        return set(model.objects.using(alias).filter(**filters).values_list('id', flat=True))
+
+    def test_new_users_are_placed_by_hash(self):
+        users = [CustomUser.objects.create_user(email=f'user{n}@example.com', password='x') for n in range(12)]
+        for user in users:
+            sharding.place(user)
+
+        placed = dict(UserShard.objects.values_list('user_id', 'shard'))
+        for user in users:
+            self.assertEqual(placed[user.id], sharding.home_shard(user.id))
+            self.assertEqual(sharding.lookup(user.id), (placed[user.id], False))
+            if placed[user.id] != 'default':
+                # Anchor row for the foreign keys on the shard
+                self.assertTrue(CustomUser.objects.using(placed[user.id]).filter(id=user.id).exists())
+        self.assertGreater(len(set(placed.values())), 1)
+
+    def test_registration_records_the_shard(self):
+        response = self.client.post('/auth/register/', json.dumps({
+            'email': 'new@example.com', 'password': 'Very$ecure123', 'first_name': 'a', 'last_name': 'b', 'phone': '1'
+        }), content_type='application/json', secure=True)
+        self.assertEqual(response.status_code, 201)
+        user_id = response.json()['user']['id']
+        self.assertEqual(UserShard.objects.get(user_id=user_id).shard, sharding.home_shard(user_id))
+
+    def test_requests_stay_on_the_users_shard(self):
+        user = self.make_user('shard1')
+        other = self.make_user('shard2')
+
+        folder = self.api(user, 'post', '/auth/folders/', {'name': 'Work'}).json()
+        todo = self.api(user, 'post', '/auth/todos/', {'folder_id': folder['id'], 'title': 'Ship it'}).json()
+        self.api(other, 'post', '/auth/folders/', {'name': 'Home'})
+
+        self.assertEqual(self.rows(Todo, 'shard1', user=user), {todo['id']})
+        self.assertEqual(self.rows(TodoFolder, 'shard1'), {folder['id']})
+        self.assertEqual(self.rows(Todo, 'default'), set())
+        self.assertEqual(self.rows(TodoFolder, 'shard2', user=user), set())
+        # Ids come from the shard's own range
+        self.assertGreaterEqual(todo['id'], sharding.SHARD_ID_SPAN)
+        self.assertLess(todo['id'], 2 * sharding.SHARD_ID_SPAN)
+
+        response = self.api(user, 'get', '/auth/todos/')
+        self.assertEqual([row['id'] for row in response.json()['todos']], [todo['id']])
+        self.assertEqual(self.api(other, 'get', f"/auth/todos/{todo['id']}/").status_code, 404)
+
+    def test_move_user_keeps_ids_and_relations(self):
+        user = self.make_user('shard1')
+        folder = self.api(user, 'post', '/auth/folders/', {'name': 'Work'}).json()
+        parent = self.api(user, 'post', '/auth/todos/', {'folder_id': folder['id'], 'title': 'Parent'}).json()
+        child = self.api(user, 'post', '/auth/todos/', {'parent_id': parent['id'], 'title': 'Child'}).json()
+        self.api(user, 'post', '/auth/todos/tags/', {'todo_ids': [parent['id']], 'add': ['urgent']})
+        before = self.api(user, 'get', f"/auth/todos/{parent['id']}/?include=subtree").json()
+
+        moved = sharding.move_user(user, 'shard2', wait=False)
+
+        self.assertEqual(moved['Todo'], 2)
+        self.assertEqual(moved['TodoClosure'], 1)
+        self.assertEqual(self.rows(Todo, 'shard2'), {parent['id'], child['id']})
+        self.assertEqual(self.rows(Todo, 'shard1'), set())
+        self.assertFalse(CustomUser.objects.using('shard1').filter(id=user.id).exists())
+        self.assertEqual(sharding.lookup(user.id), ('shard2', False))
+
+        after = self.api(user, 'get', f"/auth/todos/{parent['id']}/?include=subtree").json()
+        self.assertEqual(after, before)
+
+        # New rows on the target still get ids from its own range
+        created = self.api(user, 'post', '/auth/todos/', {'folder_id': folder['id'], 'title': 'New'}).json()
+        self.assertGreaterEqual(created['id'], 2 * sharding.SHARD_ID_SPAN)
+
+    def test_sqlite_shard_refuses_rows_from_a_higher_range(self):
+        user = self.make_user('shard2')
+        folder = self.api(user, 'post', '/auth/folders/', {'name': 'Work'}).json()
+
+        # SQLite would keep allocating above the copied ids, inside shard2's range
+        with self.assertRaises(sharding.ShardError):
+            sharding.move_user(user, 'shard1', wait=False)
+
+        self.assertEqual(self.rows(TodoFolder, 'shard2'), {folder['id']})
+        self.assertEqual(self.rows(TodoFolder, 'shard1'), set())
+        self.assertEqual(sharding.lookup(user.id), ('shard2', False))
+
+    def test_every_shard_is_migrated_and_checked(self):
+        out = StringIO()
+        call_command('migrate_shards', verbosity=0, stdout=out)
+        self.assertEqual(out.getvalue().split('\n')[:3], [f'Migrating {alias}' for alias in SHARDS])
+        self.assertEqual(health.check_migrations(), {'status': 'ok', 'pending': {}})
+
+        nodes = health._migration_nodes | {('Register', '9999_not_applied')}
+        with mock.patch.object(health, '_migration_nodes', nodes):
+            result = health.check_migrations()
+        self.assertEqual(result['status'], 'failing')
+        self.assertEqual(result['pending'], {alias: ['Register.9999_not_applied'] for alias in SHARDS})
+
+    def test_moving_user_gets_503(self):
+        user = self.make_user('shard1')
+        UserShard.objects.filter(user=user).update(moving=True)
+        cache.clear()
+
+        response = self.api(user, 'get', '/auth/todos/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '30')
+
+
+@override_settings(
+    SHARDS=['default'],
+    RATE_LIMIT_ENABLED=False,
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class QueryBudgetTests(TestCase):
+    """Exact SQL query counts for every endpoint and method.
+
+    Each request runs once as a user with a handful of rows and once as a
+    user with many, and both must issue the same number of queries: a
+    count that grows with the data is an N+1. When a change legitimately
+    adds a query, update the number here in the same commit.
+
+    The events stream is left out: it holds the connection open and
+    reads nothing per row.
+    """
+    SIZES = (3, 40)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.accounts = [cls.seed(size) for size in cls.SIZES]
+
+    @classmethod
+    def seed(cls, size):
+        user = CustomUser.objects.create_user(email=f'budget{size}@example.com', password='Very$ecure123')
+        today = timezone.localdate()
+
+        folder, locked, scratch, *_ = TodoFolder.objects.bulk_create([
+            TodoFolder(user=user, user_folder_id=n + 1, name=f'Folder {n}') for n in range(size)
+        ])
+        TodoFolder.objects.filter(id=locked.id).update(locked=True, password=hash_folder_password('secret'))
+        locked.refresh_from_db()
+
+        def add_todos(folder, count, **extra):
+            return Todo.objects.bulk_create([
+                Todo(
+                    user=user, folder=folder, title=f'Todo {n}', position=position,
+                    due_date=today + timedelta(days=n % 7), status=Todo.STATUS_CHOICES[n % 3][0], **extra
+                )
+                for n, position in enumerate(keys_between(None, None, count))
+            ])
+
+        todos = add_todos(folder, size)
+        add_todos(locked, size)
+        add_todos(scratch, size)
+        archive_todos(Todo.objects.filter(id__in=[todo.id for todo in add_todos(folder, size, completed=True)]))
+
+        # A two-level branch below the first todo
+        parent, *children = todos[:size // 2 + 1]
+        for child in children:
+            Todo.objects.filter(id=child.id).update(parent=parent)
+            subtasks.attach(child.id, parent.id)
+        Todo.objects.filter(id=todos[-1].id).update(parent=children[0])
+        subtasks.attach(todos[-1].id, children[0].id)
+        tag_todos(user, [todo.id for todo in todos], add=['work', 'home'])
+
+        rules = RecurrenceRule.objects.bulk_create([
+            RecurrenceRule(user=user, folder=folder, title=f'Rule {n}', frequency='daily', start_date=today)
+            for n in range(size)
+        ])
+        Todo.objects.filter(id=todos[1].id).update(recurrence=rules[0])
+        Activity.objects.bulk_create([
+            Activity(user=user, action='todo.updated', object_type='todo', object_id=todo.id, changes={'title': ['a', 'b']},
+                     created_at=timezone.now())
+            for todo in todos
+        ])
+        job = FolderDeletionJob.objects.create(user=user, folder_name='Old', total_todos=size)
+
+        return {
+            'size': size,
+            'user': user,
+            'folder': folder.id,
+            'locked': locked.id,
+            'scratch': scratch.id,
+            'todos': [todo.id for todo in todos],
+            'loose': Todo.objects.filter(folder=scratch).values_list('id', flat=True).first(),
+            'tag': Tag.objects.get(user=user, name='work').id,
+            'archived': ArchivedTodo.objects.filter(user=user).values_list('id', flat=True).first(),
+            'unlock_token': make_unlock_token(locked, user),
+            'job': job.id,
+        }
+
+    def setUp(self):
+        cache.clear()
+        for account in self.accounts:
+            account['tokens'] = issue_tokens(account['user'])
+            # Warm the per-user caches every authenticated request reads
+            token_version(account['user'].id)
+            sharding.lookup(account['user'].id)
+
+    def request(self, account, method, path, body=None, **headers):
+        content = body if isinstance(body, (str, bytes)) else json.dumps(body) if body is not None else ''
+        headers.setdefault('content_type', 'application/json')
+        headers.setdefault('HTTP_AUTHORIZATION', f"Bearer {account['tokens']['access']}")
+        response = getattr(self.client, method)(path, content, secure=True, **headers)
+        if response.streaming:
+            # Exports run their queries while the body is streamed
+            b''.join(response.streaming_content)
+        return response
+
+    def assertBudget(self, queries, method, path, body=None, status=HTTPStatus.OK, keys=None, rows=None, **headers):
+        """Request as the small and the large user; both must run exactly ``queries`` queries.
+
+        ``path``, ``body`` and headers may be callables taking the account. ``keys``
+        are the response's keys, ``rows`` ``(list key, row keys)`` for the
+        rows of a list in it (key None for a top-level list).
+        """
+        for account in self.accounts:
+            with self.subTest(size=account['size']):
+                resolve = lambda value: value(account) if callable(value) else value  # noqa: E731
+                target, payload = resolve(path), resolve(body)
+                extra = {name: resolve(value) for name, value in headers.items()}
+                with self.assertNumQueries(queries):
+                    response = self.request(account, method, target, payload, **extra)
+                self.assertEqual(response.status_code, status, getattr(response, 'content', b'')[:200])
+                if keys is None and rows is None:
+                    continue
+                data = response.json()
+                if keys is not None:
+                    self.assertEqual(set(data), set(keys))
+                if rows is not None:
+                    items = data if rows[0] is None else data[rows[0]]
+                    self.assertTrue(items)
+                    self.assertEqual(set(items[0]), set(rows[1]))
+
+    # Accounts
+
+    def test_register(self):
+        self.assertBudget(
+            5, 'post', '/auth/register/',
+            lambda account: {
+                'email': f"new{account['size']}@example.com", 'password': 'Very$ecure123',
+                'first_name': 'a', 'last_name': 'b', 'phone': '1'
+            },
+            status=HTTPStatus.CREATED, keys={'message', 'user'}, HTTP_AUTHORIZATION=''
+        )
+
+    def test_login(self):
+        self.assertBudget(
+            2, 'post', '/auth/login/',
+            lambda account: {'email': account['user'].email, 'password': 'Very$ecure123'},
+            keys={'message', 'token', 'access', 'refresh', 'expires_in', 'user_id', 'email', 'first_name', 'last_name'},
+            HTTP_AUTHORIZATION=''
+        )
+
+    def test_refresh_token(self):
+        self.assertBudget(
+            0, 'post', '/auth/token/refresh/', lambda account: {'refresh': account['tokens']['refresh']},
+            keys={'access', 'expires_in'}
+        )
+
+    def test_logout(self):
+        self.assertBudget(2, 'post', '/auth/logout/', keys={'message'})
+
+    # Folders
+
+    def test_list_folders(self):
+        self.assertBudget(1, 'get', '/auth/folders/', rows=(None, views.FOLDER_LIST_FIELDS))
+        self.assertBudget(1, 'get', '/auth/folders/?fields=name', rows=(None, ('id', 'name')))
+
+    def test_create_folder(self):
+        self.assertBudget(
+            2, 'post', '/auth/folders/', {'name': 'New', 'locked': True, 'password': 'secret'},
+            status=HTTPStatus.CREATED,
+            keys={'id', 'user_folder_id', 'name', 'description', 'locked', 'priority', 'version', 'created_at'}
+        )
+
+    def test_update_folder(self):
+        self.assertBudget(
+            2, 'put', '/auth/folders/', lambda account: {'folder_id': account['folder'], 'name': 'Renamed'},
+            keys={'id', 'user_folder_id', 'name', 'description', 'locked', 'priority', 'version', 'updated_at'}
+        )
+
+    def test_delete_folder(self):
+        self.assertBudget(
+            12, 'delete', '/auth/folders/', lambda account: {'folder_id': account['scratch']},
+            status=HTTPStatus.NO_CONTENT
+        )
+
+    @override_settings(FOLDER_DELETE_SYNC_LIMIT=2)
+    def test_delete_large_folder(self):
+        self.assertBudget(
+            6, 'delete', lambda account: f"/auth/folders/{account['scratch']}/",
+            lambda account: {'folder_id': account['scratch']},
+            status=HTTPStatus.ACCEPTED, keys={'message', 'job_id', 'status'}
+        )
+
+    def test_folder_deletion_job(self):
+        self.assertBudget(
+            1, 'get', lambda account: f"/auth/folders/jobs/{account['job']}/",
+            keys={
+                'id', 'folder_id', 'folder_name', 'status', 'total_todos', 'deleted_todos', 'progress', 'error',
+                'attempts', 'retry_at', 'created_at', 'updated_at', 'finished_at'
+            }
+        )
+
+    def test_verify_folder_password(self):
+        self.assertBudget(
+            1, 'post', lambda account: f"/auth/folders/{account['locked']}/verify/", {'password': 'secret'},
+            keys={'message', 'unlock_token', 'expires_in'}
+        )
+
+    def test_todos_by_folder(self):
+        for method in ('get', 'post'):
+            self.assertBudget(
+                3, method, lambda account: f"/auth/folders/{account['folder']}/todos/",
+                keys={'todos'}, rows=('todos', views.FOLDER_TODO_LIST_FIELDS)
+            )
+
+    def test_reorder_todos(self):
+        self.assertBudget(
+            8, 'post', lambda account: f"/auth/folders/{account['folder']}/todos/reorder/",
+            lambda account: {'moves': [
+                {'id': account['todos'][0], 'before_id': None},
+                {'id': account['todos'][1], 'after_id': account['todos'][2]},
+            ]},
+            keys={'todos'}, rows=('todos', ('id', 'position'))
+        )
+
+    # Todos
+
+    def test_list_todos(self):
+        self.assertBudget(2, 'get', '/auth/todos/', keys={'todos'}, rows=('todos', views.TODO_LIST_FIELDS))
+        self.assertBudget(
+            2, 'get', '/auth/todos/?tags=work,home&tag_match=all', keys={'todos'}, rows=('todos', views.TODO_LIST_FIELDS)
+        )
+        self.assertBudget(1, 'get', '/auth/todos/?fields=title', keys={'todos'}, rows=('todos', ('id', 'title')))
+
+    def test_create_todo(self):
+        created = {
+            'id', 'folder_id', 'parent_id', 'title', 'description', 'status', 'priority', 'due_date', 'completed',
+            'position', 'version', 'created_at'
+        }
+        self.assertBudget(
+            5, 'post', '/auth/todos/', lambda account: {'folder_id': account['folder'], 'title': 'New'},
+            status=HTTPStatus.CREATED, keys=created
+        )
+        self.assertBudget(
+            7, 'post', '/auth/todos/', lambda account: {'parent_id': account['todos'][0], 'title': 'Subtask'},
+            status=HTTPStatus.CREATED, keys=created
+        )
+
+    def test_get_todo(self):
+        detail = {
+            'id', 'folder_id', 'parent_id', 'title', 'description', 'status', 'priority', 'due_date', 'completed',
+            'recurrence_id', 'version', 'created_at', 'updated_at', 'tags', 'progress'
+        }
+        self.assertBudget(3, 'get', lambda account: f"/auth/todos/{account['todos'][0]}/", keys=detail)
+        self.assertBudget(
+            3, 'get', lambda account: f"/auth/todos/{account['todos'][0]}/?include=subtree",
+            keys=detail | {'subtasks'}, rows=('subtasks', set(subtasks.SUBTREE_FIELDS) | {'children', 'progress'})
+        )
+
+    def test_update_todo(self):
+        updated = {
+            'id', 'folder_id', 'parent_id', 'title', 'description', 'status', 'priority', 'due_date', 'completed',
+            'recurrence_id', 'version', 'created_at', 'updated_at', 'next_occurrence_id'
+        }
+        self.assertBudget(
+            4, 'put', lambda account: f"/auth/todos/{account['todos'][2]}/", {'title': 'Renamed'}, keys=updated
+        )
+        # Moving a todo with its subtasks below a todo in another folder;
+        # the check is repeated once the rows it depends on are locked
+        self.assertBudget(
+            11, 'put', lambda account: f"/auth/todos/{account['todos'][0]}/",
+            lambda account: {'parent_id': account['loose']}, keys=updated
+        )
+        # Completing a recurring todo creates the next occurrence
+        self.assertBudget(
+            11, 'put', lambda account: f"/auth/todos/{account['todos'][1]}/", {'completed': True}, keys=updated
+        )
+
+    def test_delete_todo(self):
+        # The whole branch below the first todo goes with it
+        self.assertBudget(
+            9, 'delete', lambda account: f"/auth/todos/{account['todos'][0]}/", status=HTTPStatus.NO_CONTENT
+        )
+
+    def test_delete_todo_in_locked_folder(self):
+        self.assertBudget(
+            9, 'delete',
+            lambda account: f"/auth/todos/{Todo.objects.filter(folder_id=account['locked']).values_list('id', flat=True).first()}/",
+            status=HTTPStatus.NO_CONTENT,
+            HTTP_X_FOLDER_UNLOCK=lambda account: account['unlock_token'],
+        )
+
+    def test_recurrence(self):
+        rule = {'id', 'frequency', 'interval', 'weekdays', 'start_date', 'until', 'count'}
+        path = lambda account: f"/auth/todos/{account['todos'][1]}/recurrence/"  # noqa: E731
+        self.assertBudget(1, 'get', path, keys=rule)
+        self.assertBudget(4, 'put', path, {'frequency': 'weekly', 'weekdays': [0, 2]}, keys=rule)
+        self.assertBudget(3, 'delete', path, status=HTTPStatus.NO_CONTENT)
+
+    def test_occurrences(self):
+        today = timezone.localdate()
+        self.assertBudget(
+            2, 'get', f'/auth/todos/occurrences/?start={today}&end={today + timedelta(days=30)}',
+            keys={'occurrences'},
+            rows=('occurrences', (
+                'id', 'recurrence_id', 'folder_id', 'title', 'status', 'priority', 'due_date', 'completed', 'virtual'
+            ))
+        )
+
+    def test_agenda(self):
+        for include in ('ids', 'rows', 'none'):
+            self.assertBudget(
+                1, 'get', f'/auth/todos/agenda/?include={include}', keys={'start', 'end', 'days'}
+            )
+
+    def test_next_up(self):
+        self.assertBudget(2, 'get', '/auth/todos/next/?limit=5', keys={'todos'}, rows=('todos', views.NEXT_UP_FIELDS))
+
+    # Tags
+
+    def test_bulk_tag_todos(self):
+        # Includes bumping the tagged todos' versions
+        self.assertBudget(
+            9, 'post', '/auth/todos/tags/',
+            lambda account: {'todo_ids': account['todos'], 'add': ['urgent', 'work'], 'remove': ['home']},
+            keys={'updated', 'not_found', 'added', 'removed'}
+        )
+
+    def test_tags(self):
+        self.assertBudget(1, 'get', '/auth/tags/', rows=(None, ('id', 'name', 'todo_count')))
+        self.assertBudget(
+            4, 'post', '/auth/tags/', {'name': 'errands'}, status=HTTPStatus.CREATED, keys={'id', 'name', 'created_at'}
+        )
+
+    def test_tag_detail(self):
+        path = lambda account: f"/auth/tags/{account['tag']}/"  # noqa: E731
+        # Both bump the versions of the tag's todos in a transaction
+        self.assertBudget(5, 'put', path, {'name': 'job'}, keys={'id', 'name', 'created_at'})
+        self.assertBudget(6, 'delete', path, status=HTTPStatus.NO_CONTENT)
+
+    # Archive, activity, export and import
+
+    def test_archived_todos(self):
+        self.assertBudget(
+            1, 'get', '/auth/todos/archive/?limit=2', keys={'todos', 'next_before'},
+            rows=('todos', (
+                'id', 'folder_id', 'title', 'description', 'status', 'priority', 'due_date', 'completed',
+                'created_at', 'updated_at', 'archived_at'
+            ))
+        )
+
+    def test_restore_archived(self):
+        self.assertBudget(
+            8, 'post', lambda account: f"/auth/todos/archive/{account['archived']}/restore/",
+            keys={
+                'id', 'folder_id', 'title', 'description', 'status', 'priority', 'due_date', 'completed',
+                'created_at', 'updated_at'
+            }
+        )
+
+    def test_activity_feed(self):
+        self.assertBudget(
+            1, 'get', '/auth/activity/?limit=2', keys={'activity', 'next_before'},
+            rows=('activity', ('id', 'action', 'object_type', 'object_id', 'changes', 'created_at'))
+        )
+
+    def test_export(self):
+        self.assertBudget(3, 'get', '/auth/export/')
+        self.assertBudget(3, 'get', '/auth/export/?format=csv&gzip=1')
+
+    def test_import(self):
+        upload = '\n'.join(json.dumps(record) for record in [
+            {'type': 'folder', 'user_folder_id': 100, 'name': 'Imported'},
+            *({'type': 'todo', 'user_folder_id': 100, 'title': f'Imported {n}'} for n in range(5)),
+            {'type': 'todo', 'user_folder_id': 1, 'title': 'Into an existing folder'},
+        ])
+        self.assertBudget(
+            10, 'post', '/auth/import/', upload, content_type='application/x-ndjson',
+            keys={'rows', 'folders_created', 'todos_created', 'error_count', 'errors'}
+        )
+
+    def test_batch(self):
+        self.assertBudget(
+            12, 'post', '/auth/batch/',
+            lambda account: {'atomic': True, 'requests': [
+                {'method': 'POST', 'path': '/auth/todos/', 'body': {'folder_id': account['folder'], 'title': 'New'}},
+                {'method': 'PUT', 'path': f"/auth/todos/{account['todos'][2]}/", 'body': {'completed': True}},
+                {'method': 'GET', 'path': '/auth/folders/'},
+            ]},
+            keys={'responses', 'rolled_back'}
+        )
+
+    def test_idempotent_replay(self):
+        self.assertBudget(
+            9, 'post', '/auth/folders/', {'name': 'Once'}, status=HTTPStatus.CREATED, HTTP_IDEMPOTENCY_KEY='once'
+        )
+        self.assertBudget(
+            1, 'post', '/auth/folders/', {'name': 'Once'}, status=HTTPStatus.CREATED, HTTP_IDEMPOTENCY_KEY='once'
+        )
+
+
+@override_settings(SHARDS=['default'], RATE_LIMIT_ENABLED=False)
+class IdempotentImportTests(TestCase):
+    UPLOAD = json.dumps({'type': 'folder', 'user_folder_id': 1, 'name': 'Imported'})
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email='import@example.com', password='Very$ecure123')
+
+    def setUp(self):
+        cache.clear()
+        self.token = issue_tokens(self.user)['access']
+
+    def upload(self, key='import-1', digest='sha-256=:abc=:'):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key}
+        if digest:
+            headers['HTTP_CONTENT_DIGEST'] = digest
+        return self.client.post(
+            '/auth/import/', self.UPLOAD, content_type='application/x-ndjson', secure=True,
+            HTTP_AUTHORIZATION=f'Bearer {self.token}', **headers
+        )
+
+    def test_digest_required(self):
+        self.assertEqual(self.upload(digest=None).status_code, HTTPStatus.BAD_REQUEST)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_replay(self):
+        first = self.upload()
+        self.assertEqual(first.status_code, HTTPStatus.OK)
+        self.assertEqual(first.json()['folders_created'], 1)
+        second = self.upload()
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(TodoFolder.objects.filter(user=self.user).count(), 1)
+
+    def test_different_digest(self):
+        self.upload()
+        self.assertEqual(self.upload(digest='sha-256=:def=:').status_code, HTTPStatus.UNPROCESSABLE_ENTITY)
+
+    def test_in_progress(self):
+        self.upload()
+        claim = IdempotencyKey.objects.get(user=self.user)
+        IdempotencyKey.objects.filter(id=claim.id).update(content_type='', body=b'')
+        self.assertEqual(self.upload().status_code, HTTPStatus.CONFLICT)
+
+        # Abandoned by a request that died: the next one runs again
+        IdempotencyKey.objects.filter(id=claim.id).update(created_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(self.upload().status_code, HTTPStatus.OK)
+
+
+@override_settings(SHARDS=['default'], RATE_LIMIT_ENABLED=False)
+class BulkActivityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='bulk@example.com', password='Very$ecure123')
+        self.folder = TodoFolder.objects.create(user=self.user, user_folder_id=1, name='Work')
+        self.todos = Todo.objects.bulk_create([
+            Todo(user=self.user, folder=self.folder, title=f'Todo {n}', position=position)
+            for n, position in enumerate(keys_between(None, None, 3))
+        ])
+
+    def post(self, path, body):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                path, json.dumps(body), content_type='application/json', secure=True,
+                HTTP_AUTHORIZATION=f"Bearer {issue_tokens(self.user)['access']}",
+            )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        activity.flush()
+        return response
+
+    def test_reorder(self):
+        first, _, last = self.todos
+        self.post(f'/auth/folders/{self.folder.id}/todos/reorder/', {'moves': [{'id': last.id, 'after_id': None}]})
+        entry = Activity.objects.get(user=self.user)
+        self.assertEqual((entry.action, entry.object_id), ('todo.updated', last.id))
+        old, new = entry.changes['position']
+        self.assertEqual(old, last.position)
+        self.assertLess(new, first.position)
+
+    def test_bulk_tag(self):
+        ids = [todo.id for todo in self.todos[:2]]
+        self.post('/auth/todos/tags/', {'todo_ids': ids, 'add': ['work']})
+        entries = Activity.objects.filter(user=self.user, action='todo.tagged')
+        self.assertEqual(sorted(entries.values_list('object_id', flat=True)), ids)
+        self.assertEqual(entries[0].changes, {'added': ['work'], 'removed': []})
+
+
+@override_settings(SHARDS=['default'])
+class ArchiveTests(TestCase):
+    def test_taken_archive_id_keeps_the_todo(self):
+        user = CustomUser.objects.create_user(email='archive@example.com', password='x')
+        folder = TodoFolder.objects.create(user=user, user_folder_id=1, name='Work')
+        kept, moved = Todo.objects.bulk_create([
+            Todo(user=user, folder=folder, title=title, completed=True) for title in ('Kept', 'Moved')
+        ])
+        ArchivedTodo.objects.create(
+            id=kept.id, user=user, folder=folder, title='Already archived', completed=True,
+            created_at=timezone.now(), updated_at=timezone.now()
+        )
+
+        self.assertEqual(archive_todos(Todo.objects.all()), 1)
+        self.assertEqual(list(Todo.objects.values_list('id', flat=True)), [kept.id])
+        self.assertEqual(ArchivedTodo.objects.get(id=kept.id).title, 'Already archived')
+        self.assertEqual(ArchivedTodo.objects.get(id=moved.id).title, 'Moved')
+
+
+@override_settings(SHARDS=['default'], RATE_LIMIT_ENABLED=False)
+class TagVersionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='tags@example.com', password='Very$ecure123')
+        folder = TodoFolder.objects.create(user=self.user, user_folder_id=1, name='Work')
+        self.todo = Todo.objects.create(user=self.user, folder=folder, title='Tagged')
+        self.headers = {'HTTP_AUTHORIZATION': f"Bearer {issue_tokens(self.user)['access']}"}
+
+    def api(self, method, path, body=None):
+        return getattr(self.client, method)(
+            path, json.dumps(body) if body is not None else '', content_type='application/json', secure=True,
+            **self.headers
+        )
+
+    def etag(self):
+        return self.api('get', f'/auth/todos/{self.todo.id}/')['ETag']
+
+    def test_tag_changes_change_the_etag(self):
+        tags = [self.etag()]
+        self.api('post', '/auth/todos/tags/', {'todo_ids': [self.todo.id], 'add': ['work', 'home']})
+        tags.append(self.etag())
+        tag_id = Tag.objects.get(user=self.user, name='work').id
+        self.api('put', f'/auth/tags/{tag_id}/', {'name': 'job'})
+        tags.append(self.etag())
+        self.api('delete', f'/auth/tags/{tag_id}/')
+        tags.append(self.etag())
+        self.assertEqual(len(set(tags)), 4)
+
+    def test_rename_to_a_taken_name(self):
+        Tag.objects.bulk_create([Tag(user=self.user, name=name) for name in ('work', 'home')])
+        tag_id = Tag.objects.get(user=self.user, name='work').id
+        response = self.api('put', f'/auth/tags/{tag_id}/', {'name': 'home'})
+        self.assertEqual(response.status_code, HTTPStatus.CONFLICT)
+        self.assertEqual(Tag.objects.get(id=tag_id).name, 'work')
+
+    def test_body_must_be_an_object(self):
+        tag = Tag.objects.create(user=self.user, name='work')
+        for method, path in (('post', '/auth/tags/'), ('put', f'/auth/tags/{tag.id}/'), ('post', '/auth/todos/tags/')):
+            for body in ([], 'work', 1):
+                with self.subTest(method=method, path=path, body=body):
+                    self.assertEqual(self.api(method, path, body).status_code, HTTPStatus.BAD_REQUEST)
+
+
+@override_settings(SHARDS=['default'], RATE_LIMIT_ENABLED=False)
+class AsgiExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email='export@example.com', password='Very$ecure123')
+        folder = TodoFolder.objects.create(user=cls.user, user_folder_id=1, name='Work')
+        Todo.objects.create(user=cls.user, folder=folder, title='Exported')
+
+    async def export(self, path='/auth/export/'):
+        token = (await sync_to_async(issue_tokens)(self.user))['access']
+        return await self.async_client.get(path, secure=True, headers={'Authorization': f'Bearer {token}'})
+
+    async def test_body_is_pulled_one_chunk_at_a_time(self):
+        produced = []
+
+        def stream_export(user, export_format, gzip):
+            for n in range(3):
+                produced.append(n)
+                yield b'%d\n' % n
+
+        with mock.patch.object(views, 'stream_export', stream_export):
+            response = await self.export()
+            self.assertTrue(response.is_async)
+            chunks = aiter(response.streaming_content)
+            self.assertEqual(await anext(chunks), b'0\n')
+            # Nothing past the chunk being sent has been produced
+            self.assertEqual(produced, [0])
+            self.assertEqual([chunk async for chunk in chunks], [b'1\n', b'2\n'])
+
+    async def test_export(self):
+        response = await self.export('/auth/export/?gzip=1')
+        body = zlib.decompress(b''.join([chunk async for chunk in response.streaming_content]), 31)
+        records = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([record['type'] for record in records], ['folder', 'todo'])
+        self.assertEqual(records[1]['title'], 'Exported')
+
+
+class EventTests(TestCase):
+    def message(self, user_id, event='todo.updated', data=None):
+        return json.dumps({'user': user_id, 'event': event, 'data': data or {'id': 1}})
+
+    async def test_fan_out(self):
+        broker = events.Broker()
+        first, second, other = broker.subscribe(1), broker.subscribe(1), broker.subscribe(2)
+
+        broker.dispatch(self.message(1))
+        await asyncio.sleep(0)
+
+        frame = 'event: todo.updated\ndata: {"id": 1}\n\n'
+        self.assertEqual(first.queue.get_nowait(), frame)
+        self.assertEqual(second.queue.get_nowait(), frame)
+        self.assertTrue(other.queue.empty())
+
+        broker.unsubscribe(first)
+        broker.dispatch(self.message(1))
+        await asyncio.sleep(0)
+        self.assertTrue(first.queue.empty())
+        self.assertEqual(second.queue.get_nowait(), frame)
+
+    async def test_overflow_asks_for_a_resync(self):
+        broker = events.Broker()
+        subscription = broker.subscribe(1)
+        for n in range(events.QUEUE_SIZE + 1):
+            broker.dispatch(self.message(1, data={'id': n}))
+        await asyncio.sleep(0)
+
+        # The backlog is dropped for a single resync
+        self.assertEqual(subscription.queue.qsize(), 1)
+        self.assertEqual(subscription.queue.get_nowait(), 'event: resync\ndata: {}\n\n')
+
+    def test_no_event_on_rollback(self):
+        with mock.patch.object(events, '_backend', events.LocalEventBackend()), \
+                mock.patch.object(events.broker, 'dispatch') as dispatch:
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertRaises(RuntimeError), transaction.atomic():
+                    events.publish_event(1, 'todo.updated', {'id': 1})
+                    raise RuntimeError
+                events.publish_event(1, 'todo.created', {'id': 2})
+
+        self.assertEqual([json.loads(call.args[0])['event'] for call in dispatch.call_args_list], ['todo.created'])
+
+
+@override_settings(SHARDS=['default'])
+class ImportValidationTests(TestCase):
+    def test_bad_rows_are_reported_not_fatal(self):
+        user = CustomUser.objects.create_user(email='badimport@example.com', password='x')
+        records = [
+            {'type': 'folder', 'user_folder_id': 1, 'name': 'Work'},
+            {'type': 'folder', 'user_folder_id': 2, 'name': 5},
+            {'type': 'folder', 'user_folder_id': 3, 'name': 'Locked', 'locked': True, 'password': 5},
+            {'type': 'folder', 'user_folder_id': 4, 'name': 'Notes', 'description': ['x']},
+            {'type': 'todo', 'user_folder_id': 1, 'title': 123},
+            {'type': 'todo', 'user_folder_id': 1, 'title': ['a', 'list']},
+            {'type': 'todo', 'user_folder_id': 1, 'title': 'Bad status', 'status': []},
+            {'type': 'todo', 'user_folder_id': 1, 'title': 'Bad description', 'description': {'a': 1}},
+            {'type': 'todo', 'user_folder_id': 1, 'title': 'Fine'},
+        ]
+        lines = [json.dumps(record) + '\n' for record in records]
+
+        summary = import_records(user, lines, batch_size=3)
+
+        self.assertEqual((summary['folders_created'], summary['todos_created']), (1, 1))
+        self.assertEqual([error['line'] for error in summary['errors']], [2, 3, 4, 5, 6, 7, 8])
+        self.assertEqual(list(Todo.objects.filter(user=user).values_list('title', flat=True)), ['Fine'])
+
+
+@override_settings(SHARDS=['default'])
+class FolderDeletionWorkerTests(TestCase):
+    def setUp(self):
+        user = CustomUser.objects.create_user(email='deleter@example.com', password='x')
+        self.folder = TodoFolder.objects.create(user=user, user_folder_id=1, name='Big')
+        Todo.objects.bulk_create([Todo(user=user, folder=self.folder, title=f'Todo {n}') for n in range(5)])
+        self.job = queue_folder_deletion(self.folder)
+
+    def test_deletes_in_batches_with_progress(self):
+        progress = []
+        delete = QuerySet.delete
+
+        def recording_delete(queryset):
+            result = delete(queryset)
+            if queryset.model is Todo:
+                progress.append(FolderDeletionJob.objects.get(id=self.job.id).deleted_todos)
+            return result
+
+        job = claim_next_job()
+        self.assertEqual((job.id, job.status, job.attempts), (self.job.id, 'running', 1))
+        with mock.patch.object(QuerySet, 'delete', recording_delete):
+            job = run_job(job, batch_size=2)
+
+        # Each batch's progress update runs in the transaction after its delete
+        self.assertEqual(progress, [0, 2, 4])
+        self.assertEqual((job.status, job.total_todos, job.deleted_todos), ('completed', 5, 5))
+        self.assertFalse(TodoFolder.objects.filter(id=self.folder.id).exists())
+        self.assertIsNone(claim_next_job())
+
+    def test_stale_running_job_is_reclaimed(self):
+        claim_next_job()
+        self.assertIsNone(claim_next_job())
+
+        FolderDeletionJob.objects.filter(id=self.job.id).update(updated_at=timezone.now() - timedelta(minutes=11))
+        job = claim_next_job()
+        self.assertEqual((job.id, job.attempts), (self.job.id, 2))
+
+    def test_failed_runs_are_retried_then_given_up(self):
+        with mock.patch.object(QuerySet, 'delete', side_effect=RuntimeError('disk full')):
+            for attempt in range(1, folder_deletion.MAX_ATTEMPTS + 1):
+                job = claim_next_job()
+                self.assertEqual(job.attempts, attempt)
+                with self.assertRaises(RuntimeError):
+                    run_job(job)
+                job.refresh_from_db()
+                if attempt < folder_deletion.MAX_ATTEMPTS:
+                    self.assertEqual(job.status, 'pending')
+                    self.assertEqual(job.retry_at - job.updated_at, folder_deletion.RETRY_BACKOFF * 2 ** (attempt - 1))
+                    # Backing off
+                    self.assertIsNone(claim_next_job())
+                    FolderDeletionJob.objects.filter(id=job.id).update(retry_at=timezone.now())
+
+        self.assertEqual((job.status, job.error), ('failed', 'disk full'))
+        self.assertIsNone(claim_next_job())
+        # Visible again, with the todos that are left
+        self.assertFalse(TodoFolder.objects.get(id=self.folder.id).pending_deletion)
+        self.assertEqual(Todo.objects.filter(folder=self.folder).count(), 5)
+
+
+@override_settings(SHARDS=['default'], RATE_LIMIT_ENABLED=False)
+class OptimisticConcurrencyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='versions@example.com', password='Very$ecure123')
+        self.folder = TodoFolder.objects.create(user=self.user, user_folder_id=1, name='Work')
+        self.todo = Todo.objects.create(user=self.user, folder=self.folder, title='Draft')
+        self.token = issue_tokens(self.user)['access']
+
+    def put(self, path, body, **headers):
+        return self.client.put(
+            path, json.dumps(body), content_type='application/json', secure=True,
+            HTTP_AUTHORIZATION=f'Bearer {self.token}', **headers
+        )
+
+    def edit_elsewhere(self, model, pk, **values):
+        model.objects.filter(id=pk).update(version=F('version') + 1, **values)
+
+    def test_matching_version_is_applied(self):
+        response = self.put(f'/auth/todos/{self.todo.id}/', {'title': 'Final'}, HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['ETag'], '"2"')
+
+    def test_stale_version_gets_the_current_row(self):
+        self.edit_elsewhere(Todo, self.todo.id, title='From my phone')
+        response = self.put(f'/auth/todos/{self.todo.id}/', {'title': 'Final'}, HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, HTTPStatus.CONFLICT)
+        self.assertEqual(response['ETag'], '"2"')
+        self.assertEqual(response.json()['current']['title'], 'From my phone')
+        self.assertEqual(Todo.objects.get(id=self.todo.id).title, 'From my phone')
+
+        self.edit_elsewhere(TodoFolder, self.folder.id, name='Renamed')
+        response = self.put('/auth/folders/', {'folder_id': self.folder.id, 'name': 'Mine', 'version': 1})
+        self.assertEqual(response.status_code, HTTPStatus.CONFLICT)
+        self.assertEqual(response.json()['current']['name'], 'Renamed')
+
+    def test_malformed_version(self):
+        response = self.put(f'/auth/todos/{self.todo.id}/', {'title': 'Final'}, HTTP_IF_MATCH='"abc"')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        response = self.put('/auth/folders/', {'folder_id': self.folder.id, 'name': 'Mine', 'version': True})
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def losing_save(self, losses):
+        """save_changes that loses the race to another writer ``losses`` times."""
+        calls = []
+
+        def save(instance, changes):
+            calls.append(instance.version)
+            if len(calls) <= losses:
+                self.edit_elsewhere(type(instance), instance.pk)
+            return save_changes(instance, changes)
+        return mock.patch.object(views, 'save_changes', save), calls
+
+    def test_unversioned_edit_is_retried(self):
+        patch, calls = self.losing_save(UPDATE_ATTEMPTS - 1)
+        with patch:
+            response = self.put(f'/auth/todos/{self.todo.id}/', {'title': 'Final'})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        # Each attempt starts from the row as the other writer left it
+        self.assertEqual(calls, list(range(1, UPDATE_ATTEMPTS + 1)))
+        self.assertEqual(Todo.objects.get(id=self.todo.id).title, 'Final')
+
+    def test_retries_give_up_with_409(self):
+        patch, calls = self.losing_save(UPDATE_ATTEMPTS)
+        with patch:
+            response = self.put('/auth/folders/', {'folder_id': self.folder.id, 'name': 'Mine'})
+        self.assertEqual(response.status_code, HTTPStatus.CONFLICT)
+        self.assertEqual(len(calls), UPDATE_ATTEMPTS)
+        self.assertEqual(response.json()['current']['version'], UPDATE_ATTEMPTS + 1)
+        self.assertEqual(TodoFolder.objects.get(id=self.folder.id).name, 'Work')
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_buckets_allow_capacity_then_refill(self):
+        for buckets in (ratelimit.LocalBuckets(), ratelimit.CacheBuckets()):
+            with self.subTest(type(buckets).__name__):
+                self.assertEqual(buckets.take('k', 2, 1.0, 100.0), 0)
+                self.assertEqual(buckets.take('k', 2, 1.0, 100.0), 0)
+                self.assertEqual(buckets.take('k', 2, 1.0, 100.0), 1.0)
+                self.assertEqual(buckets.take('k', 2, 1.0, 100.5), 0.5)
+                # Refusals don't spend tokens, so the bucket is back to one
+                self.assertEqual(buckets.take('k', 2, 1.0, 101.0), 0)
+                self.assertEqual(buckets.take('k', 2, 1.0, 101.0), 1.0)
+                self.assertEqual(buckets.take('other', 2, 1.0, 101.0), 0)
+
+    def test_local_buckets_evict_least_recently_used(self):
+        buckets = ratelimit.LocalBuckets(max_keys=2)
+        buckets.take('a', 1, 1.0, 0.0)
+        buckets.take('b', 1, 1.0, 0.0)
+        buckets.take('a', 1, 1.0, 0.0)
+        buckets.take('c', 1, 1.0, 0.0)
+        self.assertEqual(list(buckets._buckets), ['a', 'c'])
+        # 'b' starts over with a full bucket
+        self.assertEqual(buckets.take('b', 1, 1.0, 0.0), 0)
+
+    def test_client_ip_trusts_only_the_proxies(self):
+        factory = RequestFactory()
+        cases = [
+            (0, 'spoofed', '10.0.0.1'),
+            (1, 'spoofed, 203.0.113.7', '203.0.113.7'),
+            (2, 'spoofed, 203.0.113.7, 10.0.0.2', '203.0.113.7'),
+            (3, '203.0.113.7, 10.0.0.2', '203.0.113.7'),
+        ]
+        for proxies, forwarded, expected in cases:
+            with self.subTest(proxies=proxies, forwarded=forwarded), override_settings(NUM_PROXIES=proxies):
+                request = factory.get('/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR=forwarded)
+                self.assertEqual(ratelimit.client_ip(request), expected)
+        with override_settings(NUM_PROXIES=1):
+            self.assertEqual(ratelimit.client_ip(factory.get('/', REMOTE_ADDR='10.0.0.1')), '10.0.0.1')
+
+
+@override_settings(
+    SHARDS=['default'], RATE_LIMIT_ENABLED=True, RATE_LIMIT_BACKEND='local', NUM_PROXIES=1,
+    AUTH_RATE_LIMITS={'login_ip': '3/m', 'login_email': '2/m', 'register_ip': '2/h', 'register_email': '1/h'}
+)
+class AuthThrottleTests(TestCase):
+    def setUp(self):
+        for patch in (
+            mock.patch.dict(ratelimit._limits, clear=True),
+            mock.patch.object(ratelimit, '_local_buckets', ratelimit.LocalBuckets()),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        CustomUser.objects.create_user(email='limited@example.com', password='Very$ecure123')
+
+    def post(self, path, body, ip='203.0.113.7'):
+        return self.client.post(
+            path, json.dumps(body), content_type='application/json', secure=True,
+            HTTP_X_FORWARDED_FOR=f'spoofed-{uuid.uuid4()}, {ip}'
+        )
+
+    def assertThrottled(self, response):
+        self.assertEqual(response.status_code, HTTPStatus.TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], str(response.json()['retry_after']))
+        self.assertGreater(response.json()['retry_after'], 0)
+
+    def test_login_email_limit(self):
+        wrong = {'email': 'limited@example.com', 'password': 'wrong'}
+        for _ in range(2):
+            self.assertEqual(self.post('/auth/login/', wrong).status_code, HTTPStatus.UNAUTHORIZED)
+        # Even the right password is refused until the bucket refills
+        response = self.post('/auth/login/', {**wrong, 'password': 'Very$ecure123'})
+        self.assertThrottled(response)
+        self.assertEqual(response.json()['retry_after'], 30)
+        # The email bucket is case-insensitive
+        self.assertThrottled(self.post('/auth/login/', {**wrong, 'email': 'LIMITED@example.com'}, ip='198.51.100.1'))
+
+    def test_login_ip_limit_ignores_spoofed_addresses(self):
+        for n in range(3):
+            response = self.post('/auth/login/', {'email': f'nobody{n}@example.com', 'password': 'x'})
+            self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertThrottled(self.post('/auth/login/', {'email': 'other@example.com', 'password': 'x'}))
+        response = self.post('/auth/login/', {'email': 'other@example.com', 'password': 'x'}, ip='198.51.100.1')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_login_allowed_again_after_refill(self):
+        wrong = {'email': 'limited@example.com', 'password': 'wrong'}
+        with mock.patch.object(ratelimit.time, 'time', return_value=1000.0) as clock:
+            for _ in range(2):
+                self.post('/auth/login/', wrong)
+            self.assertThrottled(self.post('/auth/login/', wrong))
+            clock.return_value = 1030.0
+            self.assertEqual(self.post('/auth/login/', wrong).status_code, HTTPStatus.UNAUTHORIZED)
+            self.assertThrottled(self.post('/auth/login/', wrong))
+
+    def test_register_limits(self):
+        body = {'email': 'new@example.com', 'password': 'Very$ecure123', 'first_name': 'New', 'last_name': 'User', 'phone': '555'}
+        self.assertEqual(self.post('/auth/register/', body).status_code, HTTPStatus.CREATED)
+        self.assertThrottled(self.post('/auth/register/', body, ip='198.51.100.1'))
+
+        response = self.post('/auth/register/', {**body, 'email': 'second@example.com'})
+        self.assertNotEqual(response.status_code, HTTPStatus.TOO_MANY_REQUESTS)
+        self.assertThrottled(self.post('/auth/register/', {**body, 'email': 'third@example.com'}))
+
+    def test_disabled(self):
+        with override_settings(RATE_LIMIT_ENABLED=False):
+            for _ in range(5):
+                response = self.post('/auth/login/', {'email': 'limited@example.com', 'password': 'wrong'})
+                self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+
+@override_settings(SHARDS=['default'], RATE_LIMIT_ENABLED=False)
+class TokenTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='tokens@example.com', password='Very$ecure123')
+
+    def get_folders(self, authorization):
+        return self.client.get('/auth/folders/', secure=True, HTTP_AUTHORIZATION=authorization)
+
+    def refresh(self, token):
+        return self.client.post(
+            '/auth/token/refresh/', json.dumps({'refresh': token}), content_type='application/json', secure=True
+        )
+
+    def test_access_token_authenticates(self):
+        tokens = issue_tokens(self.user)
+        self.assertEqual(self.get_folders(f'Bearer {tokens["access"]}').status_code, HTTPStatus.OK)
+        self.assertEqual(self.get_folders('Bearer not-a-token').status_code, HTTPStatus.UNAUTHORIZED)
+
+    def test_revoked_access_token_is_rejected(self):
+        access = issue_tokens(self.user)['access']
+        # Warm the cached version so the revocation has to invalidate it
+        self.assertEqual(self.get_folders(f'Bearer {access}').status_code, HTTPStatus.OK)
+        revoke_tokens(self.user)
+        self.assertEqual(self.get_folders(f'Bearer {access}').status_code, HTTPStatus.UNAUTHORIZED)
+
+        self.user.refresh_from_db()
+        fresh = issue_tokens(self.user)['access']
+        self.assertEqual(self.get_folders(f'Bearer {fresh}').status_code, HTTPStatus.OK)
+
+    def test_refresh_carries_version(self):
+        refresh = issue_tokens(self.user)['refresh']
+        response = self.refresh(refresh)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        access = response.json()['access']
+        self.assertEqual(AccessToken(access)[VERSION_CLAIM], self.user.token_version)
+        self.assertEqual(self.get_folders(f'Bearer {access}').status_code, HTTPStatus.OK)
+
+        # Tokens minted from a refresh token are revoked with it
+        revoke_tokens(self.user)
+        self.assertEqual(self.get_folders(f'Bearer {access}').status_code, HTTPStatus.UNAUTHORIZED)
+
+    def test_revoked_refresh_token_is_rejected(self):
+        refresh = issue_tokens(self.user)['refresh']
+        revoke_tokens(self.user)
+        self.assertEqual(self.refresh(refresh).status_code, HTTPStatus.UNAUTHORIZED)
+        self.assertEqual(self.refresh('garbage').status_code, HTTPStatus.UNAUTHORIZED)
+
+    def test_logout_revokes_every_token(self):
+        login = self.client.post(
+            '/auth/login/', json.dumps({'email': 'tokens@example.com', 'password': 'Very$ecure123'}),
+            content_type='application/json', secure=True
+        ).json()
+        legacy = f'Token {login["token"]}'
+        self.assertEqual(self.get_folders(legacy).status_code, HTTPStatus.OK)
+        self.assertEqual(self.get_folders(f'Bearer {login["access"]}').status_code, HTTPStatus.OK)
+
+        response = self.client.post('/auth/logout/', secure=True, HTTP_AUTHORIZATION=legacy)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(self.get_folders(legacy).status_code, HTTPStatus.UNAUTHORIZED)
+        self.assertEqual(self.get_folders(f'Bearer {login["access"]}').status_code, HTTPStatus.UNAUTHORIZED)
+        self.assertEqual(self.refresh(login['refresh']).status_code, HTTPStatus.UNAUTHORIZED)
+
+    def test_deleted_user_token_is_rejected(self):
+        access = issue_tokens(self.user)['access']
+        self.user.delete()
+        self.assertEqual(self.get_folders(f'Bearer {access}').status_code, HTTPStatus.UNAUTHORIZED)
+
+
+class FailingSender(reminders.BaseReminderSender):
+    def send_messages(self, batch):
+        raise RuntimeError('smtp down')
+
+
+@override_settings(SHARDS=['default'])
+class ReminderTests(TestCase):
+    def setUp(self):
+        reminders.outbox.clear()
+        self.today = timezone.localdate()
+        user = CustomUser.objects.create_user(email='remind@example.com', password='x')
+        self.due = Todo.objects.create(user=user, title='Pay rent', due_date=self.today)
+        self.late = Todo.objects.create(user=user, title='Taxes', due_date=self.today - timedelta(days=2))
+        Todo.objects.create(user=user, title='Later', due_date=self.today + timedelta(days=3))
+        Todo.objects.create(user=user, title='Done', due_date=self.today, completed=True, status='completed')
+
+    def test_enqueue_is_idempotent(self):
+        self.assertEqual(reminders.enqueue(self.today), 2)
+        self.assertEqual(reminders.enqueue(self.today), 0)
+        self.assertEqual(
+            set(Reminder.objects.values_list('todo__title', 'kind')),
+            {('Pay rent', 'due'), ('Taxes', 'overdue')}
+        )
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Reminder.objects.create(todo=self.due, kind='due', due_date=self.today)
+
+        # Rescheduling makes a new reminder
+        Todo.objects.filter(id=self.due.id).update(due_date=self.today + timedelta(days=1))
+        self.assertEqual(reminders.enqueue(self.today, lookahead_days=1), 1)
+
+    def test_claims_are_disjoint(self):
+        reminders.enqueue(self.today)
+        first = reminders.claim('a', batch_size=1)
+        second = reminders.claim('b', batch_size=5)
+        self.assertEqual(len(first), 1)
+        self.assertEqual(len(second), 1)
+        self.assertNotEqual(first[0].id, second[0].id)
+        self.assertTrue(first[0].claimed_by.startswith('a:'))
+        self.assertEqual(reminders.claim('c'), [])
+
+        # A claim whose worker stopped is taken over after stale_after
+        Reminder.objects.filter(id=first[0].id).update(claimed_at=timezone.now() - timedelta(minutes=6))
+        retaken = reminders.claim('c')
+        self.assertEqual([(r.id, r.attempts) for r in retaken], [(first[0].id, 2)])
+
+    def test_deliver(self):
+        reminders.enqueue(self.today)
+        batch = reminders.claim('a')
+        self.assertEqual(reminders.deliver(batch, reminders.LocMemReminderSender()), 2)
+        self.assertEqual(set(Reminder.objects.values_list('status', flat=True)), {'sent'})
+        self.assertEqual(
+            sorted(message['message'] for message in reminders.outbox),
+            sorted([f"'Pay rent' is due on {self.today:%Y-%m-%d}",
+                    f"'Taxes' was due on {self.today - timedelta(days=2):%Y-%m-%d} and is overdue"])
+        )
+        self.assertEqual(reminders.claim('a'), [])
+
+    def test_completed_todo_is_skipped(self):
+        reminders.enqueue(self.today)
+        Todo.objects.filter(id=self.due.id).update(completed=True)
+        batch = reminders.claim('a')
+        self.assertEqual(reminders.deliver(batch, reminders.LocMemReminderSender()), 1)
+        self.assertEqual(Reminder.objects.get(todo=self.due).status, 'skipped')
+
+    def test_stale_claim_cannot_record_outcome(self):
+        reminders.enqueue(self.today)
+        stale = reminders.claim('slow')
+        Reminder.objects.update(claimed_at=timezone.now() - timedelta(minutes=6))
+        current = reminders.claim('fast')
+
+        # The slow worker finally fails, but the reminders are no longer its
+        with self.assertLogs('Register.reminders', 'ERROR'):
+            reminders.deliver(stale, FailingSender())
+        self.assertEqual(set(Reminder.objects.values_list('status', 'last_error')), {('claimed', '')})
+
+        self.assertEqual(reminders.deliver(current, reminders.LocMemReminderSender()), 2)
+        reminders.deliver(stale, reminders.LocMemReminderSender())
+        self.assertEqual(set(Reminder.objects.values_list('status', 'claimed_by')), {('sent', current[0].claimed_by)})
+
+    def test_failed_delivery_is_retried_then_given_up(self):
+        Todo.objects.filter(id=self.late.id).delete()
+        reminders.enqueue(self.today)
+        for attempt in range(1, reminders.MAX_ATTEMPTS + 1):
+            batch = reminders.claim('a')
+            self.assertEqual([r.attempts for r in batch], [attempt])
+            with self.assertLogs('Register.reminders', 'ERROR'):
+                self.assertEqual(reminders.deliver(batch, FailingSender()), 0)
+            reminder = Reminder.objects.get()
+            self.assertEqual(reminder.last_error, 'smtp down')
+            if attempt < reminders.MAX_ATTEMPTS:
+                self.assertEqual(reminder.status, 'pending')
+                # Retried once the claim is stale
+                self.assertEqual(reminders.claim('a'), [])
+                Reminder.objects.update(claimed_at=timezone.now() - timedelta(minutes=6))
+
+        self.assertEqual(reminder.status, 'failed')
+        Reminder.objects.update(claimed_at=timezone.now() - timedelta(minutes=6))
+        self.assertEqual(reminders.claim('a'), [])
+
+
+@skipUnless(connection.features.has_select_for_update_skip_locked, 'needs SELECT ... SKIP LOCKED')
+@override_settings(SHARDS=['default'])
+class ReminderSkipLockedTests(TransactionTestCase):
+    def test_claim_skips_rows_locked_by_another_worker(self):
+        user = CustomUser.objects.create_user(email='locked@example.com', password='x')
+        today = timezone.localdate()
+        todos = Todo.objects.bulk_create([Todo(user=user, title=f'Todo {n}', due_date=today) for n in range(3)])
+        reminders.enqueue(today)
+        locked = Reminder.objects.get(todo=todos[0])
+
+        claimed = []
+
+        def other_worker():
+            try:
+                claimed.extend(r.id for r in reminders.claim('other'))
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            # Held by a worker that is still claiming
+            Reminder.objects.select_for_update().get(id=locked.id)
+            worker = threading.Thread(target=other_worker)
+            worker.start()
+            worker.join(timeout=10)
+
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(len(claimed), 2)
+        self.assertNotIn(locked.id, claimed)
+        self.assertEqual(Reminder.objects.get(id=locked.id).status, 'pending')
+
+
+class RecurrenceExpansionTests(SimpleTestCase):
+    def rule(self, frequency, start_date, **fields):
+        return RecurrenceRule(frequency=frequency, start_date=start_date, **fields)
+
+    def assertExpands(self, rule, expected, end=None):
+        end = end or expected[-1] + timedelta(days=400)
+        self.assertEqual(occurrences(rule, rule.start_date, end), expected)
+        # Windows starting anywhere later agree with the full expansion
+        for offset in range((end - rule.start_date).days + 1):
+            start = rule.start_date + timedelta(days=offset)
+            with self.subTest(start=start):
+                self.assertEqual(occurrences(rule, start, end), [day for day in expected if day >= start])
+
+    def test_monthly_at_the_end_of_the_month(self):
+        self.assertExpands(
+            self.rule('monthly', date(2024, 1, 31), count=6),
+            [date(2024, 1, 31), date(2024, 2, 29), date(2024, 3, 31), date(2024, 4, 30), date(2024, 5, 31),
+             date(2024, 6, 30)]
+        )
+        self.assertExpands(
+            self.rule('monthly', date(2023, 1, 29), count=3),
+            [date(2023, 1, 29), date(2023, 2, 28), date(2023, 3, 29)]
+        )
+        self.assertExpands(
+            self.rule('monthly', date(2023, 12, 30), until=date(2024, 3, 30)),
+            [date(2023, 12, 30), date(2024, 1, 30), date(2024, 2, 29), date(2024, 3, 30)]
+        )
+        self.assertExpands(
+            self.rule('monthly', date(2023, 11, 30), interval=3, count=4),
+            [date(2023, 11, 30), date(2024, 2, 29), date(2024, 5, 30), date(2024, 8, 30)]
+        )
+
+    def test_weekly_on_several_weekdays(self):
+        # Wednesday start, Monday/Wednesday/Friday: the first week starts mid-week
+        self.assertExpands(
+            self.rule('weekly', date(2024, 1, 3), weekdays='0,2,4', count=7),
+            [date(2024, 1, 3), date(2024, 1, 5), date(2024, 1, 8), date(2024, 1, 10), date(2024, 1, 12),
+             date(2024, 1, 15), date(2024, 1, 17)]
+        )
+        self.assertExpands(
+            self.rule('weekly', date(2024, 1, 3), weekdays='0,2,4', interval=2, until=date(2024, 1, 29)),
+            [date(2024, 1, 3), date(2024, 1, 5), date(2024, 1, 15), date(2024, 1, 17), date(2024, 1, 19),
+             date(2024, 1, 29)]
+        )
+        # Without weekdays the rule repeats on the start date's weekday
+        self.assertExpands(
+            self.rule('weekly', date(2024, 1, 4), count=3),
+            [date(2024, 1, 4), date(2024, 1, 11), date(2024, 1, 18)]
+        )
+
+    def test_until_and_count(self):
+        self.assertExpands(
+            self.rule('daily', date(2024, 1, 1), interval=2, until=date(2024, 1, 8)),
+            [date(2024, 1, 1), date(2024, 1, 3), date(2024, 1, 5), date(2024, 1, 7)]
+        )
+        self.assertExpands(
+            self.rule('daily', date(2024, 1, 1), count=3, until=date(2024, 12, 31)),
+            [date(2024, 1, 1), date(2024, 1, 2), date(2024, 1, 3)]
+        )
+        rule = self.rule('monthly', date(2024, 1, 31), count=2)
+        self.assertEqual(next_occurrence(rule, date(2024, 1, 31)), date(2024, 2, 29))
+        self.assertIsNone(next_occurrence(rule, date(2024, 2, 29)))
+
+
+@override_settings(SHARDS=['default'])
+class MaterializeNextTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='series@example.com', password='x')
+        self.rule = RecurrenceRule.objects.create(
+            user=self.user, title='Water plants', frequency='weekly', weekdays='0,3', start_date=date(2024, 1, 1),
+            count=3
+        )
+        self.first = Todo.objects.create(
+            user=self.user, recurrence=self.rule, title='Water plants', due_date=date(2024, 1, 1), completed=True
+        )
+
+    def test_called_twice_creates_one_occurrence(self):
+        created = materialize_next(self.first)
+        self.assertEqual(created.due_date, date(2024, 1, 4))
+        self.assertIsNone(materialize_next(self.first))
+        self.assertEqual(
+            list(self.rule.todos.order_by('due_date').values_list('due_date', flat=True)),
+            [date(2024, 1, 1), date(2024, 1, 4)]
+        )
+
+    def test_series_ends_at_count(self):
+        second = materialize_next(self.first)
+        third = materialize_next(second)
+        self.assertEqual(third.due_date, date(2024, 1, 8))
+        self.assertIsNone(materialize_next(third))
+        self.assertEqual(self.rule.todos.count(), 3)
+
+
+@override_settings(SHARDS=['default'], HEALTH_CHECK_CACHE_TTL=60, HEALTH_DB_LATENCY_WARNING=10)
+class HealthTests(TestCase):
+    def setUp(self):
+        patch = mock.patch.object(health, '_cached', None)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def ready(self):
+        return self.client.get('/health/ready/', secure=True)
+
+    def fake_postgres(self, used, max_connections=100, reserved=3):
+        fake = mock.MagicMock(vendor='postgresql')
+        fake.cursor.return_value.__enter__.return_value.fetchone.return_value = (used, max_connections, reserved)
+        return mock.patch.object(health, 'connections', {'default': fake})
+
+    def test_ok(self):
+        self.assertEqual(self.client.get('/health/live/', secure=True).json(), {'status': 'ok'})
+        response = self.ready()
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        result = response.json()
+        self.assertEqual(result['status'], 'ok')
+        self.assertEqual(set(result['checks']), {'database', 'migrations', 'shards', 'connections'})
+        self.assertFalse(result['cached'])
+
+    def test_failing_database_answers_503(self):
+        def failing():
+            raise OperationalError('connection refused')
+
+        with mock.patch.dict(health.CHECKS, database=failing):
+            response = self.ready()
+        self.assertEqual(response.status_code, HTTPStatus.SERVICE_UNAVAILABLE)
+        result = response.json()
+        self.assertEqual(result['checks']['database']['error'], 'connection refused')
+        # The other checks need the same database
+        self.assertEqual(set(result['checks']), {'database'})
+
+    def test_pending_migrations_answer_503(self):
+        health.check_migrations()
+        nodes = health._migration_nodes | {('Register', '9999_not_applied')}
+        with mock.patch.object(health, '_migration_nodes', nodes):
+            response = self.ready()
+        self.assertEqual(response.status_code, HTTPStatus.SERVICE_UNAVAILABLE)
+        self.assertEqual(response.json()['checks']['migrations']['status'], 'failing')
+
+    def test_connection_usage_is_never_failing(self):
+        for used, status in ((50, 'ok'), (80, 'degraded'), (97, 'degraded')):
+            with self.subTest(used=used), self.fake_postgres(used):
+                self.assertEqual(health.check_connections()['status'], status)
+
+        with mock.patch.dict(health.CHECKS, connections=lambda: {'status': 'degraded', 'usage': 1.0}):
+            response = self.ready()
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.json()['status'], 'degraded')
+
+    def test_results_are_cached(self):
+        calls = []
+
+        def counting():
+            calls.append(1)
+            return {'status': 'failing'}
+
+        with mock.patch.dict(health.CHECKS, database=counting):
+            first, second = self.ready(), self.ready()
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(second.status_code, HTTPStatus.SERVICE_UNAVAILABLE)
+            self.assertEqual((first.json()['cached'], second.json()['cached']), (False, True))
+
+            with override_settings(HEALTH_CHECK_CACHE_TTL=0):
+                self.assertFalse(self.ready().json()['cached'])
+            self.assertEqual(len(calls), 2)
+
+
+class AgendaTests(TestCase):
+    # The per-day lists are aggregated to JSON by the database, which each
+    # backend returns differently; run the suite against PostgreSQL too
+    # (DATABASE_URL=postgres://...)
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='agenda@example.com', password='x')
+        folder = TodoFolder.objects.create(user=self.user, user_folder_id=1, name='Work')
+        self.today = timezone.localdate()
+        self.todos = [
+            Todo.objects.create(user=self.user, folder=folder, title=f'Todo {n}', due_date=self.today, **extra)
+            for n, extra in enumerate([{'priority': 'high'}, {'completed': True}, {'status': 'in_progress'}])
+        ]
+
+    def get(self, include):
+        response = self.client.get(
+            f'/auth/todos/agenda/?start={self.today}&include={include}', secure=True,
+            HTTP_AUTHORIZATION=f"Bearer {issue_tokens(self.user)['access']}",
+        )
+        self.assertEqual(response.status_code, 200)
+        [day] = response.json()['days']
+        self.assertEqual((day['date'], day['total'], day['done']), (str(self.today), 3, 1))
+        self.assertEqual(day['by_priority'], {'low': 0, 'medium': 2, 'high': 1})
+        return day
+
+    def test_ids(self):
+        self.assertEqual(self.get('ids')['todo_ids'], [todo.id for todo in self.todos])
+
+    def test_rows(self):
+        rows = self.get('rows')['todos']
+        self.assertEqual([row['id'] for row in rows], [todo.id for todo in self.todos])
+        self.assertEqual(rows[1], {
+            'id': self.todos[1].id, 'folder_id': self.todos[1].folder_id, 'parent_id': None, 'title': 'Todo 1',
+            'status': 'pending', 'priority': 'medium', 'completed': True
+        })
+
+    def test_counts_only(self):
+        self.assertNotIn('todos', self.get('none'))
+
+
+class PriorityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='priority@example.com', password='x')
+        self.folder = TodoFolder.objects.create(user=self.user, user_folder_id=1, name='Work')
+
+    def api(self, method, path, body=None):
+        return getattr(self.client, method)(
+            path, json.dumps(body) if body is not None else '', content_type='application/json', secure=True,
+            HTTP_AUTHORIZATION=f"Bearer {issue_tokens(self.user)['access']}",
+        )
+
+    def add(self, title, priority='medium', due=None, **extra):
+        due_date = timezone.localdate() + timedelta(days=due) if due is not None else None
+        return Todo.objects.create(
+            user=self.user, folder=extra.pop('folder', self.folder), title=title, priority=priority,
+            due_date=due_date, **extra
+        )
+
+    def test_priority_is_stored_as_a_sortable_number(self):
+        for priority in ('medium', 'low', 'high'):
+            self.add(priority, priority)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT title, priority FROM {connection.ops.quote_name(Todo._meta.db_table)}')
+            self.assertEqual(dict(cursor.fetchall()), {'low': 1, 'medium': 2, 'high': 3})
+        self.assertEqual(list(Todo.objects.order_by('-priority').values_list('priority', flat=True)), [
+            'high', 'medium', 'low'
+        ])
+        self.assertEqual(Todo.objects.filter(priority__gte='medium').count(), 2)
+        response = self.api('get', '/auth/todos/?fields=priority')
+        self.assertEqual(sorted(todo['priority'] for todo in response.json()['todos']), ['high', 'low', 'medium'])
+
+    def test_unknown_priorities_are_rejected(self):
+        response = self.api('post', '/auth/todos/', {'folder_id': self.folder.id, 'title': 'x', 'priority': 'urgent'})
+        self.assertEqual(response.status_code, 400)
+        todo = self.add('Todo')
+        self.assertEqual(self.api('put', f'/auth/todos/{todo.id}/', {'priority': 'urgent'}).status_code, 400)
+        self.assertEqual(self.api('post', '/auth/folders/', {'name': 'x', 'priority': 'urgent'}).status_code, 400)
+        self.assertEqual(self.api('put', '/auth/folders/', {'folder_id': self.folder.id, 'priority': 1}).status_code, 400)
+
+        # Older clients send the priority as "status"; anything else there is ignored
+        created = self.api('post', '/auth/todos/', {'folder_id': self.folder.id, 'title': 'x', 'status': 'high'}).json()
+        self.assertEqual(created['priority'], 'high')
+        created = self.api('post', '/auth/todos/', {'folder_id': self.folder.id, 'title': 'x', 'status': 'pending'}).json()
+        self.assertEqual(created['priority'], 'medium')
+
+    def test_next_up_ranks_open_todos_by_priority_and_due_date(self):
+        self.add('high, undated', 'high')
+        self.add('high, tomorrow', 'high', due=1)
+        self.add('high, today', 'high', due=0)
+        self.add('medium, yesterday', 'medium', due=-1)
+        self.add('low, today', 'low', due=0)
+        self.add('high, done', 'high', due=0, completed=True)
+        self.add('high, completed status', 'high', due=0, status='completed')
+        hidden = TodoFolder.objects.create(user=self.user, user_folder_id=2, name='Old', pending_deletion=True)
+        self.add('high, folder being deleted', 'high', due=0, folder=hidden)
+        other = CustomUser.objects.create_user(email='other@example.com', password='x')
+        Todo.objects.create(user=other, folder=TodoFolder.objects.create(user=other, user_folder_id=1, name='x'),
+                            title='someone else', priority='high')
+
+        response = self.api('get', '/auth/todos/next/?limit=4&fields=title,priority')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([todo['title'] for todo in response.json()['todos']], [
+            'high, today', 'high, tomorrow', 'high, undated', 'medium, yesterday'
+        ])
+        self.assertEqual(len(self.api('get', '/auth/todos/next/').json()['todos']), 5)
+        self.assertEqual(self.api('get', '/auth/todos/next/?limit=0').status_code, 400)
+
+    @skipUnless(connection.vendor == 'sqlite', "EXPLAIN output is SQLite's")
+    def test_next_up_reads_the_index_in_order(self):
+        todos = Todo.objects.filter(user=self.user).filter(models.OPEN_TODOS).order_by(*models.NEXT_UP_ORDER)[:10]
+        plan = todos.explain()
+        self.assertIn('todo_next_up_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class AdminTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = CustomUser.objects.create_user(
+            email='admin@example.com', password='x', is_staff=True, is_superuser=True, is_active=True
+        )
+        self.client.force_login(self.admin)
+        self.folder = TodoFolder.objects.create(user=self.admin, user_folder_id=1, name='Work')
+        self.todo = Todo.objects.create(user=self.admin, folder=self.folder, title='Todo')
+
+    def changelist(self, model, **params):
+        response = self.client.get(f'/admin/Register/{model}/', params, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    def test_search(self):
+        for model, pk in (('todo', self.todo.id), ('todofolder', self.folder.id)):
+            with self.subTest(model=model):
+                self.assertEqual(self.changelist(model, q='').result_count, 1)
+                self.assertEqual(self.changelist(model, q=str(pk)).result_count, 1)
+                self.assertEqual(self.changelist(model, q='admin@example.com').result_count, 1)
+                # Anything else matches nothing rather than scanning
+                self.assertEqual(self.changelist(model, q='work').result_count, 0)
+                self.assertEqual(self.changelist(model, q='9' * 30).result_count, 0)
+                self.assertEqual(self.changelist(model, q='²').result_count, 0)
+
+    def test_mark_completed_continues_recurring_series(self):
+        today = timezone.localdate()
+        rule = RecurrenceRule.objects.create(
+            user=self.admin, folder=self.folder, title='Daily', frequency='daily', start_date=today
+        )
+        recurring = Todo.objects.create(
+            user=self.admin, folder=self.folder, title='Daily', recurrence=rule, due_date=today, position='b'
+        )
+
+        with mock.patch('Register.admin.publish_event') as publish, self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/admin/Register/todo/', {
+                'action': 'mark_completed', '_selected_action': [self.todo.id, recurring.id]
+            }, secure=True)
+        activity.flush()
+
+        self.assertEqual(Todo.objects.filter(completed=True).count(), 2)
+        next_todo = Todo.objects.get(recurrence=rule, completed=False)
+        self.assertEqual(next_todo.due_date, today + timedelta(days=1))
+        events = {call.args[1]: call.args[2] for call in publish.call_args_list}
+        self.assertEqual(sorted(events['todos.completed']['todo_ids']), sorted([self.todo.id, recurring.id]))
+        self.assertEqual(events['todo.created']['id'], next_todo.id)
+        self.assertEqual(
+            sorted(Activity.objects.values_list('action', 'object_id')),
+            sorted([('todo.updated', self.todo.id), ('todo.updated', recurring.id), ('todo.created', next_todo.id)])
+        )
+
+    def test_move_to_folder_moves_whole_branches(self):
+        child = Todo.objects.create(user=self.admin, folder=self.folder, title='Child', parent=self.todo)
+        subtasks.attach(child.id, self.todo.id)
+        target = TodoFolder.objects.create(user=self.admin, user_folder_id=2, name='Home')
+
+        self.client.post('/admin/Register/todo/', {
+            'action': 'move_to_folder', 'folder': target.id, '_selected_action': [self.todo.id]
+        }, secure=True)
+        self.assertEqual(set(Todo.objects.values_list('folder_id', flat=True)), {target.id})
+
+        # A subtask alone stays with its parent
+        self.client.post('/admin/Register/todo/', {
+            'action': 'move_to_folder', 'folder': self.folder.id, '_selected_action': [child.id]
+        }, secure=True)
+        self.assertEqual(Todo.objects.get(id=child.id).folder_id, target.id)
+
+
+
+@requires_shards
+@override_settings(SHARDS=SHARDS)
+class ShardedAdminTests(AdminTests):
+    databases = SHARD_DATABASES
+
+    def sharded_user(self):
+        user = CustomUser.objects.create_user(email='sharded@example.com', password='x')
+        sharding.move_user(user, 'shard1', wait=False)
+        with sharding.use('shard1'):
+            folder = TodoFolder.objects.create(user=user, user_folder_id=1, name='Home')
+            todo = Todo.objects.create(user=user, folder=folder, title='On a shard')
+        return user, todo
+
+    def test_shard_filter(self):
+        _, todo = self.sharded_user()
+
+        self.assertEqual([row.id for row in self.changelist('todo').result_list], [self.todo.id])
+        self.assertEqual([row.id for row in self.changelist('todo', shard='shard1').result_list], [todo.id])
+
+        response = self.client.post('/admin/Register/todo/?shard=shard1', {
+            'action': 'mark_completed', '_selected_action': [todo.id]
+        }, secure=True)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Todo.objects.using('shard1').get(id=todo.id).completed)
+
+        change_url = f'/admin/Register/todo/{todo.id}/change/?_changelist_filters=shard%3Dshard1'
+        self.assertEqual(self.client.get(change_url, secure=True).status_code, 200)
+
+    def test_delete_user_clears_their_shard(self):
+        user, todo = self.sharded_user()
+
+        response = self.client.post(f'/admin/Register/customuser/{user.id}/delete/', {'post': 'yes'}, secure=True)
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(CustomUser.objects.filter(id=user.id).exists())
+        self.assertFalse(CustomUser.objects.using('shard1').filter(id=user.id).exists())
+        self.assertFalse(Todo.objects.using('shard1').filter(id=todo.id).exists())
+        self.assertFalse(TodoFolder.objects.using('shard1').filter(user_id=user.id).exists())
@@ -0,0 +1,94 @@
+"""Signed, expiring access and refresh tokens for the API.
+
+Access tokens are simplejwt HS256 JWTs, so verifying one is an HMAC check
+with no database query. Revocation is per user: every token carries the
+user's ``token_version`` and ``revoke_tokens`` bumps it. The current version
+is read through the cache (``TOKEN_VERSION_CACHE_TTL`` seconds), so a
+revocation reaches other processes within that window.
+
+simplejwt's token and settings modules are imported on first use: importing
+them pulls in ``django.test``, which management commands and cron jobs that
+never see a token shouldn't pay for at startup.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import F
+from rest_framework_simplejwt.exceptions import TokenError
+
+from .models import CustomUser
+
+VERSION_CLAIM = 'ver'
+
+
+class TokenRevoked(TokenError):
+    pass
+
+
+def _version_key(user_id):
+    return f'token-version:{user_id}'
+
+
+def token_version(user_id):
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        version = CustomUser.objects.filter(id=user_id).values_list('token_version', flat=True).first()
+        if version is None:
+            raise TokenRevoked('User no longer exists')
+        cache.set(_version_key(user_id), version, getattr(settings, 'TOKEN_VERSION_CACHE_TTL', 60))
+    return version
+
+
+def issue_tokens(user):
+    from rest_framework_simplejwt.settings import api_settings
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    refresh = RefreshToken.for_user(user)
+    refresh[VERSION_CLAIM] = user.token_version
+    access = refresh.access_token
+    return {
+        'access': str(access),
+        'refresh': str(refresh),
+        'expires_in': int(api_settings.ACCESS_TOKEN_LIFETIME.total_seconds()),
+    }
+
+
+def _check_version(token):
+    from rest_framework_simplejwt.settings import api_settings
+
+    user_id = token[api_settings.USER_ID_CLAIM]
+    if token.get(VERSION_CLAIM) != token_version(user_id):
+        raise TokenRevoked('Token has been revoked')
+    return user_id
+
+
+def user_from_access_token(raw):
+    """Return the (lazily loaded) user for a valid access token.
+
+    Raises TokenError when the token is malformed, expired or revoked.
+    """
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    user_id = _check_version(AccessToken(raw))
+    # Only the id is loaded; views use the user as a foreign key value, and
+    # any other attribute is fetched on first access
+    return CustomUser.from_db(DEFAULT_DB_ALIAS, ['id'], [user_id])
+
+
+def refresh_tokens(raw_refresh):
+    """New access token for a valid, unrevoked refresh token."""
+    from rest_framework_simplejwt.settings import api_settings
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    refresh = RefreshToken(raw_refresh)
+    _check_version(refresh)
+    return {
+        'access': str(refresh.access_token),
+        'expires_in': int(api_settings.ACCESS_TOKEN_LIFETIME.total_seconds()),
+    }
+
+
+def revoke_tokens(user):
+    """Invalidate every access and refresh token issued to ``user`` so far."""
+    CustomUser.objects.filter(id=user.id).update(token_version=F('token_version') + 1)
+    cache.delete(_version_key(user.id))
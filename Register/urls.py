@@ -4,13 +4,32 @@ from . import views
 urlpatterns = [
     path('register/', views.register, name='register'),
     path('login/', views.Login, name='login'),
+    path('token/refresh/', views.refresh_token, name='token-refresh'),  # POST {"refresh": ...} for a new access token
+    path('logout/', views.logout, name='logout'),  # POST revokes all of the user's tokens
     
     path('folders/', views.todo_folders, name='todo-folders'),  # GET all folders, POST new folder
     path('folders/<int:folder_id>/', views.todo_folders, name='folder-detail'),  # DELETE folder
+    path('folders/jobs/<int:job_id>/', views.folder_deletion_job, name='folder-deletion-job'),  # GET background delete progress
     
-    path('todos/', views.todos, name='todo-list'),  # GET all todos, POST new todo
+    path('todos/', views.todos, name='todo-list'),  # GET all todos (?tags=a,b&tag_match=any|all), POST new todo
     path('todos/<int:todo_id>/', views.todo_detail, name='todo-detail'),  # GET, PUT, DELETE specific todo
+    path('todos/<int:todo_id>/recurrence/', views.todo_recurrence, name='todo-recurrence'),  # GET, PUT, DELETE repeat rule
+    path('todos/occurrences/', views.todo_occurrences, name='todo-occurrences'),  # GET ?start=&end= incl. virtual repeats
+    path('todos/agenda/', views.todo_agenda, name='todo-agenda'),  # GET per-day counts ?start=&end=&include=ids|rows|none
+    path('todos/next/', views.todos_next_up, name='todos-next-up'),  # GET top open todos by priority, due date (?limit=)
+    path('todos/tags/', views.bulk_tag_todos, name='bulk-tag-todos'),  # POST {"todo_ids", "add", "remove"}
+    path('tags/', views.tags, name='tags'),  # GET tags with counts, POST new tag
+    path('tags/<int:tag_id>/', views.tag_detail, name='tag-detail'),  # PUT rename, DELETE
+    path('todos/archive/', views.archived_todos, name='archived-todos'),  # GET archived todos (paginated)
+    path('todos/archive/<int:todo_id>/restore/', views.restore_archived, name='restore-archived-todo'),  # POST
     path('folders/<int:folder_id>/verify/', views.verify_folder_password, name='verify_folder_password'), 
     
     path('folders/<int:folder_id>/todos/', views.todos_by_folder, name='todos-by-folder'),
+    path('export/', views.export_data, name='export-data'),  # GET streamed NDJSON/CSV (?format=, ?gzip=1)
+    path('import/', views.import_data, name='import-data'),  # POST streamed NDJSON/CSV body
+    path('batch/', views.batch, name='batch'),  # POST several API calls in one round trip
+    path('events/', views.events, name='events'),  # GET Server-Sent Events stream of changes
+    path('activity/', views.activity_feed, name='activity-feed'),  # GET change history (paginated)
+
+    path('folders/<int:folder_id>/todos/reorder/', views.reorder_todos, name='reorder-todos'),  # POST batch of moves
 ]
\ No newline at end of file
@@ -0,0 +1,50 @@
+"""Input rules for creating todos, shared by the todos POST view and imports."""
+from datetime import datetime
+
+from .models import Todo
+
+PRIORITIES = [value for value, _ in Todo.PRIORITY_CHOICES]
+
+
+class TodoValidationError(ValueError):
+    """Input that the todos POST view rejects with 400 Bad Request."""
+
+
+def parse_due_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise TodoValidationError('Invalid date format. Use YYYY-MM-DD')
+
+
+def _max_length(field_name):
+    return Todo._meta.get_field(field_name).max_length
+
+
+def clean_todo(title, description='', priority='medium', due_date=None, completed=False, status='pending'):
+    """Validate todo fields and return them ready for ``Todo(**fields)``."""
+    if not title:
+        raise TodoValidationError('Title is required')
+    if not isinstance(title, str):
+        raise TodoValidationError('Title must be a string')
+    if description is not None and not isinstance(description, str):
+        raise TodoValidationError('Description must be a string')
+    if not isinstance(status, str):
+        raise TodoValidationError('Invalid status')
+    if len(title) > _max_length('title'):
+        raise TodoValidationError(f"Title must be at most {_max_length('title')} characters")
+    if priority not in PRIORITIES:
+        raise TodoValidationError('Invalid priority')
+    if status not in dict(Todo.STATUS_CHOICES):
+        raise TodoValidationError('Invalid status')
+
+    return {
+        'title': title,
+        'description': description,
+        'status': status,
+        'priority': priority,
+        'due_date': parse_due_date(due_date),
+        'completed': completed,
+    }
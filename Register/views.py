@@ -1,19 +1,126 @@
 from django.shortcuts import render 
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.contrib.auth.models import User
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
+import csv
 import json
-from .models import CustomUser, Todo, TodoFolder
-from rest_framework import status
+import math
+from django.db import IntegrityError, transaction
+from django.db.models import Count
+from .models import (
+    NEXT_UP_ORDER, OPEN_TODOS, Activity, ArchivedTodo, CustomUser, FolderDeletionJob, RecurrenceRule, Tag, Todo,
+    TodoFolder
+)
+from .recurrence import RecurrenceError, clean_rule, expand_for_user, is_done, materialize_next
+from .archive import restore as restore_archived_todo
+from .exporting import EXPORT_FORMATS, as_async, stream_export
+from .validation import PRIORITIES, TodoValidationError, clean_todo, parse_due_date
+from .importing import IMPORT_FORMATS, import_records
+import gzip
+from .folder_deletion import queue_folder_deletion, sync_delete_limit
+from .folder_lock import (
+    check_folder_password,
+    check_unlock_token,
+    hash_folder_password,
+    make_unlock_token,
+    unlock_token_max_age,
+)
+from .ordering import key_between, rebalance
+from . import activity, sharding, subtasks
+from .agenda import INCLUDE_MODES as AGENDA_INCLUDE_MODES, AgendaError, agenda as build_agenda, window as agenda_window
+from .tagging import (
+    MATCH_MODES as TAG_MATCH_MODES,
+    MAX_TODOS_PER_REQUEST as MAX_TAGGED_TODOS,
+    TagError,
+    clean_tag_names,
+    delete_tag,
+    filter_by_tags,
+    rename_tag,
+    tag_names_by_todo,
+    tag_todos,
+)
+from .batch import BatchError, clean_batch, run_batch
+from .idempotency import idempotent
+from .concurrency import UPDATE_ATTEMPTS, VersionError, changed_fields, etag, requested_version, save_changes
+from .events import publish_event, stream as event_stream, subscribe as subscribe_events
+from asgiref.sync import sync_to_async
+from .ratelimit import client_ip, hit as rate_limit_hit
+from .tokens import issue_tokens, refresh_tokens, revoke_tokens, user_from_access_token
+from http import HTTPStatus
+from rest_framework_simplejwt.exceptions import TokenError
 import secrets
-from datetime import datetime
+
+
+def _user_for_token(scheme, token):
+    if scheme == 'Bearer':
+        # Signed access token: verified without touching the database
+        try:
+            return user_from_access_token(token), None
+        except TokenError as e:
+            return None, JsonResponse({'error': str(e)}, status=HTTPStatus.UNAUTHORIZED)
+
+    # Legacy opaque token stored on the user, kept while clients migrate
+    try:
+        return CustomUser.objects.get(auth_token=token), None
+    except CustomUser.DoesNotExist:
+        return None, JsonResponse({'error': 'Invalid token'}, status=HTTPStatus.UNAUTHORIZED)
+
+
+def authenticate_request(request):
+    """Resolve the ``Authorization: Bearer <access token>`` (or legacy ``Token ...``) header.
+
+    Returns ``(user, None)`` on success or ``(None, error_response)``.
+    """
+    # Sub-requests of a batch reuse the batch's authentication
+    if getattr(request, 'authenticated_user', None) is not None:
+        return request.authenticated_user, None
+
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme not in ('Bearer', 'Token') or not token:
+        return None, JsonResponse({'error': 'Authorization Token required'}, status=HTTPStatus.UNAUTHORIZED)
+
+    user, error = _user_for_token(scheme, token)
+    if error:
+        return None, error
+
+    # Everything the request does with the user's data runs on their shard
+    shard, moving = sharding.lookup(user.id)
+    if moving:
+        response = JsonResponse(
+            {'error': 'Your data is being moved to another server; try again shortly'},
+            status=HTTPStatus.SERVICE_UNAVAILABLE
+        )
+        response['Retry-After'] = '30'
+        return None, response
+    sharding.activate(shard)
+    return user, None
+
+
+def _throttle(scope, value):
+    """429 response when ``scope`` is out of attempts for ``value``, else None."""
+    retry_after = rate_limit_hit(scope, value)
+    if not retry_after:
+        return None
+    response = JsonResponse(
+        {'error': 'Too many attempts. Try again later.', 'retry_after': math.ceil(retry_after)},
+        status=HTTPStatus.TOO_MANY_REQUESTS
+    )
+    response['Retry-After'] = str(math.ceil(retry_after))
+    return response
+
 
 @csrf_exempt
 def register(request):
     if request.method != 'POST':
-        return JsonResponse({'error': 'Only POST method allowed'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+        return JsonResponse({'error': 'Only POST method allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
+
+    # Throttle before any password validation or hashing
+    throttled = _throttle('register_ip', client_ip(request))
+    if throttled:
+        return throttled
     
     try:
         data = json.loads(request.body)
@@ -24,24 +131,30 @@ def register(request):
         phone = data.get('phone') 
 
         if not all([email, password, first_name, last_name, phone]):
-            return JsonResponse({'error': 'All fields are required'}, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse({'error': 'All fields are required'}, status=HTTPStatus.BAD_REQUEST)
+
+        throttled = _throttle('register_email', str(email).lower())
+        if throttled:
+            return throttled
 
         if CustomUser.objects.filter(email=email).exists():
-            return JsonResponse({'error': 'Email already exists'}, status=status.HTTP_409_CONFLICT)
+            return JsonResponse({'error': 'Email already exists'}, status=HTTPStatus.CONFLICT)
         
         try:
             validate_password(password)
         except ValidationError as e:
-            return JsonResponse({'error': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse({'error': e.messages}, status=HTTPStatus.BAD_REQUEST)
             
-        user = CustomUser.objects.create_user(
-            username=email,
-            email=email,
-            password=password,
-            first_name=first_name,
-            last_name=last_name,
-            phone=phone
-        )
+        with transaction.atomic():
+            user = CustomUser.objects.create_user(
+                username=email,
+                email=email,
+                password=password,
+                first_name=first_name,
+                last_name=last_name,
+                phone=phone
+            )
+            sharding.place(user)
 
         return JsonResponse({
             'message': 'User registered successfully',
@@ -52,17 +165,22 @@ def register(request):
                 'last_name': user.last_name,
                 'phone': user.phone
             }
-        }, status=status.HTTP_201_CREATED)
+        }, status=HTTPStatus.CREATED)
         
     except json.JSONDecodeError:
-        return JsonResponse({'error': 'Invalid JSON'}, status=status.HTTP_400_BAD_REQUEST)
+        return JsonResponse({'error': 'Invalid JSON'}, status=HTTPStatus.BAD_REQUEST)
     except Exception as e:
-        return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return JsonResponse({'error': str(e)}, status=HTTPStatus.BAD_REQUEST)
 
 @csrf_exempt
 def Login(request):
     if request.method != 'POST':
-        return JsonResponse({'error': 'Only POST method allowed'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+        return JsonResponse({'error': 'Only POST method allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
+
+    # Throttle before check_password runs the hasher
+    throttled = _throttle('login_ip', client_ip(request))
+    if throttled:
+        return throttled
    
     try:
         data = json.loads(request.body)
@@ -70,7 +188,11 @@ def Login(request):
         password = data.get('password')
         
         if not email or not password:
-            return JsonResponse({'error': 'Email and password are required'}, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse({'error': 'Email and password are required'}, status=HTTPStatus.BAD_REQUEST)
+
+        throttled = _throttle('login_email', str(email).lower())
+        if throttled:
+            return throttled
 
         try:
             user = CustomUser.objects.get(email=email)
@@ -81,51 +203,220 @@ def Login(request):
                 
                 return JsonResponse({
                     'message': 'Login successful',
+                    # Legacy token for clients that still send "Token ..."
                     'token': token,
+                    **issue_tokens(user),
                     'user_id': user.id,
                     'email': user.email,
                     'first_name': user.first_name,
                     'last_name': user.last_name
                 })
             else:
-                return JsonResponse({'error': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
+                return JsonResponse({'error': 'Invalid credentials'}, status=HTTPStatus.UNAUTHORIZED)
         except CustomUser.DoesNotExist:
-            return JsonResponse({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+            return JsonResponse({'error': 'User not found'}, status=HTTPStatus.NOT_FOUND)
             
     except json.JSONDecodeError:
-        return JsonResponse({'error': 'Invalid JSON'}, status=status.HTTP_400_BAD_REQUEST)
+        return JsonResponse({'error': 'Invalid JSON'}, status=HTTPStatus.BAD_REQUEST)
     except Exception as e:
-        return JsonResponse({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return JsonResponse({'error': str(e)}, status=HTTPStatus.INTERNAL_SERVER_ERROR)
+
+TODO_LIST_FIELDS = (
+    'id', 'parent_id', 'title', 'description', 'status', 'priority', 'due_date', 'completed', 'version', 'tags',
+    'created_at', 'updated_at'
+)
+FOLDER_TODO_LIST_FIELDS = (
+    'id', 'parent_id', 'title', 'description', 'status', 'priority', 'due_date', 'completed', 'position',
+    'version', 'tags', 'created_at', 'updated_at'
+)
+NEXT_UP_FIELDS = (
+    'id', 'folder_id', 'parent_id', 'title', 'description', 'status', 'priority', 'due_date', 'completed', 'version',
+    'tags', 'created_at', 'updated_at'
+)
+NEXT_UP_LIMIT = 10
+MAX_NEXT_UP_LIMIT = 100
+FOLDER_LIST_FIELDS = (
+    'id', 'user_folder_id', 'name', 'description', 'locked', 'priority', 'version', 'created_at', 'updated_at',
+    'todo_count'
+)
+
+
+def _requested_fields(request, allowed):
+    """Fields named by ``?fields=a,b``, checked against ``allowed``; all of them by default.
+
+    Returns ``(fields, None)`` or ``(None, error_response)``.
+    """
+    names = {name.strip() for name in request.GET.get('fields', '').split(',') if name.strip()}
+    if not names:
+        return list(allowed), None
+    unknown = sorted(names.difference(allowed))
+    if unknown:
+        return None, JsonResponse(
+            {'error': f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(allowed)}"},
+            status=HTTPStatus.BAD_REQUEST
+        )
+    # The id is always included so clients can address the rows
+    return [name for name in allowed if name in names or name == 'id'], None
+
+
+def _todo_rows(todos, fields):
+    # values() selects only the requested columns and skips building model
+    # instances, so unrequested descriptions are never read
+    rows = list(todos.values(*[field for field in fields if field != 'tags']))
+    if 'due_date' in fields:
+        for row in rows:
+            row['due_date'] = row['due_date'].strftime('%Y-%m-%d') if row['due_date'] else None
+    if 'tags' in fields:
+        # One query for the tags of every listed todo
+        tags = tag_names_by_todo(todos)
+        for row in rows:
+            row['tags'] = tags.get(row['id'], [])
+    return rows
+
+
+def _folder_event_data(folder):
+    return {
+        'id': folder.id,
+        'name': folder.name,
+        'description': folder.description,
+        'locked': folder.locked,
+        'priority': folder.priority,
+        'version': folder.version,
+        'updated_at': folder.updated_at
+    }
+
+
+def _folder_detail_data(folder):
+    return {
+        'id': folder.id,
+        'user_folder_id': folder.user_folder_id,
+        'name': folder.name,
+        'description': folder.description,
+        'locked': folder.locked,
+        'priority': folder.priority,
+        'version': folder.version,
+        'updated_at': folder.updated_at
+    }
+
+
+def _todo_detail_data(todo):
+    return {
+        'id': todo.id,
+        'folder_id': todo.folder_id,
+        'parent_id': todo.parent_id,
+        'title': todo.title,
+        'description': todo.description,
+        'status': todo.status,
+        'priority': todo.priority,
+        'due_date': todo.due_date.strftime('%Y-%m-%d') if todo.due_date else None,
+        'completed': todo.completed,
+        'recurrence_id': todo.recurrence_id,
+        'version': todo.version,
+        'created_at': todo.created_at,
+        'updated_at': todo.updated_at
+    }
+
+
+def _subtask_parent(user, parent_id, todo_id=None):
+    """The parent todo named by ``parent_id`` for a new (or moved) todo.
+
+    Returns ``(parent, None)`` or ``(None, error_response)``.
+    """
+    if not isinstance(parent_id, int) or isinstance(parent_id, bool):
+        return None, JsonResponse({'error': 'parent_id must be a todo id'}, status=HTTPStatus.BAD_REQUEST)
+    try:
+        parent = Todo.objects.exclude(folder__pending_deletion=True).get(id=parent_id, user=user)
+    except Todo.DoesNotExist:
+        return None, JsonResponse({'error': 'Parent todo not found'}, status=HTTPStatus.NOT_FOUND)
+    if todo_id is not None:
+        try:
+            subtasks.check_parent(todo_id, parent)
+        except subtasks.SubtaskError as e:
+            return None, JsonResponse({'error': str(e)}, status=HTTPStatus.BAD_REQUEST)
+    return parent, None
+
+
+def _version_conflict(current):
+    # The client's edit was based on an older version; it gets the row as it
+    # is now so it can merge and retry with the new version
+    response = JsonResponse(
+        {'error': 'Modified by another request', 'current': current},
+        status=HTTPStatus.CONFLICT
+    )
+    response['ETag'] = f'"{current["version"]}"'
+    return response
+
+
+def _todo_event_data(todo):
+    return {
+        'id': todo.id,
+        'folder_id': todo.folder_id,
+        'parent_id': todo.parent_id,
+        'title': todo.title,
+        'description': todo.description,
+        'status': todo.status,
+        'priority': todo.priority,
+        'due_date': todo.due_date.strftime('%Y-%m-%d') if todo.due_date else None,
+        'completed': todo.completed,
+        'position': todo.position,
+        'recurrence_id': todo.recurrence_id,
+        'version': todo.version,
+        'updated_at': todo.updated_at
+    }
+
 
 @csrf_exempt
-def todo_folders(request, folder_id=None):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Token '):
-        return JsonResponse({'error': 'Authorization Token required'}, status=status.HTTP_401_UNAUTHORIZED)
-    
-    token = auth_header.split(' ')[1]
-    
+def refresh_token(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST method allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
+
     try:
-        user = CustomUser.objects.get(auth_token=token)
-    except CustomUser.DoesNotExist:
-        return JsonResponse({'error': 'Invalid token'}, status=status.HTTP_401_UNAUTHORIZED)
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=HTTPStatus.BAD_REQUEST)
+    if not data.get('refresh'):
+        return JsonResponse({'error': 'Refresh token is required'}, status=HTTPStatus.BAD_REQUEST)
+
+    try:
+        return JsonResponse(refresh_tokens(data['refresh']), status=HTTPStatus.OK)
+    except TokenError as e:
+        return JsonResponse({'error': str(e)}, status=HTTPStatus.UNAUTHORIZED)
+
+
+@csrf_exempt
+def logout(request):
+    user, error = authenticate_request(request)
+    if error:
+        return error
+
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST method allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
+
+    # Signs out every device: revokes all signed tokens and the legacy token
+    revoke_tokens(user)
+    CustomUser.objects.filter(id=user.id).update(auth_token=None)
+    return JsonResponse({'message': 'Logged out'}, status=HTTPStatus.OK)
+
+
+@csrf_exempt
+@idempotent()
+def todo_folders(request, folder_id=None):
+    user, error = authenticate_request(request)
+    if error:
+        return error
 
     if request.method == 'GET':
-        folders = TodoFolder.objects.filter(user=user).order_by('-created_at')
-        
-        data = [{
-            'id': folder.id,
-            'user_folder_id': folder.user_folder_id,
-            'name': folder.name,
-            'description': folder.description,
-            'locked': folder.locked,
-            'priority': folder.priority,
-            'created_at': folder.created_at,
-            'updated_at': folder.updated_at,
-            'todo_count': folder.todos.count()
-        } for folder in folders]
-
-        return JsonResponse(data, safe=False, status=status.HTTP_200_OK)
+        fields, error = _requested_fields(request, FOLDER_LIST_FIELDS)
+        if error:
+            return error
+
+        folders = TodoFolder.objects.visible().filter(user=user).order_by('-created_at')
+        if 'todo_count' in fields:
+            # One grouped query instead of a COUNT per folder
+            folders = folders.annotate(todo_count=Count('todos'))
+        data = list(folders.values(*fields))
+
+        return JsonResponse(data, safe=False, status=HTTPStatus.OK)
 
     elif request.method == 'POST':
         try:
@@ -133,11 +424,13 @@ def todo_folders(request, folder_id=None):
             name = data.get('name')
             description = data.get('description', '')
             locked = data.get('locked', False)
-            password = data.get('password', '') if locked else None
+            password = hash_folder_password(data.get('password', '')) if locked else None
             priority = data.get('priority', 'medium')
 
             if not name:
-                return JsonResponse({'error': 'Folder name is required'}, status=status.HTTP_400_BAD_REQUEST)
+                return JsonResponse({'error': 'Folder name is required'}, status=HTTPStatus.BAD_REQUEST)
+            if priority is not None and priority not in PRIORITIES:
+                return JsonResponse({'error': 'Invalid priority'}, status=HTTPStatus.BAD_REQUEST)
 
             
             # Get the next user_folder_id
@@ -153,6 +446,8 @@ def todo_folders(request, folder_id=None):
                 password=password,
                 priority=priority
             )
+            publish_event(user.id, 'folder.created', _folder_event_data(folder))
+            activity.record(user.id, 'folder.created', 'folder', folder.id, {'name': folder.name})
 
             return JsonResponse({
                 'id': folder.id,
@@ -161,13 +456,14 @@ def todo_folders(request, folder_id=None):
                 'description': folder.description,
                 'locked': folder.locked,
                 'priority': folder.priority,
+                'version': folder.version,
                 'created_at': folder.created_at
-            }, status=status.HTTP_201_CREATED)
+            }, status=HTTPStatus.CREATED)
 
         except json.JSONDecodeError:
-            return JsonResponse({'error': 'Invalid JSON'}, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse({'error': 'Invalid JSON'}, status=HTTPStatus.BAD_REQUEST)
         except Exception as e:
-            return JsonResponse({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return JsonResponse({'error': str(e)}, status=HTTPStatus.INTERNAL_SERVER_ERROR)
 
     elif request.method == 'DELETE':
         try:
@@ -175,23 +471,38 @@ def todo_folders(request, folder_id=None):
             folder_id = data.get('folder_id')
             
             if not folder_id:
-                return JsonResponse({'error': 'Folder ID is required'}, status=status.HTTP_400_BAD_REQUEST)
+                return JsonResponse({'error': 'Folder ID is required'}, status=HTTPStatus.BAD_REQUEST)
 
             try:
-                folder = TodoFolder.objects.get(id=folder_id, user=user)
-                
+                folder = TodoFolder.objects.visible().get(id=folder_id, user=user)
                 
+                # Small folders are deleted right away; large ones are hidden
+                # and handed to the process_folder_deletions worker
+                limit = sync_delete_limit()
+                if Todo.objects.filter(folder=folder)[:limit + 1].count() > limit:
+                    job = queue_folder_deletion(folder)
+                    publish_event(user.id, 'folder.deleted', {'id': folder.id})
+                    activity.record(user.id, 'folder.deleted', 'folder', folder.id, {'name': folder.name})
+                    return JsonResponse({
+                        'message': 'Folder deletion scheduled',
+                        'job_id': job.id,
+                        'status': job.status
+                    }, status=HTTPStatus.ACCEPTED)
+
+                folder_id = folder.id
                 folder.delete()
+                publish_event(user.id, 'folder.deleted', {'id': folder_id})
+                activity.record(user.id, 'folder.deleted', 'folder', folder_id, {'name': folder.name})
                 return JsonResponse(
                     {'message': 'Folder deleted successfully'}, 
-                    status=status.HTTP_204_NO_CONTENT
+                    status=HTTPStatus.NO_CONTENT
                 )
             except TodoFolder.DoesNotExist:
-                return JsonResponse({'error': 'Folder not found'}, status=status.HTTP_404_NOT_FOUND)
+                return JsonResponse({'error': 'Folder not found'}, status=HTTPStatus.NOT_FOUND)
         except json.JSONDecodeError:
-            return JsonResponse({'error': 'Invalid JSON'}, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse({'error': 'Invalid JSON'}, status=HTTPStatus.BAD_REQUEST)
         except Exception as e:
-            return JsonResponse({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return JsonResponse({'error': str(e)}, status=HTTPStatus.INTERNAL_SERVER_ERROR)
 
     elif request.method == 'PUT':
         try:
@@ -199,95 +510,83 @@ def todo_folders(request, folder_id=None):
             folder_id = data.get('folder_id')
             
             if not folder_id:
-                return JsonResponse({'error': 'Folder ID is required'}, status=status.HTTP_400_BAD_REQUEST)
-
+                return JsonResponse({'error': 'Folder ID is required'}, status=HTTPStatus.BAD_REQUEST)
             try:
-                folder = TodoFolder.objects.get(id=folder_id, user=user)
-                
-                
-                # Update folder properties
-                name = data.get('name')
-                description = data.get('description')
-                locked = data.get('locked')
-                new_password = data.get('password')
-                priority = data.get('priority')
-                
-                if name is not None:
-                    folder.name = name
-                if description is not None:
-                    folder.description = description
-                if priority is not None:
-                    folder.priority = priority
-                
-                # Handle locking/unlocking logic
-                if locked is not None:
-                    if locked and not new_password:
-                        return JsonResponse(
-                            {'error': 'New password is required when locking a folder'},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-                    folder.locked = locked
-                    if locked:
-                        folder.password = new_password
-                    else:
-                        folder.password = None
-                
-                folder.save()
-                
-                return JsonResponse({
-                    'id': folder.id,
-                    'user_folder_id': folder.user_folder_id,
-                    'name': folder.name,
-                    'description': folder.description,
-                    'locked': folder.locked,
-                    'priority': folder.priority,
-                    'updated_at': folder.updated_at
-                }, status=status.HTTP_200_OK)
-                
-            except TodoFolder.DoesNotExist:
-                return JsonResponse({'error': 'Folder not found'}, status=status.HTTP_404_NOT_FOUND)
+                expected_version = requested_version(request, data)
+            except VersionError as e:
+                return JsonResponse({'error': str(e)}, status=HTTPStatus.BAD_REQUEST)
+
+            # Update folder properties
+            values = {}
+            for field in ('name', 'description', 'priority'):
+                if data.get(field) is not None:
+                    values[field] = data[field]
+            if values.get('priority', 'medium') not in PRIORITIES:
+                return JsonResponse({'error': 'Invalid priority'}, status=HTTPStatus.BAD_REQUEST)
+
+            # Handle locking/unlocking logic
+            locked = data.get('locked')
+            new_password = data.get('password')
+            if locked is not None:
+                if locked and not new_password:
+                    return JsonResponse(
+                        {'error': 'New password is required when locking a folder'},
+                        status=HTTPStatus.BAD_REQUEST
+                    )
+                values['locked'] = locked
+                values['password'] = hash_folder_password(new_password) if locked else None
+
+            for attempt in range(UPDATE_ATTEMPTS):
+                try:
+                    folder = TodoFolder.objects.visible().get(id=folder_id, user=user)
+                except TodoFolder.DoesNotExist:
+                    return JsonResponse({'error': 'Folder not found'}, status=HTTPStatus.NOT_FOUND)
+                if expected_version is not None and folder.version != expected_version:
+                    return _version_conflict(_folder_detail_data(folder))
+
+                changes = changed_fields(folder, values)
+                if not changes:
+                    break
+                logged = activity.diff(folder, changes)
+                if save_changes(folder, changes):
+                    publish_event(user.id, 'folder.updated', _folder_event_data(folder))
+                    activity.record(user.id, 'folder.updated', 'folder', folder.id, logged)
+                    break
+            else:
+                folder.refresh_from_db()
+                return _version_conflict(_folder_detail_data(folder))
+
+            response = JsonResponse(_folder_detail_data(folder), status=HTTPStatus.OK)
+            response['ETag'] = etag(folder)
+            return response
                 
         except json.JSONDecodeError:
-            return JsonResponse({'error': 'Invalid JSON'}, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse({'error': 'Invalid JSON'}, status=HTTPStatus.BAD_REQUEST)
         except Exception as e:
-            return JsonResponse({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    return JsonResponse({'error': 'Method not allowed'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+            return JsonResponse({'error': str(e)}, status=HTTPStatus.INTERNAL_SERVER_ERROR)
+    return JsonResponse({'error': 'Method not allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
 
 
 @csrf_exempt
 def verify_folder_password(request, folder_id):
-    # Authentication check
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Token '):
-        return JsonResponse(
-            {'error': 'Authorization Token required'}, 
-            status=status.HTTP_401_UNAUTHORIZED
-        )
-    
-    token = auth_header.split(' ')[1]
-    
-    try:
-        user = CustomUser.objects.get(auth_token=token)
-    except CustomUser.DoesNotExist:
-        return JsonResponse(
-            {'error': 'Invalid token'}, 
-            status=status.HTTP_401_UNAUTHORIZED
-        )
+    user, error = authenticate_request(request)
+    if error:
+        return error
 
     if request.method != 'POST':
         return JsonResponse(
             {'error': 'Only POST method allowed'}, 
-            status=status.HTTP_405_METHOD_NOT_ALLOWED
+            status=HTTPStatus.METHOD_NOT_ALLOWED
         )
 
     try:
         
         try:
-            folder = TodoFolder.objects.get(id=folder_id, user=user)
+            folder = TodoFolder.objects.visible().get(id=folder_id, user=user)
         except TodoFolder.DoesNotExist:
             return JsonResponse(
                 {'error': 'Folder not found'}, 
-                status=status.HTTP_404_NOT_FOUND
+                status=HTTPStatus.NOT_FOUND
             )
 
         # Parse request data
@@ -297,321 +596,1052 @@ def verify_folder_password(request, folder_id):
         if not password:
             return JsonResponse(
                 {'error': 'Password is required'}, 
-                status=status.HTTP_400_BAD_REQUEST
+                status=HTTPStatus.BAD_REQUEST
             )
 
-        # Verify password
+        # Verify password and hand out a short-lived unlock token so later
+        # operations on this folder don't have to pay for the hash again
         if folder.locked:
-            if password == folder.password:
+            if check_folder_password(folder, password):
                 return JsonResponse(
-                    {'message': 'Password verified successfully'}, 
-                    status=status.HTTP_200_OK
+                    {
+                        'message': 'Password verified successfully',
+                        'unlock_token': make_unlock_token(folder, user),
+                        'expires_in': unlock_token_max_age()
+                    },
+                    status=HTTPStatus.OK
                 )
             else:
                 return JsonResponse(
                     {'error': 'Incorrect password'}, 
-                    status=status.HTTP_403_FORBIDDEN
+                    status=HTTPStatus.FORBIDDEN
                 )
         else:
             return JsonResponse(
                 {'message': 'Folder is not locked, no password required'}, 
-                status=status.HTTP_200_OK
+                status=HTTPStatus.OK
             )
 
     except json.JSONDecodeError:
         return JsonResponse(
             {'error': 'Invalid JSON'}, 
-            status=status.HTTP_400_BAD_REQUEST
+            status=HTTPStatus.BAD_REQUEST
         )
     except Exception as e:
         return JsonResponse(
             {'error': str(e)}, 
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            status=HTTPStatus.INTERNAL_SERVER_ERROR
         )
 
 @csrf_exempt
+@idempotent()
 def todos(request):
-    # Authentication check
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Token '):
-        return JsonResponse(
-            {'error': 'Authorization Token required'}, 
-            status=status.HTTP_401_UNAUTHORIZED
-        )
-    
-    token = auth_header.split(' ')[1]
-    
-    try:
-        user = CustomUser.objects.get(auth_token=token)
-    except CustomUser.DoesNotExist:
-        return JsonResponse(
-            {'error': 'Invalid token'}, 
-            status=status.HTTP_401_UNAUTHORIZED
-        )
+    user, error = authenticate_request(request)
+    if error:
+        return error
 
     if request.method == 'GET':
+        fields, error = _requested_fields(request, TODO_LIST_FIELDS)
+        if error:
+            return error
+
         try:
-            todos = Todo.objects.filter(user=user).order_by('-created_at')
+            todos = Todo.objects.filter(user=user).exclude(folder__pending_deletion=True).order_by('-created_at')
+
+            # ?tags=a,b matches todos with any of the tags; add
+            # &tag_match=all for todos that have every one of them
+            if request.GET.get('tags'):
+                match = request.GET.get('tag_match', 'any')
+                if match not in TAG_MATCH_MODES:
+                    return JsonResponse(
+                        {'error': f"tag_match must be one of: {', '.join(TAG_MATCH_MODES)}"},
+                        status=HTTPStatus.BAD_REQUEST
+                    )
+                try:
+                    names = clean_tag_names(request.GET['tags'])
+                except TagError as e:
+                    return JsonResponse({'error': str(e)}, status=HTTPStatus.BAD_REQUEST)
+                todos = filter_by_tags(todos, user, names, match)
             
             data = {
-                'todos': [{
-                    'id': todo.id,
-                    'title': todo.title,
-                    'description': todo.description,
-                    'status': todo.status,
-                    'priority': todo.priority,
-                    'due_date': todo.due_date.strftime('%Y-%m-%d') if todo.due_date else None,
-                    'completed': todo.completed,
-                    'created_at': todo.created_at,
-                    'updated_at': todo.updated_at
-                } for todo in todos]
+                'todos': _todo_rows(todos, fields)
             }
 
-            return JsonResponse(data, status=status.HTTP_200_OK)
+            return JsonResponse(data, status=HTTPStatus.OK)
 
         except Exception as e:
             return JsonResponse(
                 {'error': str(e)}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                status=HTTPStatus.INTERNAL_SERVER_ERROR
             )
 
     elif request.method == 'POST':
         try:
             data = json.loads(request.body)
-            title = data.get('name') or data.get('title')  # Accept both field names
             folder_id = data.get('folder_id')
-            description = data.get('description', '')
-            priority = data.get('status') or data.get('priority', 'medium')  # Accept both
-            due_date = data.get('due_date')
-            completed = data.get('completed', False)
 
             # Validation
-            if not title:
+            try:
+                fields = clean_todo(
+                    title=data.get('name') or data.get('title'),  # Accept both field names
+                    description=data.get('description', ''),
+                    # Older clients send the priority as "status"
+                    priority=data['status'] if data.get('status') in PRIORITIES else data.get('priority', 'medium'),
+                    due_date=data.get('due_date'),
+                    completed=data.get('completed', False)
+                )
+            except TodoValidationError as e:
                 return JsonResponse(
-                    {'error': 'Title is required'}, 
-                    status=status.HTTP_400_BAD_REQUEST
+                    {'error': str(e)}, 
+                    status=HTTPStatus.BAD_REQUEST
                 )
                 
+            # Subtasks always live in their parent's folder
+            parent = None
+            if data.get('parent_id') is not None:
+                parent, error = _subtask_parent(user, data['parent_id'])
+                if error:
+                    return error
+                folder_id = parent.folder_id
+
             if not folder_id:
                 return JsonResponse(
                     {'error': 'Folder ID is required'}, 
-                    status=status.HTTP_400_BAD_REQUEST
+                    status=HTTPStatus.BAD_REQUEST
                 )
 
             try:
-                folder = TodoFolder.objects.get(id=folder_id, user=user)
-                
-                
-                # Parse date
-                parsed_due_date = None
-                if due_date:
-                    try:
-                        parsed_due_date = datetime.strptime(due_date, '%Y-%m-%d').date()
-                    except ValueError:
-                        return JsonResponse(
-                            {'error': 'Invalid date format. Use YYYY-MM-DD'}, 
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
+                folder = TodoFolder.objects.visible().get(id=folder_id, user=user)
 
-                # Create todo
-                todo = Todo.objects.create(
-                    user=user,
-                    folder=folder,
-                    title=title,
-                    description=description,
-                    status='pending',
-                    priority=priority,
-                    due_date=parsed_due_date,
-                    completed=completed
+                # New todos go to the top of the folder's manual order
+                first_position = (
+                    Todo.objects.filter(folder=folder)
+                    .order_by('position')
+                    .values_list('position', flat=True)
+                    .first()
                 )
 
+                # Create todo
+                with transaction.atomic(using=sharding.current()):
+                    todo = Todo.objects.create(
+                        user=user,
+                        folder=folder,
+                        parent=parent,
+                        position=key_between(None, first_position),
+                        **fields
+                    )
+                    if parent:
+                        subtasks.attach(todo.id, parent.id)
+                publish_event(user.id, 'todo.created', _todo_event_data(todo))
+                activity.record(user.id, 'todo.created', 'todo', todo.id, {'title': todo.title, 'folder_id': folder.id})
+
                 return JsonResponse({
                     'id': todo.id,
                     'folder_id': todo.folder.id,
+                    'parent_id': todo.parent_id,
                     'title': todo.title,
                     'description': todo.description,
                     'status': todo.status,
                     'priority': todo.priority,
                     'due_date': todo.due_date.strftime('%Y-%m-%d') if todo.due_date else None,
                     'completed': todo.completed,
+                    'position': todo.position,
+                    'version': todo.version,
                     'created_at': todo.created_at
-                }, status=status.HTTP_201_CREATED)
+                }, status=HTTPStatus.CREATED)
 
             except TodoFolder.DoesNotExist:
                 return JsonResponse(
                     {'error': 'Folder not found'}, 
-                    status=status.HTTP_404_NOT_FOUND
+                    status=HTTPStatus.NOT_FOUND
                 )
 
         except json.JSONDecodeError:
             return JsonResponse(
                 {'error': 'Invalid JSON'}, 
-                status=status.HTTP_400_BAD_REQUEST
+                status=HTTPStatus.BAD_REQUEST
             )
         except Exception as e:
             return JsonResponse(
                 {'error': str(e)}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                status=HTTPStatus.INTERNAL_SERVER_ERROR
             )
 
     return JsonResponse(
         {'error': 'Method not allowed'}, 
-        status=status.HTTP_405_METHOD_NOT_ALLOWED
+        status=HTTPStatus.METHOD_NOT_ALLOWED
     )
 
 @csrf_exempt
 def todo_detail(request, todo_id):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Token '):
-        return JsonResponse({'error': 'Authorization Token required'}, status=status.HTTP_401_UNAUTHORIZED)
-    
-    token = auth_header.split(' ')[1]
-    
-    try:
-        user = CustomUser.objects.get(auth_token=token)
-    except CustomUser.DoesNotExist:
-        return JsonResponse({'error': 'Invalid token'}, status=status.HTTP_401_UNAUTHORIZED)
+    user, error = authenticate_request(request)
+    if error:
+        return error
 
     try:
-        todo = Todo.objects.get(id=todo_id, user=user)
+        todo = Todo.objects.exclude(folder__pending_deletion=True).get(id=todo_id, user=user)
     except Todo.DoesNotExist:
-        return JsonResponse({'error': 'Todo not found'}, status=status.HTTP_404_NOT_FOUND)
+        return JsonResponse({'error': 'Todo not found'}, status=HTTPStatus.NOT_FOUND)
 
     if request.method == 'GET':
-        return JsonResponse({
-            'id': todo.id,
-            'folder_id': todo.folder.id,
-            'title': todo.title,
-            'description': todo.description,
-            'status': todo.status,
-            'priority': todo.priority,
-            'due_date': todo.due_date.strftime('%Y-%m-%d') if todo.due_date else None,
-            'completed': todo.completed,
-            'created_at': todo.created_at,
-            'updated_at': todo.updated_at
-        }, status=status.HTTP_200_OK)
+        data = {
+            **_todo_detail_data(todo),
+            'tags': sorted(todo.tags.values_list('name', flat=True)),
+        }
+        # ?include=subtree nests every subtask below the todo
+        if request.GET.get('include') == 'subtree':
+            tree = subtasks.subtree(todo)
+            data.update(progress=tree['progress'], subtasks=tree['children'])
+        else:
+            data['progress'] = subtasks.progress(todo.id)
+        response = JsonResponse(data, status=HTTPStatus.OK)
+        response['ETag'] = etag(todo)
+        return response
 
     elif request.method == 'PUT':
         try:
             data = json.loads(request.body)
-            
-           
-            todo.title = data.get('title', todo.title)
-            todo.description = data.get('description', todo.description)
-            todo.status = data.get('status', todo.status)
-            todo.priority = data.get('priority', todo.priority)
-            todo.completed = data.get('completed', todo.completed)
-            
+            expected_version = requested_version(request, data)
+            values = {
+                field: data[field] for field in ('title', 'description', 'status', 'priority', 'completed')
+                if field in data
+            }
+            if values.get('priority', 'medium') not in PRIORITIES:
+                raise TodoValidationError('Invalid priority')
             # Handle due_date update
-            due_date = data.get('due_date')
-            if due_date:
-                try:
-                    todo.due_date = datetime.strptime(due_date, '%Y-%m-%d').date()
-                except ValueError:
-                    return JsonResponse(
-                        {'error': 'Invalid date format. Use YYYY-MM-DD'}, 
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-            
-            todo.save()
+            if data.get('due_date'):
+                values['due_date'] = parse_due_date(data['due_date'])
+        except (TodoValidationError, VersionError) as e:
+            return JsonResponse(
+                {'error': str(e)}, 
+                status=HTTPStatus.BAD_REQUEST
+            )
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON'}, status=HTTPStatus.BAD_REQUEST)
 
-            return JsonResponse({
-                'id': todo.id,
-                'folder_id': todo.folder.id,
-                'title': todo.title,
-                'description': todo.description,
-                'status': todo.status,
-                'priority': todo.priority,
-                'due_date': todo.due_date.strftime('%Y-%m-%d') if todo.due_date else None,
-                'completed': todo.completed,
-                'updated_at': todo.updated_at
-            }, status=status.HTTP_200_OK)
+        # "parent_id" moves the todo and its subtasks below another todo, or
+        # to the top level when null
+        parent = None
+        if 'parent_id' in data:
+            if data['parent_id'] is not None:
+                parent, error = _subtask_parent(user, data['parent_id'], todo.id)
+                if error:
+                    return error
+                values['folder_id'] = parent.folder_id
+            values['parent_id'] = data['parent_id']
 
-        except json.JSONDecodeError:
-            return JsonResponse({'error': 'Invalid JSON'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            for attempt in range(UPDATE_ATTEMPTS):
+                if attempt:
+                    try:
+                        todo = Todo.objects.exclude(folder__pending_deletion=True).get(id=todo_id, user=user)
+                    except Todo.DoesNotExist:
+                        return JsonResponse({'error': 'Todo not found'}, status=HTTPStatus.NOT_FOUND)
+                if expected_version is not None and todo.version != expected_version:
+                    return _version_conflict(_todo_detail_data(todo))
+
+                was_done = is_done(todo)
+                changes = changed_fields(todo, values)
+                logged = activity.diff(todo, changes)
+                with transaction.atomic(using=sharding.current()):
+                    if parent is not None and 'parent_id' in changes:
+                        subtasks.lock_for_move(todo.id, parent)
+                    if changes and not save_changes(todo, changes):
+                        continue
+                    if 'parent_id' in changes:
+                        subtasks.move(todo, parent)
+                    # Completing a recurring todo materializes its next occurrence
+                    next_todo = materialize_next(todo) if not was_done and is_done(todo) else None
+                    if changes:
+                        publish_event(user.id, 'todo.updated', _todo_event_data(todo))
+                        activity.record(user.id, 'todo.updated', 'todo', todo.id, logged)
+                    if next_todo:
+                        publish_event(user.id, 'todo.created', _todo_event_data(next_todo))
+                        activity.record(user.id, 'todo.created', 'todo', next_todo.id, {
+                            'title': next_todo.title, 'folder_id': next_todo.folder_id, 'recurrence_id': next_todo.recurrence_id
+                        })
+                break
+            else:
+                todo.refresh_from_db()
+                return _version_conflict(_todo_detail_data(todo))
+
+            response = JsonResponse({
+                **_todo_detail_data(todo),
+                'next_occurrence_id': next_todo.id if next_todo else None,
+            }, status=HTTPStatus.OK)
+            response['ETag'] = etag(todo)
+            return response
+
+        except subtasks.SubtaskError as e:
+            # Another request moved the new parent below this todo meanwhile
+            return JsonResponse({'error': str(e)}, status=HTTPStatus.BAD_REQUEST)
         except Exception as e:
-            return JsonResponse({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return JsonResponse({'error': str(e)}, status=HTTPStatus.INTERNAL_SERVER_ERROR)
 
     elif request.method == 'DELETE':
-        # Check if folder is locked and password is correct
+        # Check if folder is locked: accept an unlock token from
+        # verify_folder_password, or fall back to the password itself
         if todo.folder.locked:
-            try:
-                data = json.loads(request.body)
-                password = data.get('password')
-                if not password or password != todo.folder.password:
+            unlock_token = request.headers.get('X-Folder-Unlock')
+            password = None
+            if not unlock_token:
+                try:
+                    data = json.loads(request.body)
+                    unlock_token = data.get('unlock_token')
+                    password = data.get('password')
+                except json.JSONDecodeError:
                     return JsonResponse(
-                        {'error': 'Incorrect password for this folder'}, 
-                        status=status.HTTP_403_FORBIDDEN
+                        {'error': 'Password or unlock token is required in request body for locked folder'}, 
+                        status=HTTPStatus.BAD_REQUEST
                     )
-            except json.JSONDecodeError:
+            if unlock_token:
+                unlocked = check_unlock_token(unlock_token, todo.folder, user)
+            else:
+                unlocked = check_folder_password(todo.folder, password)
+            if not unlocked:
                 return JsonResponse(
-                    {'error': 'Password is required in request body for locked folder'}, 
-                    status=status.HTTP_400_BAD_REQUEST
+                    {'error': 'Incorrect password for this folder'}, 
+                    status=HTTPStatus.FORBIDDEN
                 )
 
-        todo.delete()
+        # Deleting a todo deletes its subtasks too
+        subtask_ids = subtasks.delete_branch(todo)
+        publish_event(user.id, 'todo.deleted', {'id': todo.id, 'folder_id': todo.folder_id, 'subtask_ids': subtask_ids})
+        activity.record(user.id, 'todo.deleted', 'todo', todo.id, {'title': todo.title, 'subtask_ids': subtask_ids})
+        if todo.recurrence_id:
+            # A series ends once none of its occurrences are left
+            RecurrenceRule.objects.filter(id=todo.recurrence_id, todos__isnull=True).delete()
         return JsonResponse(
             {'message': 'Todo deleted successfully'}, 
-            status=status.HTTP_204_NO_CONTENT
+            status=HTTPStatus.NO_CONTENT
         )
 
-    return JsonResponse({'error': 'Method not allowed'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    return JsonResponse({'error': 'Method not allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
 
 @csrf_exempt
 def todos_by_folder(request, folder_id):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Token '):
-        return JsonResponse({'error': 'Authorization Token required'}, status=status.HTTP_401_UNAUTHORIZED)
-    
-    token = auth_header.split(' ')[1]
-    
+    user, error = authenticate_request(request)
+    if error:
+        return error
+
     try:
-        user = CustomUser.objects.get(auth_token=token)
-        folder = TodoFolder.objects.get(id=folder_id, user=user)
-    except CustomUser.DoesNotExist:
-        return JsonResponse({'error': 'Invalid token'}, status=status.HTTP_401_UNAUTHORIZED)
+        folder = TodoFolder.objects.visible().get(id=folder_id, user=user)
     except TodoFolder.DoesNotExist:
-        return JsonResponse({'error': 'Folder not found'}, status=status.HTTP_404_NOT_FOUND)
+        return JsonResponse({'error': 'Folder not found'}, status=HTTPStatus.NOT_FOUND)
+
+    fields, error = _requested_fields(request, FOLDER_TODO_LIST_FIELDS)
+    if error:
+        return error
 
     if request.method == 'GET':
         # For GET requests, don't require password even for locked folders
         # Since we're just reading todos, not modifying them
-        todos = Todo.objects.filter(user=user, folder=folder).order_by('-created_at')
+        todos = Todo.objects.filter(user=user, folder=folder).order_by('position', 'id')
         
         data = {
-            'todos': [{
-                'id': todo.id,
-                'title': todo.title,
-                'description': todo.description,
-                'status': todo.status,
-                'priority': todo.priority,
-                'due_date': todo.due_date.strftime('%Y-%m-%d') if todo.due_date else None,
-                'completed': todo.completed,
-                'created_at': todo.created_at,
-                'updated_at': todo.updated_at
-            } for todo in todos]
+            'todos': _todo_rows(todos, fields)
         }
 
-        return JsonResponse(data, safe=False, status=status.HTTP_200_OK)
+        return JsonResponse(data, safe=False, status=HTTPStatus.OK)
 
     elif request.method == 'POST':
        
-        todos = Todo.objects.filter(user=user, folder=folder).order_by('-created_at')
+        todos = Todo.objects.filter(user=user, folder=folder).order_by('position', 'id')
         
         data = {
-            'todos': [{
-                'id': todo.id,
-                'title': todo.title,
-                'description': todo.description,
-                'status': todo.status,
-                'priority': todo.priority,
-                'due_date': todo.due_date.strftime('%Y-%m-%d') if todo.due_date else None,
-                'completed': todo.completed,
-                'created_at': todo.created_at,
-                'updated_at': todo.updated_at
-            } for todo in todos]
+            'todos': _todo_rows(todos, fields)
         }
 
-        return JsonResponse(data, safe=False, status=status.HTTP_200_OK)
+        return JsonResponse(data, safe=False, status=HTTPStatus.OK)
+
+    return JsonResponse({'error': 'Method not allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
+
+
+@csrf_exempt
+def tags(request):
+    user, error = authenticate_request(request)
+    if error:
+        return error
+
+    if request.method == 'GET':
+        data = list(
+            Tag.objects.filter(user=user)
+            .annotate(todo_count=Count('todo_tags'))
+            .order_by('name')
+            .values('id', 'name', 'todo_count')
+        )
+        return JsonResponse(data, safe=False, status=HTTPStatus.OK)
+
+    elif request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            if not isinstance(data, dict):
+                return JsonResponse({'error': 'Request body must be a JSON object'}, status=HTTPStatus.BAD_REQUEST)
+            names = clean_tag_names([data.get('name') or ''])
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON'}, status=HTTPStatus.BAD_REQUEST)
+        except TagError as e:
+            return JsonResponse({'error': str(e)}, status=HTTPStatus.BAD_REQUEST)
+        if not names:
+            return JsonResponse({'error': 'Tag name is required'}, status=HTTPStatus.BAD_REQUEST)
+
+        tag, created = Tag.objects.get_or_create(user=user, name=names[0])
+        return JsonResponse(
+            {'id': tag.id, 'name': tag.name, 'created_at': tag.created_at},
+            status=HTTPStatus.CREATED if created else HTTPStatus.OK
+        )
+
+    return JsonResponse({'error': 'Method not allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
+
+
+@csrf_exempt
+def tag_detail(request, tag_id):
+    user, error = authenticate_request(request)
+    if error:
+        return error
+
+    try:
+        tag = Tag.objects.get(id=tag_id, user=user)
+    except Tag.DoesNotExist:
+        return JsonResponse({'error': 'Tag not found'}, status=HTTPStatus.NOT_FOUND)
+
+    if request.method == 'PUT':
+        try:
+            data = json.loads(request.body)
+            if not isinstance(data, dict):
+                return JsonResponse({'error': 'Request body must be a JSON object'}, status=HTTPStatus.BAD_REQUEST)
+            names = clean_tag_names([data.get('name') or ''])
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON'}, status=HTTPStatus.BAD_REQUEST)
+        except TagError as e:
+            return JsonResponse({'error': str(e)}, status=HTTPStatus.BAD_REQUEST)
+        if not names:
+            return JsonResponse({'error': 'Tag name is required'}, status=HTTPStatus.BAD_REQUEST)
+
+        old_name = tag.name
+        try:
+            rename_tag(tag, names[0])
+        except IntegrityError:
+            # Names are unique per user, checked by the database so
+            # concurrent renames can't both win
+            return JsonResponse({'error': 'A tag with this name already exists'}, status=HTTPStatus.CONFLICT)
+        publish_event(user.id, 'tag.updated', {'id': tag.id, 'name': tag.name, 'old_name': old_name})
+        return JsonResponse({'id': tag.id, 'name': tag.name, 'created_at': tag.created_at}, status=HTTPStatus.OK)
+
+    elif request.method == 'DELETE':
+        publish_event(user.id, 'tag.deleted', {'id': tag.id, 'name': tag.name})
+        delete_tag(tag)
+        return JsonResponse({'message': 'Tag deleted successfully'}, status=HTTPStatus.NO_CONTENT)
+
+    return JsonResponse({'error': 'Method not allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
+
+
+@csrf_exempt
+def bulk_tag_todos(request):
+    user, error = authenticate_request(request)
+    if error:
+        return error
+
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST method allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
+
+    try:
+        data = json.loads(request.body)
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'Request body must be a JSON object'}, status=HTTPStatus.BAD_REQUEST)
+        add = clean_tag_names(data.get('add') or [])
+        remove = clean_tag_names(data.get('remove') or [])
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=HTTPStatus.BAD_REQUEST)
+    except TagError as e:
+        return JsonResponse({'error': str(e)}, status=HTTPStatus.BAD_REQUEST)
+
+    todo_ids = data.get('todo_ids')
+    if not isinstance(todo_ids, list) or not todo_ids or not all(isinstance(i, int) for i in todo_ids):
+        return JsonResponse({'error': 'todo_ids must be a non-empty list of ids'}, status=HTTPStatus.BAD_REQUEST)
+    if len(todo_ids) > MAX_TAGGED_TODOS:
+        return JsonResponse(
+            {'error': f'At most {MAX_TAGGED_TODOS} todos per request'}, status=HTTPStatus.BAD_REQUEST
+        )
+    if not add and not remove:
+        return JsonResponse({'error': 'Nothing to add or remove'}, status=HTTPStatus.BAD_REQUEST)
+
+    found = tag_todos(user, todo_ids, add, remove)
+    if found:
+        publish_event(user.id, 'todos.tagged', {'todo_ids': found, 'added': add, 'removed': remove})
+    for todo_id in found:
+        activity.record(user.id, 'todo.tagged', 'todo', todo_id, {'added': add, 'removed': remove})
+    return JsonResponse({
+        'updated': found,
+        'not_found': sorted(set(todo_ids).difference(found)),
+        'added': add,
+        'removed': remove
+    }, status=HTTPStatus.OK)
+
+
+def _move_bounds(folder, todo_id, after, anchor_position):
+    """Keys that a todo moved directly after/before the anchor must sit between.
+
+    An anchor position of None means the top (after) or bottom (before) of the folder.
+    """
+    others = Todo.objects.filter(folder=folder).exclude(id=todo_id)
+    if after:
+        if anchor_position is not None:
+            others = others.filter(position__gt=anchor_position)
+        return anchor_position, others.order_by('position').values_list('position', flat=True).first()
+    if anchor_position is not None:
+        others = others.filter(position__lt=anchor_position)
+    return others.order_by('-position').values_list('position', flat=True).first(), anchor_position
+
+
+@csrf_exempt
+def reorder_todos(request, folder_id):
+    user, error = authenticate_request(request)
+    if error:
+        return error
+
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST method allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
+
+    try:
+        folder = TodoFolder.objects.visible().get(id=folder_id, user=user)
+    except TodoFolder.DoesNotExist:
+        return JsonResponse({'error': 'Folder not found'}, status=HTTPStatus.NOT_FOUND)
+
+    try:
+        data = json.loads(request.body)
+        moves = data.get('moves')
+        if not isinstance(moves, list) or not moves:
+            return JsonResponse({'error': 'moves must be a non-empty list'}, status=HTTPStatus.BAD_REQUEST)
+
+        # Each move is {"id": .., "after_id": ..} or {"id": .., "before_id": ..};
+        # "after_id": null moves to the top, "before_id": null to the bottom.
+        referenced = set()
+        for move in moves:
+            if not isinstance(move, dict) or 'id' not in move or ('after_id' in move) == ('before_id' in move):
+                return JsonResponse(
+                    {'error': 'Each move needs an id and exactly one of after_id or before_id'},
+                    status=HTTPStatus.BAD_REQUEST
+                )
+            referenced.add(move['id'])
+            anchor = move.get('after_id', move.get('before_id'))
+            if anchor is not None:
+                referenced.add(anchor)
+
+        positions = dict(
+            Todo.objects.filter(folder=folder, user=user, id__in=referenced).values_list('id', 'position')
+        )
+        missing = referenced - positions.keys()
+        if missing:
+            return JsonResponse(
+                {'error': f'Todos not found in this folder: {sorted(missing)}'},
+                status=HTTPStatus.NOT_FOUND
+            )
+
+        original = dict(positions)
+        with transaction.atomic(using=sharding.current()):
+            for move in moves:
+                todo_id = move['id']
+                after = 'after_id' in move
+                anchor = move['after_id'] if after else move['before_id']
+                if anchor == todo_id:
+                    continue
+
+                position = key_between(*_move_bounds(folder, todo_id, after, positions.get(anchor)))
+                if len(position) >= Todo._meta.get_field('position').max_length:
+                    # Far past the background rebalance threshold: respace now
+                    rebalance(Todo.objects.filter(folder=folder))
+                    positions = dict(
+                        Todo.objects.filter(folder=folder, id__in=referenced).values_list('id', 'position')
+                    )
+                    position = key_between(*_move_bounds(folder, todo_id, after, positions.get(anchor)))
+
+                # Moving an item is a single-row UPDATE
+                Todo.objects.filter(id=todo_id).update(position=position)
+                positions[todo_id] = position
+
+        moved_ids = dict.fromkeys(move['id'] for move in moves)
+        for todo_id in moved_ids:
+            if positions[todo_id] != original[todo_id]:
+                activity.record(user.id, 'todo.updated', 'todo', todo_id, {
+                    'position': [original[todo_id], positions[todo_id]]
+                })
+        publish_event(user.id, 'todos.reordered', {
+            'folder_id': folder.id,
+            'todos': [{'id': todo_id, 'position': positions[todo_id]} for todo_id in moved_ids]
+        })
+        return JsonResponse({
+            'todos': [{'id': todo_id, 'position': positions[todo_id]} for todo_id in moved_ids]
+        }, status=HTTPStatus.OK)
+
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=HTTPStatus.BAD_REQUEST)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=HTTPStatus.INTERNAL_SERVER_ERROR)
+
+
+@csrf_exempt
+def folder_deletion_job(request, job_id):
+    user, error = authenticate_request(request)
+    if error:
+        return error
+
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Only GET method allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
+
+    try:
+        job = FolderDeletionJob.objects.get(id=job_id, user=user)
+    except FolderDeletionJob.DoesNotExist:
+        return JsonResponse({'error': 'Job not found'}, status=HTTPStatus.NOT_FOUND)
+
+    return JsonResponse({
+        'id': job.id,
+        'folder_id': job.folder_id,
+        'folder_name': job.folder_name,
+        'status': job.status,
+        'total_todos': job.total_todos,
+        'deleted_todos': job.deleted_todos,
+        'progress': round(job.deleted_todos / job.total_todos, 4) if job.total_todos else None,
+        'error': job.error or None,
+        'attempts': job.attempts,
+        # Set while a failed run waits to be retried
+        'retry_at': job.retry_at if job.status == 'pending' else None,
+        'created_at': job.created_at,
+        'updated_at': job.updated_at,
+        'finished_at': job.finished_at
+    }, status=HTTPStatus.OK)
+
+
+def _archived_todo_data(todo):
+    return {
+        'id': todo.id,
+        'folder_id': todo.folder_id,
+        'title': todo.title,
+        'description': todo.description,
+        'status': todo.status,
+        'priority': todo.priority,
+        'due_date': todo.due_date.strftime('%Y-%m-%d') if todo.due_date else None,
+        'completed': todo.completed,
+        'created_at': todo.created_at,
+        'updated_at': todo.updated_at,
+        'archived_at': todo.archived_at
+    }
+
+
+@csrf_exempt
+def archived_todos(request):
+    user, error = authenticate_request(request)
+    if error:
+        return error
+
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Only GET method allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
+
+    try:
+        limit = min(int(request.GET.get('limit', 50)), 200)
+        before = request.GET.get('before')
+        folder_id = request.GET.get('folder_id')
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=HTTPStatus.BAD_REQUEST)
+
+    # Keyset pagination on (user, id): pass the last id back as ?before=
+    archived = ArchivedTodo.objects.filter(user=user).order_by('-id')
+    try:
+        if before:
+            archived = archived.filter(id__lt=int(before))
+        if folder_id:
+            archived = archived.filter(folder_id=int(folder_id))
+    except ValueError:
+        return JsonResponse({'error': 'before and folder_id must be integers'}, status=HTTPStatus.BAD_REQUEST)
+
+    page = list(archived[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+
+    return JsonResponse({
+        'todos': [_archived_todo_data(todo) for todo in page],
+        'next_before': page[-1].id if has_more else None
+    }, status=HTTPStatus.OK)
+
+
+@csrf_exempt
+def restore_archived(request, todo_id):
+    user, error = authenticate_request(request)
+    if error:
+        return error
+
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST method allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
+
+    try:
+        archived = ArchivedTodo.objects.get(id=todo_id, user=user)
+    except ArchivedTodo.DoesNotExist:
+        return JsonResponse({'error': 'Archived todo not found'}, status=HTTPStatus.NOT_FOUND)
+
+    if archived.folder_id is not None and archived.folder.pending_deletion:
+        return JsonResponse({'error': 'Folder not found'}, status=HTTPStatus.NOT_FOUND)
+
+    try:
+        todo = restore_archived_todo(archived)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=HTTPStatus.INTERNAL_SERVER_ERROR)
+    publish_event(user.id, 'todo.created', _todo_event_data(todo))
+    activity.record(user.id, 'todo.restored', 'todo', todo.id, {'title': todo.title, 'archived_id': archived.id})
+
+    return JsonResponse({
+        'id': todo.id,
+        'folder_id': todo.folder_id,
+        'title': todo.title,
+        'description': todo.description,
+        'status': todo.status,
+        'priority': todo.priority,
+        'due_date': todo.due_date.strftime('%Y-%m-%d') if todo.due_date else None,
+        'completed': todo.completed,
+        'created_at': todo.created_at,
+        'updated_at': todo.updated_at
+    }, status=HTTPStatus.OK)
+
+
+def _activity_data(entry):
+    return {
+        'id': entry.id,
+        'action': entry.action,
+        'object_type': entry.object_type,
+        'object_id': entry.object_id,
+        'changes': entry.changes,
+        'created_at': entry.created_at
+    }
+
+
+@csrf_exempt
+def activity_feed(request):
+    user, error = authenticate_request(request)
+    if error:
+        return error
+
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Only GET method allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
+
+    try:
+        limit = min(int(request.GET.get('limit', 50)), 200)
+        before = request.GET.get('before')
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=HTTPStatus.BAD_REQUEST)
+
+    # Newest first, keyset-paginated on (user, id) like archived todos.
+    # Entries show up once their batch is flushed, a few seconds at most.
+    entries = Activity.objects.filter(user=user).order_by('-id')
+    if before:
+        try:
+            entries = entries.filter(id__lt=int(before))
+        except ValueError:
+            return JsonResponse({'error': 'before must be an integer'}, status=HTTPStatus.BAD_REQUEST)
+
+    page = list(entries[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+
+    return JsonResponse({
+        'activity': [_activity_data(entry) for entry in page],
+        'next_before': page[-1].id if has_more else None
+    }, status=HTTPStatus.OK)
+
+
+@csrf_exempt
+def export_data(request):
+    user, error = authenticate_request(request)
+    if error:
+        return error
+
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Only GET method allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
+
+    export_format = request.GET.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse(
+            {'error': f"format must be one of: {', '.join(EXPORT_FORMATS)}"},
+            status=HTTPStatus.BAD_REQUEST
+        )
+    gzip = request.GET.get('gzip') in ('1', 'true')
+
+    filename = f'todos-export.{export_format}' + ('.gz' if gzip else '')
+    chunks = stream_export(user, export_format, gzip)
+    if isinstance(request, ASGIRequest):
+        chunks = as_async(chunks)
+    response = StreamingHttpResponse(
+        chunks,
+        content_type='application/gzip' if gzip else EXPORT_FORMATS[export_format]
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@csrf_exempt
+@idempotent(hash_body=False)
+def import_data(request):
+    user, error = authenticate_request(request)
+    if error:
+        return error
+
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST method allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
+
+    import_format = request.GET.get('format')
+    if not import_format:
+        import_format = 'csv' if request.content_type == 'text/csv' else 'ndjson'
+    if import_format not in IMPORT_FORMATS:
+        return JsonResponse(
+            {'error': f"format must be one of: {', '.join(IMPORT_FORMATS)}"},
+            status=HTTPStatus.BAD_REQUEST
+        )
+
+    # Read the body line by line straight from the request stream instead
+    # of request.body, so large uploads never sit in memory
+    lines = request
+    if request.headers.get('Content-Encoding') == 'gzip':
+        lines = gzip.GzipFile(fileobj=request)
+
+    try:
+        summary = import_records(user, lines, import_format)
+    except (OSError, EOFError, UnicodeDecodeError, csv.Error) as e:
+        return JsonResponse({'error': f'Could not read upload: {e}'}, status=HTTPStatus.BAD_REQUEST)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    # Too many rows for per-todo events; clients refetch instead
+    publish_event(user.id, 'data.imported', summary)
+    return JsonResponse(summary, status=HTTPStatus.OK)
+
+
+def _recurrence_data(rule):
+    return {
+        'id': rule.id,
+        'frequency': rule.frequency,
+        'interval': rule.interval,
+        'weekdays': [int(day) for day in rule.weekdays.split(',')] if rule.weekdays else [],
+        'start_date': rule.start_date.strftime('%Y-%m-%d'),
+        'until': rule.until.strftime('%Y-%m-%d') if rule.until else None,
+        'count': rule.count
+    }
+
+
+@csrf_exempt
+def todo_recurrence(request, todo_id):
+    user, error = authenticate_request(request)
+    if error:
+        return error
+
+    try:
+        todo = Todo.objects.exclude(folder__pending_deletion=True).select_related('recurrence').get(id=todo_id, user=user)
+    except Todo.DoesNotExist:
+        return JsonResponse({'error': 'Todo not found'}, status=HTTPStatus.NOT_FOUND)
+
+    if request.method == 'GET':
+        if todo.recurrence is None:
+            return JsonResponse({'error': 'Todo does not repeat'}, status=HTTPStatus.NOT_FOUND)
+        return JsonResponse(_recurrence_data(todo.recurrence), status=HTTPStatus.OK)
+
+    elif request.method == 'PUT':
+        try:
+            data = json.loads(request.body)
+            fields = clean_rule(data)
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON'}, status=HTTPStatus.BAD_REQUEST)
+        except RecurrenceError as e:
+            return JsonResponse({'error': str(e)}, status=HTTPStatus.BAD_REQUEST)
+
+        if not todo.due_date:
+            return JsonResponse(
+                {'error': 'A due date is required to make a todo repeat'},
+                status=HTTPStatus.BAD_REQUEST
+            )
+
+        # The todo becomes the first occurrence; replacing a rule restarts
+        # the series from this todo
+        rule = todo.recurrence or RecurrenceRule(user=user)
+        rule.folder_id = todo.folder_id
+        rule.title, rule.description, rule.priority = todo.title, todo.description, todo.priority
+        rule.start_date = todo.due_date
+        for name, value in fields.items():
+            setattr(rule, name, value)
+        with transaction.atomic(using=sharding.current()):
+            rule.save()
+            if todo.recurrence_id != rule.id:
+                Todo.objects.filter(id=todo.id).update(recurrence=rule)
+
+        return JsonResponse(_recurrence_data(rule), status=HTTPStatus.OK)
+
+    elif request.method == 'DELETE':
+        if todo.recurrence is None:
+            return JsonResponse({'error': 'Todo does not repeat'}, status=HTTPStatus.NOT_FOUND)
+        # Existing occurrences stay as plain todos (on_delete=SET_NULL)
+        todo.recurrence.delete()
+        return JsonResponse({'message': 'Recurrence removed'}, status=HTTPStatus.NO_CONTENT)
+
+    return JsonResponse({'error': 'Method not allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
+
+
+@csrf_exempt
+def todo_occurrences(request):
+    user, error = authenticate_request(request)
+    if error:
+        return error
+
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Only GET method allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
+
+    try:
+        start = parse_due_date(request.GET.get('start'))
+        end = parse_due_date(request.GET.get('end'))
+    except TodoValidationError as e:
+        return JsonResponse({'error': str(e)}, status=HTTPStatus.BAD_REQUEST)
+    if not start or not end or end < start:
+        return JsonResponse({'error': 'start and end dates are required, with start <= end'}, status=HTTPStatus.BAD_REQUEST)
+    if (end - start).days > 366:
+        return JsonResponse({'error': 'The window can span at most 366 days'}, status=HTTPStatus.BAD_REQUEST)
+
+    todos = (
+        Todo.objects.filter(user=user, due_date__gte=start, due_date__lte=end)
+        .exclude(folder__pending_deletion=True)
+    )
+    entries = [{
+        'id': todo.id,
+        'recurrence_id': todo.recurrence_id,
+        'folder_id': todo.folder_id,
+        'title': todo.title,
+        'status': todo.status,
+        'priority': todo.priority,
+        'due_date': todo.due_date.strftime('%Y-%m-%d'),
+        'completed': todo.completed,
+        'virtual': False
+    } for todo in todos]
+
+    entries.extend({
+        'id': None,
+        'recurrence_id': rule.id,
+        'folder_id': rule.folder_id,
+        'title': rule.title,
+        'status': 'pending',
+        'priority': rule.priority,
+        'due_date': day.strftime('%Y-%m-%d'),
+        'completed': False,
+        'virtual': True
+    } for rule, day in expand_for_user(user, start, end))
+
+    entries.sort(key=lambda entry: entry['due_date'])
+    return JsonResponse({'occurrences': entries}, status=HTTPStatus.OK)
+
+
+@csrf_exempt
+def todo_agenda(request):
+    user, error = authenticate_request(request)
+    if error:
+        return error
+
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Only GET method allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
+
+    # ?start=&end= default to the week from today in ?tz= (or TIME_ZONE);
+    # ?include=ids|rows|none picks what is listed per day besides the counts
+    include = request.GET.get('include', 'ids')
+    if include not in AGENDA_INCLUDE_MODES:
+        return JsonResponse(
+            {'error': f"include must be one of: {', '.join(AGENDA_INCLUDE_MODES)}"},
+            status=HTTPStatus.BAD_REQUEST
+        )
+    try:
+        start, end = agenda_window(
+            parse_due_date(request.GET.get('start')),
+            parse_due_date(request.GET.get('end')),
+            request.GET.get('tz'),
+        )
+    except (TodoValidationError, AgendaError) as e:
+        return JsonResponse({'error': str(e)}, status=HTTPStatus.BAD_REQUEST)
+
+    return JsonResponse({
+        'start': start.strftime('%Y-%m-%d'),
+        'end': end.strftime('%Y-%m-%d'),
+        'days': build_agenda(user, start, end, include)
+    }, status=HTTPStatus.OK)
+
+
+@csrf_exempt
+def todos_next_up(request):
+    user, error = authenticate_request(request)
+    if error:
+        return error
+
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Only GET method allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
+
+    fields, error = _requested_fields(request, NEXT_UP_FIELDS)
+    if error:
+        return error
+    try:
+        limit = min(int(request.GET.get('limit', NEXT_UP_LIMIT)), MAX_NEXT_UP_LIMIT)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=HTTPStatus.BAD_REQUEST)
+    if limit < 1:
+        return JsonResponse({'error': 'limit must be at least 1'}, status=HTTPStatus.BAD_REQUEST)
+
+    # Read in todo_next_up_idx order, stopping after ``limit`` rows instead
+    # of sorting every open todo
+    todos = (
+        Todo.objects.filter(OPEN_TODOS, user=user)
+        .exclude(folder__pending_deletion=True)
+        .order_by(*NEXT_UP_ORDER)[:limit]
+    )
+    return JsonResponse({'todos': _todo_rows(todos, fields)}, status=HTTPStatus.OK)
+
+
+@csrf_exempt
+@idempotent()
+def batch(request):
+    user, error = authenticate_request(request)
+    if error:
+        return error
+
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST method allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
+
+    try:
+        sub_requests, atomic = clean_batch(json.loads(request.body))
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=HTTPStatus.BAD_REQUEST)
+    except BatchError as e:
+        return JsonResponse({'error': str(e)}, status=HTTPStatus.BAD_REQUEST)
+
+    responses, rolled_back = run_batch(request, user, sub_requests, atomic)
+    return JsonResponse({
+        'responses': responses,
+        'rolled_back': rolled_back
+    }, status=HTTPStatus.OK)
+
+
+def _event_stream_user(request):
+    # Browsers' EventSource can't send headers, so the token may also be
+    # passed as ?token=
+    token = request.GET.get('token')
+    if token and 'Authorization' not in request.headers:
+        return _user_for_token('Bearer' if token.count('.') == 2 else 'Token', token)
+    return authenticate_request(request)
+
+
+@csrf_exempt
+async def events(request):
+    """Server-Sent Events stream of the user's todo and folder changes.
+
+    Needs the ASGI server (project1/asgi.py); under WSGI every open stream
+    would tie up a worker.
+    """
+    user, error = await sync_to_async(_event_stream_user)(request)
+    if error:
+        return error
+
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Only GET method allowed'}, status=HTTPStatus.METHOD_NOT_ALLOWED)
 
-    return JsonResponse({'error': 'Method not allowed'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
\ No newline at end of file
+    response = StreamingHttpResponse(event_stream(subscribe_events(user.id)), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,28 @@
+"""Gunicorn settings for the web service (read from the working directory).
+
+The application is imported once in the master and workers are forked from
+it, so a new or restarted worker is serving within milliseconds and shares
+the imported code with its siblings. Importing the app opens no database
+connection and starts no thread (the event listener starts on the first
+stream), which is what makes preloading safe.
+"""
+import importlib
+
+preload_app = True
+
+# Imported lazily by the app so management commands start fast (see
+# Register/tokens.py); every web worker needs them, so load them once here
+PRELOAD_MODULES = [
+    'rest_framework_simplejwt.settings',
+    'rest_framework_simplejwt.tokens',
+]
+
+
+def when_ready(server):
+    from django.db import connections
+
+    for module in PRELOAD_MODULES:
+        importlib.import_module(module)
+    # A connection opened in the master would be shared by every forked
+    # worker; close anything opened while loading before forking
+    connections.close_all()
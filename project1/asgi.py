@@ -3,14 +3,40 @@ ASGI config for project1 project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The web service runs this application under gunicorn's uvicorn worker so the
+Server-Sent Events stream (``auth/events/``) can keep thousands of idle
+connections open as coroutines; ordinary views still run in Django's sync
+thread pool. With several workers, set EVENTS_BACKEND to
+``Register.events.PostgresEventBackend`` so events reach every worker.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.core.handlers.asgi import ASGIHandler
+from django.urls import reverse
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project1.settings')
+django.setup(set_prefix=False)
+
+
+class TaskManagerASGIHandler(ASGIHandler):
+    def __init__(self):
+        super().__init__()
+        self.events_path = reverse('events')
+
+    async def __call__(self, scope, receive, send):
+        # Django gives every request its own thread for sync code (middleware,
+        # signals) that lives until the response ends. Event streams skip it,
+        # so that short sync work runs on the shared thread and an idle
+        # stream costs no thread at all.
+        if scope['type'] == 'http' and scope['path'] == self.events_path:
+            await self.handle(scope, receive, send)
+        else:
+            await super().__call__(scope, receive, send)
+
 
-application = get_asgi_application()
+application = TaskManagerASGIHandler()
@@ -0,0 +1,150 @@
+"""Liveness and readiness probes.
+
+``/health/live/`` (and the older ``/health/``) only says the process can
+answer requests. ``/health/ready/`` also checks what serving traffic needs:
+
+* database: a ``SELECT 1`` round trip on this worker's connection,
+* migrations: every migration on disk is recorded as applied, on default
+  and on every shard,
+* shards: a ``SELECT 1`` on every other database holding user data,
+* connections: how close PostgreSQL is to ``max_connections`` (at most
+  ``degraded``, since the count covers the whole server).
+
+Results are cached in the process for ``HEALTH_CHECK_CACHE_TTL`` seconds, so
+a load balancer probing every second costs at most a few small queries per
+worker per TTL. Slow but working dependencies are reported as ``degraded``
+with their timings and keep the worker in rotation; only ``failing`` checks
+answer 503.
+"""
+import threading
+import time
+from http import HTTPStatus
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.recorder import MigrationRecorder
+from django.http import JsonResponse
+
+OK, DEGRADED, FAILING = 'ok', 'degraded', 'failing'
+_SEVERITY = {OK: 0, DEGRADED: 1, FAILING: 2}
+
+_lock = threading.Lock()
+_cached = None
+_migration_nodes = None
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _timed(check):
+    started = time.perf_counter()
+    try:
+        result = check()
+    except Exception as e:
+        result = {'status': FAILING, 'error': str(e)}
+    result['duration_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+def check_database(using=DEFAULT_DB_ALIAS):
+    started = time.perf_counter()
+    with connections[using].cursor() as cursor:
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+    latency = time.perf_counter() - started
+    slow = latency > _setting('HEALTH_DB_LATENCY_WARNING', 0.25)
+    return {'status': DEGRADED if slow else OK, 'latency_ms': round(latency * 1000, 2)}
+
+
+def _pending_migrations(using):
+    global _migration_nodes
+    if _migration_nodes is None:
+        # The migration files can't change while the process runs; only the
+        # applied set is read on each check
+        _migration_nodes = set(MigrationLoader(None, ignore_no_migrations=True).graph.nodes)
+    applied = MigrationRecorder(connections[using]).applied_migrations()
+    return sorted(f'{app}.{name}' for app, name in _migration_nodes - set(applied))
+
+
+def check_migrations():
+    # ``migrate`` without --database only covers default; an unmigrated
+    # shard fails every request of the users placed on it
+    pending = {}
+    for alias in _setting('SHARDS', [DEFAULT_DB_ALIAS]):
+        if names := _pending_migrations(alias):
+            pending[alias] = names
+    return {'status': FAILING if pending else OK, 'pending': pending}
+
+
+def check_connections(using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return {'status': OK, 'skipped': f'not available on {connection.vendor}'}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*), current_setting('max_connections')::int, "
+            "current_setting('superuser_reserved_connections')::int FROM pg_stat_activity"
+        )
+        used, max_connections, reserved = cursor.fetchone()
+    usage = used / max(max_connections - reserved, 1)
+    # Never failing: the count is server-wide (other workers, instances and
+    # clients), so a 503 here would take every instance out at once
+    state = DEGRADED if usage >= _setting('HEALTH_CONNECTIONS_WARNING', 0.8) else OK
+    return {'status': state, 'used': used, 'available': max_connections - reserved, 'usage': round(usage, 3)}
+
+
+def check_shards():
+    results = {}
+    for alias in _setting('SHARDS', [DEFAULT_DB_ALIAS]):
+        if alias != DEFAULT_DB_ALIAS:
+            try:
+                results[alias] = check_database(alias)
+            except Exception as e:
+                results[alias] = {'status': FAILING, 'error': str(e)}
+    if not results:
+        return {'status': OK, 'skipped': 'no shards configured'}
+    overall = max((result['status'] for result in results.values()), key=_SEVERITY.get)
+    return {'status': overall, 'shards': results}
+
+
+CHECKS = {
+    'database': check_database,
+    'migrations': check_migrations,
+    'shards': check_shards,
+    'connections': check_connections,
+}
+
+
+def run_checks():
+    checks = {}
+    for name, check in CHECKS.items():
+        checks[name] = _timed(check)
+        if name == 'database' and checks[name]['status'] == FAILING:
+            # The remaining checks need the same database
+            break
+    overall = max((result['status'] for result in checks.values()), key=_SEVERITY.get)
+    return {'status': overall, 'checked_at': time.time(), 'checks': checks}
+
+
+def readiness():
+    """Cached result of ``run_checks``; concurrent probes share one run."""
+    global _cached
+    ttl = _setting('HEALTH_CHECK_CACHE_TTL', 5)
+    with _lock:
+        stale = _cached is None or time.time() - _cached['checked_at'] >= ttl
+        if stale:
+            _cached = run_checks()
+        result = _cached
+    return {**result, 'cached': not stale}
+
+
+def live(request):
+    return JsonResponse({'status': OK})
+
+
+def ready(request):
+    result = readiness()
+    code = HTTPStatus.SERVICE_UNAVAILABLE if result['status'] == FAILING else HTTPStatus.OK
+    return JsonResponse(result, status=code)
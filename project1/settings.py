@@ -31,9 +31,8 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     
-    # Third-party apps
-    'rest_framework',
-    'rest_framework_simplejwt',
+    # Third-party apps. simplejwt is used as a library (Register/tokens.py);
+    # installing it as an app only imports django.test at every startup.
     'corsheaders',
     
     # Local apps
@@ -51,6 +50,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'Register.sharding.shard_middleware',
 ]
 
 ROOT_URLCONF = 'project1.urls'
@@ -74,13 +74,33 @@ TEMPLATES = [
 WSGI_APPLICATION = 'project1.wsgi.application'
 
 # Database Configuration
+# Under ASGI every request's sync code runs on a new thread, so a persistent
+# connection would never be reused, only leaked until it times out; Django
+# recommends disabling them there. Put a pooler (e.g. PgBouncer) in front
+# of PostgreSQL instead if connection setup shows up in latency.
+CONN_MAX_AGE = int(os.getenv('CONN_MAX_AGE', 0))
 DATABASES = {
     'default': dj_database_url.config(
         default=os.getenv('DATABASE_URL'),
-        conn_max_age=600,
+        conn_max_age=CONN_MAX_AGE,
         ssl_require=False
     )
 }
+
+# Users' folders and todos are spread over the default database and the
+# shards listed in DATABASE_SHARD_URLS (comma-separated; aliases shard1,
+# shard2, ...); users and the shard directory stay in default. See
+# Register/sharding.py. Deploys migrate them all with ``migrate_shards``.
+# The sharding tests need two shards and are skipped without them, e.g.
+# DATABASE_SHARD_URLS=sqlite:///shard1.sqlite3,sqlite:///shard2.sqlite3
+SHARD_URLS = [url for url in os.getenv('DATABASE_SHARD_URLS', '').split(',') if url]
+for n, url in enumerate(SHARD_URLS, start=1):
+    DATABASES[f'shard{n}'] = dj_database_url.parse(url, conn_max_age=CONN_MAX_AGE)
+SHARDS = ['default', *(f'shard{n}' for n in range(1, len(SHARD_URLS) + 1))]
+DATABASE_ROUTERS = ['Register.sharding.ShardRouter']
+# How long a process trusts its cached copy of a user's directory entry;
+# move_user_shard waits this long before copying
+SHARD_DIRECTORY_CACHE_TTL = int(os.getenv('SHARD_DIRECTORY_CACHE_TTL', 30))
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -114,22 +134,66 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Custom user model
 AUTH_USER_MODEL = 'Register.CustomUser'
 
-# REST Framework settings
-REST_FRAMEWORK = {
-    'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    ),
-    'DEFAULT_PERMISSION_CLASSES': (
-        'rest_framework.permissions.IsAuthenticated',
-    ),
-}
-
 # JWT settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
 }
 
+# How long a user's token version (see Register/tokens.py) is cached; a
+# logout reaches other processes within this many seconds
+TOKEN_VERSION_CACHE_TTL = int(os.getenv('TOKEN_VERSION_CACHE_TTL', 60))
+
+# Folder lock settings
+# Lifetime (seconds) of the unlock token returned by verify_folder_password
+FOLDER_UNLOCK_TOKEN_MAX_AGE = int(os.getenv('FOLDER_UNLOCK_TOKEN_MAX_AGE', 300))
+
+# Folders holding more todos than this are deleted in the background by
+# `manage.py process_folder_deletions`
+FOLDER_DELETE_SYNC_LIMIT = int(os.getenv('FOLDER_DELETE_SYNC_LIMIT', 1000))
+
+# Backend used by `manage.py run_reminder_scheduler` to deliver due-date
+# reminders (see Register/reminders.py)
+REMINDER_SENDER = os.getenv('REMINDER_SENDER', 'Register.reminders.ConsoleReminderSender')
+
+# Delivery of live change events to the auth/events/ stream (see
+# Register/events.py); use Register.events.PostgresEventBackend when more
+# than one process serves requests
+EVENTS_BACKEND = os.getenv('EVENTS_BACKEND', 'Register.events.LocalEventBackend')
+
+# Token-bucket limits for login/register attempts (Register/ratelimit.py).
+# Use the 'cache' backend when several processes serve requests and CACHES
+# points at a shared cache.
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'local')
+AUTH_RATE_LIMITS = {
+    'login_ip': os.getenv('LOGIN_IP_RATE_LIMIT', '30/m'),
+    'login_email': os.getenv('LOGIN_EMAIL_RATE_LIMIT', '10/m'),
+    'register_ip': os.getenv('REGISTER_IP_RATE_LIMIT', '10/h'),
+    'register_email': os.getenv('REGISTER_EMAIL_RATE_LIMIT', '5/h'),
+}
+# Reverse proxies in front of the app that append to X-Forwarded-For
+NUM_PROXIES = int(os.getenv('NUM_PROXIES', 0))
+# Shared secret for scraping /metrics/ (Authorization: Bearer ...); the
+# endpoint is disabled while unset
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# How long responses stored for Idempotency-Key replays are kept (seconds)
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', 24 * 3600))
+
+# Readiness probe (project1/health.py): results are cached per process for
+# HEALTH_CHECK_CACHE_TTL seconds; a slower SELECT 1 or a larger share of
+# PostgreSQL's connection slots in use is reported as degraded
+HEALTH_CHECK_CACHE_TTL = float(os.getenv('HEALTH_CHECK_CACHE_TTL', 5))
+HEALTH_DB_LATENCY_WARNING = float(os.getenv('HEALTH_DB_LATENCY_WARNING', 0.25))
+HEALTH_CONNECTIONS_WARNING = 0.8
+
+# Activity log (Register/activity.py): each worker buffers up to
+# ACTIVITY_BUFFER_SIZE entries and writes them ACTIVITY_FLUSH_SIZE rows at a
+# time, at least every ACTIVITY_FLUSH_INTERVAL seconds
+ACTIVITY_BUFFER_SIZE = int(os.getenv('ACTIVITY_BUFFER_SIZE', 10000))
+ACTIVITY_FLUSH_SIZE = int(os.getenv('ACTIVITY_FLUSH_SIZE', 200))
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv('ACTIVITY_FLUSH_INTERVAL', 2))
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3001",
@@ -148,6 +212,8 @@ CORS_ALLOW_CREDENTIALS = True
 if not DEBUG:
     SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
     SECURE_SSL_REDIRECT = True
+    # Load balancer probes come in over plain HTTP
+    SECURE_REDIRECT_EXEMPT = [r'^health/']
     SESSION_COOKIE_SECURE = True
     CSRF_COOKIE_SECURE = True
     SECURE_BROWSER_XSS_FILTER = True
@@ -16,15 +16,27 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, Http404
+from django.utils.crypto import constant_time_compare
+from Register import metrics as app_metrics
+from . import health
 
-def health_check(request):
-    return JsonResponse({"status": "ok"})
+def metrics(request):
+    # Prometheus text format, only for scrapers holding METRICS_TOKEN
+    expected = getattr(settings, 'METRICS_TOKEN', None)
+    provided = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not expected or not constant_time_compare(provided, expected):
+        raise Http404
+    return HttpResponse(app_metrics.render(), content_type='text/plain; version=0.0.4')
 
 urlpatterns = [
     path('', include('app1.urls')),
     path('auth/', include('Register.urls')),
-    path('health/', health_check),
+    path('health/', health.live),
+    path('health/live/', health.live),
+    path('health/ready/', health.ready),
+    path('metrics/', metrics),
     path('portfolio/', include('portfolio.urls')),
     path('admin/', admin.site.urls),
 